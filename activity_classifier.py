@@ -0,0 +1,107 @@
+"""
+Map rendered Activity Description strings back to their templates.
+
+The index is built from the template registry (and so from the generators'
+own tables). Templates without placeholders are found with one dict lookup.
+The others are indexed by their leading literal: a description is checked
+against each distinct prefix length, and only the templates whose prefix
+matches are verified segment by segment, most specific (longest literal
+text) first, extracting the placeholder values on the way.
+
+classify_batch factorizes its input first, so each distinct description is
+classified once and the results are broadcast back with NumPy.
+"""
+import functools
+
+class ActivityClassifier:
+    """Literal-prefix index over a TemplateRegistry"""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.exact = {}
+        self.by_prefix = {}
+        for template in registry.templates:
+            if not template.fields:
+                self.exact.setdefault(template.literals[0], template)
+            else:
+                self.by_prefix.setdefault(template.literals[0], []).append(template)
+        # Most specific first, so "{}°C to {}°C" wins over "{} to {}"
+        for candidates in self.by_prefix.values():
+            candidates.sort(key=lambda t: -sum(len(literal) for literal in t.literals))
+        self.prefix_lengths = sorted({len(prefix) for prefix in self.by_prefix}, reverse=True)
+
+    def classify(self, description):
+        """Return (template, slot strings) for one description, or (None, ())"""
+        template = self.exact.get(description)
+        if template is not None:
+            return template, ()
+        for length in self.prefix_lengths:
+            candidates = self.by_prefix.get(description[:length])
+            if candidates is None:
+                continue
+            for template in candidates:
+                slots = _extract_slots(description, template.literals)
+                if slots is not None:
+                    return template, slots
+        return None, ()
+
+    def classify_batch(self, descriptions):
+        """
+        Classify an array-like of descriptions. Returns a dict of arrays:
+        activity_id (registry activity index, -1 if unknown), template_id
+        (-1 if unknown) and value1/value2 (numeric placeholder values, NaN
+        when absent or not numeric)
+        """
+        import numpy as np
+        import pandas as pd
+        codes, uniques = pd.factorize(np.asarray(descriptions, dtype=object))
+        activity_ids = np.full(len(uniques), -1, dtype=np.int16)
+        template_ids = np.full(len(uniques), -1, dtype=np.int16)
+        values = np.full((len(uniques), 2), np.nan)
+        activity_index = self.registry.activity_index
+
+        for i, description in enumerate(uniques):
+            template, slots = self.classify(description)
+            if template is None:
+                continue
+            template_ids[i] = template.template_id
+            activity_ids[i] = activity_index[template.activity_type]
+            for j, slot in enumerate(slots[:2]):
+                values[i, j] = to_number(slot)
+
+        return {
+            'activity_id': activity_ids[codes],
+            'template_id': template_ids[codes],
+            'value1': values[codes, 0],
+            'value2': values[codes, 1]
+        }
+
+def _extract_slots(description, literals):
+    """Placeholder values if description fits the literal segments, else None"""
+    position = len(literals[0])
+    last = len(literals) - 1
+    slots = []
+    for i, literal in enumerate(literals[1:], 1):
+        if i == last:
+            end = len(description) - len(literal)
+            if end <= position or not description.endswith(literal):
+                return None
+        else:
+            end = description.find(literal, position + 1)
+            if end < 0:
+                return None
+        slots.append(description[position:end])
+        position = end + len(literal)
+    return tuple(slots)
+
+def to_number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return float('nan')
+
+@functools.lru_cache(maxsize=None)
+def get_classifier():
+    """Classifier over the shared template registry (built once per process)"""
+    from templates import get_registry
+    return ActivityClassifier(get_registry())
@@ -0,0 +1,178 @@
+"""
+Rule-based anomaly scoring for audit logs.
+
+    python anomaly_scorer.py audit_logs_with_anomalies.csv
+    python anomaly_scorer.py enhanced_audit_logs1.5k.csv --output scored.csv
+
+Every rule is a vectorized check over the whole log, built from what the
+generators already define as normal: the parameter ranges of augmentation.py
+(widened by the adjustment drift of incorrect_augmentation.py), the opening
+and closing of a batch, and the step order of demo.CORRECT_SEQUENCE. demo's
+modify_parameter draws its values from ranges beyond these, so they fall out
+as out of range.
+
+Rows are grouped into sequences per user (and per variant_id when present):
+a login starts a new sequence. Each row's score is the largest weight among
+the rules it breaks, 0 when it breaks none.
+"""
+import argparse
+import sys
+
+# Rule name -> score of a row that breaks it
+RULE_WEIGHTS = {
+    'out_of_range': 1.0,
+    'batch_deletion': 1.0,
+    'unexpected_action': 1.0,
+    'logout_before_batch_end': 0.9,
+    'duplicate_solution_change': 0.8,
+    'alarm': 0.7,
+    'step_reordered': 0.6,
+    'unrecognized': 0.5
+}
+
+def normal_ranges():
+    """(low, high) of the placeholder values for each parameter-adjusting activity type"""
+    from augmentation import TEMP_RANGE, SPRAY_RATE_RANGE, DRUM_SPEED_RANGE
+    from incorrect_augmentation import AuditLogGenerator, ADJUSTMENT_TYPES, ADJUSTMENT_DRIFT
+
+    ranges = {
+        'temp_adjust': TEMP_RANGE,
+        'spray_adjust': SPRAY_RATE_RANGE,
+        'drum_speed': DRUM_SPEED_RANGE
+    }
+    for param, low, high in AuditLogGenerator().normal_adjustments:
+        activity_type = ADJUSTMENT_TYPES[param]
+        # The generator rounds its values to one decimal
+        low, high = round(low - ADJUSTMENT_DRIFT, 1), round(high + ADJUSTMENT_DRIFT, 1)
+        if activity_type in ranges:
+            low, high = min(low, ranges[activity_type][0]), max(high, ranges[activity_type][1])
+        ranges[activity_type] = (low, high)
+    return ranges
+
+def _sequence_ids(df, is_login):
+    """Sequence number of every row: per user (and variant), a login starts a new one"""
+    import numpy as np
+    import pandas as pd
+    owner = pd.factorize(df['User'])[0].astype(np.int64)
+    if 'variant_id' in df:
+        owner = pd.factorize(df['variant_id'].to_numpy() * (owner.max() + 1) + owner)[0]
+    logins = pd.Series(is_login).groupby(owner).cumsum().to_numpy()
+    return pd.factorize(logins * (owner.max() + 1) + owner)[0]
+
+def _reordered(steps, sequence_ids):
+    """Both rows of every adjacent pair whose steps run backwards"""
+    import pandas as pd
+    steps = pd.Series(steps)
+    backwards = (steps > steps.groupby(sequence_ids).shift(-1)).to_numpy()
+    after_backwards = pd.Series(backwards).groupby(sequence_ids).shift(fill_value=False).to_numpy(dtype=bool)
+    return backwards | after_backwards
+
+def rule_hits(df, reference=None):
+    """
+    One boolean column per rule in RULE_WEIGHTS. reference is the expected
+    step order as (activity type, template) pairs, demo.CORRECT_SEQUENCE by
+    default; pass () to skip the step order check
+    """
+    import numpy as np
+    import pandas as pd
+    from activity_classifier import get_classifier
+
+    classifier = get_classifier()
+    registry = classifier.registry
+    classified = classifier.classify_batch(df['Activity Description'])
+    activity_ids, template_ids = classified['activity_id'], classified['template_id']
+    index = registry.activity_index
+
+    def rows_of(activity_type):
+        return activity_ids == index[activity_type]
+
+    is_logout, is_batch_end, is_solution_change = rows_of('logout'), rows_of('batch_end'), rows_of('solution_change')
+    sequence_ids = _sequence_ids(df, rows_of('login'))
+    hits = {}
+
+    # Placeholder values outside the normal range of their activity type
+    low = np.full(len(registry.activity_types) + 1, np.nan)
+    high = np.full(len(registry.activity_types) + 1, np.nan)
+    for activity_type, (range_low, range_high) in normal_ranges().items():
+        low[index[activity_type]], high[index[activity_type]] = range_low, range_high
+    row_low, row_high = low[activity_ids], high[activity_ids]
+    hits['out_of_range'] = ((classified['value1'] < row_low) | (classified['value1'] > row_high) |
+                            (classified['value2'] < row_low) | (classified['value2'] > row_high))
+
+    hits['batch_deletion'] = rows_of('batch_deletion')
+    hits['unexpected_action'] = rows_of('unexpected_action')
+
+    # A logout followed by the batch end of the same sequence flags both rows
+    logouts_before = pd.Series(is_logout).groupby(sequence_ids).cumsum().to_numpy() - is_logout
+    batch_ends = pd.Series(is_batch_end).groupby(sequence_ids)
+    batch_ends_after = (batch_ends.transform('sum') - batch_ends.cumsum()).to_numpy()
+    hits['logout_before_batch_end'] = (is_batch_end & (logouts_before > 0)) | (is_logout & (batch_ends_after > 0))
+
+    solution_changes = pd.Series(is_solution_change).groupby(sequence_ids).transform('sum').to_numpy()
+    hits['duplicate_solution_change'] = is_solution_change & (solution_changes > 1)
+
+    hits['alarm'] = rows_of('alarm_resolved') | rows_of('alarm_acknowledged')
+
+    # Step order is only checked for sequences written from the reference
+    # itself; the other generators shuffle their middle activities by design
+    if reference is None:
+        from demo import CORRECT_SEQUENCE
+        reference = CORRECT_SEQUENCE
+    step_of_template = np.full(len(registry.templates) + 1, np.nan)
+    for step, (_, text) in enumerate(reference):
+        step_of_template[registry.lookup(text).template_id] = step
+    steps = step_of_template[template_ids]
+    off_reference = np.isnan(steps) & ~hits['unexpected_action']
+    checked = ~pd.Series(off_reference).groupby(sequence_ids).transform('any').to_numpy() & ~np.isnan(steps)
+    reordered = np.zeros(len(df), dtype=bool)
+    if len(reference) and checked.any():
+        reordered[checked] = _reordered(steps[checked], sequence_ids[checked])
+    hits['step_reordered'] = reordered
+
+    hits['unrecognized'] = template_ids < 0
+    return pd.DataFrame(hits, index=df.index)[list(RULE_WEIGHTS)]
+
+def score_audit_logs(df, reference=None, keep_rules=False):
+    """
+    Return df with an 'Anomaly Score' column in [0, 1]; with keep_rules the
+    per-rule boolean columns are added as well
+    """
+    import numpy as np
+    hits = rule_hits(df, reference)
+    weights = np.array([RULE_WEIGHTS[rule] for rule in hits.columns])
+    scores = (hits.to_numpy() * weights).max(axis=1, initial=0.0)
+    df = df.assign(**{'Anomaly Score': scores})
+    if keep_rules:
+        df = df.join(hits)
+    return df
+
+def main(argv=None):
+    from output_formats import format_for_path, read_audit_logs, write_audit_logs
+    parser = argparse.ArgumentParser(description="Score audit logs with the rule-based anomaly checks")
+    parser.add_argument('input', help="audit log file (csv, parquet or arrow)")
+    parser.add_argument('--output', default=None, help="write the scored log here (CSV)")
+    parser.add_argument('--threshold', type=float, default=0.5, help="score at which a row counts as flagged")
+    args = parser.parse_args(argv)
+    if args.output and format_for_path(args.output) != 'csv':
+        parser.error("--output needs a CSV file, the columnar layout has no Anomaly Score column")
+
+    df = read_audit_logs(args.input)
+    scored = score_audit_logs(df, keep_rules=True)
+    for rule in RULE_WEIGHTS:
+        print(f"{rule:<28} {int(scored[rule].sum()):>8,} rows")
+
+    if 'Anomaly' in scored:
+        # Agreement with the generators' own labels
+        flagged = scored['Anomaly Score'].to_numpy() >= args.threshold
+        labeled = scored['Anomaly'].astype(str).to_numpy() != '0'
+        true_positives = int((flagged & labeled).sum())
+        print(f"precision {true_positives / max(flagged.sum(), 1):.3f}  "
+              f"recall {true_positives / max(labeled.sum(), 1):.3f}")
+
+    if args.output:
+        write_audit_logs(scored.drop(columns=list(RULE_WEIGHTS)), args.output)
+        print(f"Saved scored logs to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,230 +1,411 @@
-import pandas as pd
-from datetime import datetime, timedelta
-import random
+from datetime import timedelta
+import profiling
+from seeding import numpy_rng, python_rng
+from output_formats import AuditLogWriter
+from events import AuditEventBatch, AuditEventBuilder, epoch_seconds
 
-def generate_normal_audit_logs(num_sequences=50):
+# Define expanded activities with multiple variations
+ACTIVITY_VARIATIONS = {
+    'login': [
+        'User logged into the system',
+        'Started shift with system login',
+        'Initiated system access',
+        'Completed authentication process',
+        'Logged in for scheduled shift'
+    ],
+    'batch_prep': [
+        'Loaded recipe for batch #{}',
+        'Initialized production recipe #{}',
+        'Prepared manufacturing formula for batch #{}',
+        'Set up batch #{} parameters',
+        'Configured system for batch #{}'
+    ],
+    'equipment_check': [
+        'Initiated pre-operation equipment check',
+        'Performed equipment validation check',
+        'Completed machinery safety inspection',
+        'Conducted standard equipment verification',
+        'Executed pre-batch equipment diagnostic'
+    ],
+    'calibration': [
+        'Verified calibration of scales',
+        'Performed sensor calibration check',
+        'Validated measurement systems',
+        'Completed instrument calibration',
+        'Checked and verified all gauges',
+        'Calibrated pressure sensors',
+        'Verified temperature probes'
+    ],
+    'batch_start': [
+        'Started coating process for batch #{}',
+        'Initiated production of batch #{}',
+        'Began manufacturing sequence for #{}',
+        'Commenced batch #{} processing',
+        'Launched production run #{}'
+    ],
+    'process_monitoring': [
+        'Monitored coating uniformity',
+        'Checked product consistency',
+        'Verified process parameters',
+        'Assessed coating thickness',
+        'Evaluated product quality metrics'
+    ],
+    'temp_adjust': [
+        'Adjusted inlet air temperature from {}°C to {}°C',
+        'Modified process temperature {}°C to {}°C',
+        'Regulated air temperature: {}°C to {}°C',
+        'Adjusted heating parameters {}°C to {}°C',
+        'Fine-tuned temperature from {}°C to {}°C'
+    ],
+    'spray_adjust': [
+        'Adjusted spray rate from {} mL/min to {} mL/min',
+        'Modified coating flow rate {} to {} mL/min',
+        'Changed spray parameters {} to {} mL/min',
+        'Updated liquid flow rate {} to {} mL/min',
+        'Regulated spray speed {} to {} mL/min'
+    ],
+    'environmental_check': [
+        'Checked humidity levels',
+        'Monitored room conditions',
+        'Verified environmental parameters',
+        'Assessed ambient conditions',
+        'Recorded environmental metrics'
+    ],
+    'quality_check': [
+        'Performed intermediate quality check',
+        'Conducted in-process testing',
+        'Executed quality verification',
+        'Completed quality assessment',
+        'Performed product inspection'
+    ],
+    'drum_speed': [
+        'Adjusted drum speed from {} RPM to {} RPM',
+        'Modified rotation rate {} to {} RPM',
+        'Changed drum velocity {} to {} RPM',
+        'Updated rotation speed {} to {} RPM',
+        'Regulated drum RPM {} to {}'
+    ],
+    'solution_change': [
+        'Changed coating solution to type {}',
+        'Switched to solution variant {}',
+        'Modified coating material to type {}',
+        'Updated coating compound to {}',
+        'Transitioned to solution {}'
+    ],
+    'documentation': [
+        'Updated batch records',
+        'Documented process parameters',
+        'Recorded manufacturing data',
+        'Completed batch documentation',
+        'Updated electronic batch record'
+    ],
+    'maintenance': [
+        'Performed routine equipment cleaning',
+        'Conducted scheduled maintenance',
+        'Completed equipment sanitization',
+        'Executed standard cleaning procedure',
+        'Performed equipment maintenance check'
+    ],
+    'batch_end': [
+        'Stopped coating process for batch #{}',
+        'Completed production of batch #{}',
+        'Finalized batch #{} processing',
+        'Concluded manufacturing of batch #{}',
+        'Ended production sequence #{}'
+    ],
+    'logout': [
+        'Logged out of system',
+        'Completed system logout',
+        'Ended user session',
+        'Finished shift and logged out',
+        'Terminated system access'
+    ]
+}
+
+# Define normal parameter ranges
+TEMP_RANGE = (145, 155)
+SPRAY_RATE_RANGE = (8, 15)
+DRUM_SPEED_RANGE = (12, 19)
+SOLUTION_TYPES = ['A', 'B', 'C', 'D', 'E']
+USERS = ['user123', 'user456', 'user789', 'Sarah Johnson', 'Mark Wilson', 'Emily Davis',
+         'Chris Wilson', 'Emily Chen', 'David Kim', 'Michael Brown', 'Lisa Anderson']
+
+# Define variable time intervals for different activities
+TIME_INTERVALS = {
+    'login': (2, 5),
+    'batch_prep': (10, 20),
+    'equipment_check': (15, 25),
+    'calibration': (10, 15),
+    'batch_start': (5, 10),
+    'process_monitoring': (5, 15),
+    'temp_adjust': (3, 8),
+    'spray_adjust': (3, 8),
+    'environmental_check': (5, 10),
+    'quality_check': (15, 30),
+    'drum_speed': (3, 8),
+    'solution_change': (10, 20),
+    'documentation': (5, 15),
+    'maintenance': (20, 40),
+    'batch_end': (10, 15),
+    'logout': (2, 5)
+}
+
+# Placeholder values of each activity type: the batch number, a (from, to)
+# adjustment within a range moving at most max_step, or one of some choices
+ACTIVITY_PARAMETERS = {
+    'batch_prep': 'batch',
+    'batch_start': 'batch',
+    'batch_end': 'batch',
+    'temp_adjust': {'range': TEMP_RANGE, 'max_step': 2},
+    'spray_adjust': {'range': SPRAY_RATE_RANGE, 'max_step': 2},
+    'drum_speed': {'range': DRUM_SPEED_RANGE, 'max_step': 2},
+    'solution_change': {'choices': SOLUTION_TYPES}
+}
+
+# Activity order: fixed opening, shuffled middle, fixed closing
+BASE_SEQUENCE = ['login', 'batch_prep', 'equipment_check', 'calibration', 'batch_start']
+MIDDLE_ACTIVITIES = ['process_monitoring', 'temp_adjust', 'spray_adjust', 'environmental_check',
+                     'quality_check', 'drum_speed', 'solution_change', 'documentation']
+MIN_MIDDLE = 5
+END_SEQUENCE = ['maintenance', 'batch_end', 'logout']
+
+# Sequence n runs on START_DATE + n days from START_TIME, for batch n + 1
+START_DATE = '2024-08-27'
+START_TIME = '08:00:00'
+BATCH_NUMBER_FORMAT = '{:03d}'
+
+
+def generate_normal_audit_logs(num_sequences=50, vectorized=False, first_sequence=0, rng=None, render=True,
+                               scenario=None):
     """
-    Generate synthetic audit logs with enhanced variety and realistic timing
+    Generate synthetic audit logs with enhanced variety and realistic timing.
+    first_sequence offsets the batch numbers and dates, so consecutive chunks
+    of a larger dataset line up. rng is a seed or RNG instance (random.Random
+    or numpy.random.Generator, either path accepts both); None uses the
+    global random state.
+    render=False keeps template IDs and parameters instead of description
+    strings; the output writers render them.
+    scenario is a spec file, parsed spec or scenario.Scenario to take the
+    tables from instead of this module's
     """
-    # Define expanded activities with multiple variations
-    activity_variations = {
-        'login': [
-            'User logged into the system',
-            'Started shift with system login',
-            'Initiated system access',
-            'Completed authentication process',
-            'Logged in for scheduled shift'
-        ],
-        'batch_prep': [
-            'Loaded recipe for batch #{}',
-            'Initialized production recipe #{}',
-            'Prepared manufacturing formula for batch #{}',
-            'Set up batch #{} parameters',
-            'Configured system for batch #{}'
-        ],
-        'equipment_check': [
-            'Initiated pre-operation equipment check',
-            'Performed equipment validation check',
-            'Completed machinery safety inspection',
-            'Conducted standard equipment verification',
-            'Executed pre-batch equipment diagnostic'
-        ],
-        'calibration': [
-            'Verified calibration of scales',
-            'Performed sensor calibration check',
-            'Validated measurement systems',
-            'Completed instrument calibration',
-            'Checked and verified all gauges',
-            'Calibrated pressure sensors',
-            'Verified temperature probes'
-        ],
-        'batch_start': [
-            'Started coating process for batch #{}',
-            'Initiated production of batch #{}',
-            'Began manufacturing sequence for #{}',
-            'Commenced batch #{} processing',
-            'Launched production run #{}'
-        ],
-        'process_monitoring': [
-            'Monitored coating uniformity',
-            'Checked product consistency',
-            'Verified process parameters',
-            'Assessed coating thickness',
-            'Evaluated product quality metrics'
-        ],
-        'temp_adjust': [
-            'Adjusted inlet air temperature from {}°C to {}°C',
-            'Modified process temperature {}°C to {}°C',
-            'Regulated air temperature: {}°C to {}°C',
-            'Adjusted heating parameters {}°C to {}°C',
-            'Fine-tuned temperature from {}°C to {}°C'
-        ],
-        'spray_adjust': [
-            'Adjusted spray rate from {} mL/min to {} mL/min',
-            'Modified coating flow rate {} to {} mL/min',
-            'Changed spray parameters {} to {} mL/min',
-            'Updated liquid flow rate {} to {} mL/min',
-            'Regulated spray speed {} to {} mL/min'
-        ],
-        'environmental_check': [
-            'Checked humidity levels',
-            'Monitored room conditions',
-            'Verified environmental parameters',
-            'Assessed ambient conditions',
-            'Recorded environmental metrics'
-        ],
-        'quality_check': [
-            'Performed intermediate quality check',
-            'Conducted in-process testing',
-            'Executed quality verification',
-            'Completed quality assessment',
-            'Performed product inspection'
-        ],
-        'drum_speed': [
-            'Adjusted drum speed from {} RPM to {} RPM',
-            'Modified rotation rate {} to {} RPM',
-            'Changed drum velocity {} to {} RPM',
-            'Updated rotation speed {} to {} RPM',
-            'Regulated drum RPM {} to {}'
-        ],
-        'solution_change': [
-            'Changed coating solution to type {}',
-            'Switched to solution variant {}',
-            'Modified coating material to type {}',
-            'Updated coating compound to {}',
-            'Transitioned to solution {}'
-        ],
-        'documentation': [
-            'Updated batch records',
-            'Documented process parameters',
-            'Recorded manufacturing data',
-            'Completed batch documentation',
-            'Updated electronic batch record'
-        ],
-        'maintenance': [
-            'Performed routine equipment cleaning',
-            'Conducted scheduled maintenance',
-            'Completed equipment sanitization',
-            'Executed standard cleaning procedure',
-            'Performed equipment maintenance check'
-        ],
-        'batch_end': [
-            'Stopped coating process for batch #{}',
-            'Completed production of batch #{}',
-            'Finalized batch #{} processing',
-            'Concluded manufacturing of batch #{}',
-            'Ended production sequence #{}'
-        ],
-        'logout': [
-            'Logged out of system',
-            'Completed system logout',
-            'Ended user session',
-            'Finished shift and logged out',
-            'Terminated system access'
-        ]
-    }
-
-    # Define normal parameter ranges
-    temp_range = (145, 155)
-    spray_rate_range = (8, 15)
-    drum_speed_range = (12, 19)
-    solution_types = ['A', 'B', 'C', 'D', 'E']
-    users = ['user123', 'user456', 'user789', 'Sarah Johnson', 'Mark Wilson', 'Emily Davis',
-             'Chris Wilson', 'Emily Chen', 'David Kim', 'Michael Brown', 'Lisa Anderson']
-
-    # Define variable time intervals for different activities
-    time_intervals = {
-        'login': (2, 5),
-        'batch_prep': (10, 20),
-        'equipment_check': (15, 25),
-        'calibration': (10, 15),
-        'batch_start': (5, 10),
-        'process_monitoring': (5, 15),
-        'temp_adjust': (3, 8),
-        'spray_adjust': (3, 8),
-        'environmental_check': (5, 10),
-        'quality_check': (15, 30),
-        'drum_speed': (3, 8),
-        'solution_change': (10, 20),
-        'documentation': (5, 15),
-        'maintenance': (20, 40),
-        'batch_end': (10, 15),
-        'logout': (2, 5)
-    }
-
-    synthetic_logs = []
+    events = generate_normal_audit_events(num_sequences, vectorized, first_sequence, rng, scenario)
+    return events.to_frame(render)
+
+def generate_normal_audit_events(num_sequences=50, vectorized=False, first_sequence=0, rng=None, scenario=None):
+    """The same logs as generate_normal_audit_logs, as an AuditEventBatch"""
+    from scenario import resolve_scenario
+    scenario = resolve_scenario(scenario)
+    generate = _generate_normal_audit_events_vectorized if vectorized else _generate_normal_audit_events
+    with profiling.stage('generate'):
+        events = generate(num_sequences, rng, first_sequence, scenario)
+    profiling.count('sequences', num_sequences)
+    profiling.count('events', len(events))
+    return events
+
+def _generate_normal_audit_events(num_sequences, rng=None, first_sequence=0, scenario=None):
+    """Row-at-a-time generation with a random-module style RNG"""
+    from scenario import resolve_scenario
+    from templates import get_registry
+    scenario = resolve_scenario(scenario)
+    template_id = get_registry().template_id
+    rng = python_rng(rng)
+    lines = scenario.lines
+
+    events = AuditEventBuilder()
 
     # Generate sequences
-    for seq in range(num_sequences):
+    for seq in range(first_sequence, first_sequence + num_sequences):
         # Set up sequence parameters
-        current_date = datetime.strptime('2024-08-27', '%Y-%m-%d') + timedelta(days=seq)
-        current_time = datetime.strptime('08:00:00', '%H:%M:%S')
-        current_user = random.choice(users)
-        batch_number = f"{seq+1:03d}"
-
-        # Base sequence of activities
-        base_sequence = ['login', 'batch_prep', 'equipment_check', 'calibration', 'batch_start']
-        
-        # Add random process monitoring and adjustments
-        middle_activities = ['process_monitoring', 'temp_adjust', 'spray_adjust', 'environmental_check', 
-                           'quality_check', 'drum_speed', 'solution_change', 'documentation']
-        
-        # Shuffle middle activities and select a random number of them
-        random.shuffle(middle_activities)
-        selected_middle = middle_activities[:random.randint(5, len(middle_activities))]
-        
-        # End sequence
-        end_sequence = ['maintenance', 'batch_end', 'logout']
-        
-        # Combine all activities
-        full_sequence = base_sequence + selected_middle + end_sequence
-
-        # Generate the sequence
-        for activity_type in full_sequence:
-            if activity_type in ['batch_prep', 'batch_start', 'batch_end']:
-                activity = random.choice(activity_variations[activity_type]).format(batch_number)
-            elif activity_type == 'temp_adjust':
-                temp1 = random.randint(*temp_range)
-                temp2 = min(max(temp1 + random.randint(-2, 2), temp_range[0]), temp_range[1])
-                activity = random.choice(activity_variations[activity_type]).format(temp1, temp2)
-            elif activity_type == 'spray_adjust':
-                rate1 = random.randint(*spray_rate_range)
-                rate2 = min(max(rate1 + random.randint(-2, 2), spray_rate_range[0]), spray_rate_range[1])
-                activity = random.choice(activity_variations[activity_type]).format(rate1, rate2)
-            elif activity_type == 'drum_speed':
-                speed1 = random.randint(*drum_speed_range)
-                speed2 = min(max(speed1 + random.randint(-2, 2), drum_speed_range[0]), drum_speed_range[1])
-                activity = random.choice(activity_variations[activity_type]).format(speed1, speed2)
-            elif activity_type == 'solution_change':
-                activity = random.choice(activity_variations[activity_type]).format(random.choice(solution_types))
+        line = lines[0] if len(lines) == 1 else rng.choices(lines, cum_weights=scenario.line_cum_weights)[0]
+        current_date = line.start_date + timedelta(days=seq)
+        current_time = line.start_time
+        current_user = rng.choice(line.users)
+        batch_number = line.batch_number_format.format(seq + 1)
+        start = epoch_seconds(current_date, current_time)
+        for activity, params, offset in draw_sequence(line, rng, batch_number):
+            events.append(start + offset * 60, current_user, template_id(activity), params)
+
+    return events.build()
+
+def draw_sequence(line, rng, batch_number):
+    """
+    One sequence of a production line as (description template, parameters,
+    minutes since the sequence start) rows, drawn with a random-module style RNG
+    """
+    # Shuffle middle activities and select a random number of them
+    middle_activities = list(line.middle)
+    rng.shuffle(middle_activities)
+    selected_middle = middle_activities[:rng.randint(line.min_middle, len(middle_activities))]
+
+    # Combine all activities
+    full_sequence = line.opening + selected_middle + line.closing
+
+    rows = []
+    minutes = 0
+    for activity_type in full_sequence:
+        parameter = line.parameters[activity_type]
+        if parameter == 'batch':
+            activity = line.choose_template(activity_type, rng)
+            params = (batch_number,)
+        elif parameter is None:
+            activity = line.choose_template(activity_type, rng)
+            params = ()
+        elif 'range' in parameter:
+            low, high = parameter['range']
+            step = parameter['max_step']
+            value1 = rng.randint(low, high)
+            value2 = min(max(value1 + rng.randint(-step, step), low), high)
+            activity = line.choose_template(activity_type, rng)
+            params = (value1, value2)
+        else:
+            activity = line.choose_template(activity_type, rng)
+            params = (rng.choice(parameter['choices']),)
+        rows.append((activity, params, minutes))
+
+        # Add realistic time interval based on activity type
+        min_time, max_time = line.intervals[activity_type]
+        minutes += rng.randint(min_time, max_time)
+    return rows
+
+def _generate_normal_audit_events_vectorized(num_sequences, rng=None, first_sequence=0, scenario=None):
+    """
+    NumPy-backed version of generate_normal_audit_events with the same
+    distributions. With several production lines, each sequence's line is
+    drawn first and every line generates its sequences in one batch
+    """
+    import numpy as np
+    from scenario import resolve_scenario
+    scenario = resolve_scenario(scenario)
+    rng = numpy_rng(rng)
+    sequences = np.arange(first_sequence, first_sequence + num_sequences)
+    if len(scenario.lines) == 1:
+        return _generate_line_events(scenario.lines[0], sequences, rng)[0]
+
+    line_weights = np.array(scenario.line_cum_weights, dtype=float)
+    line_of_sequence = np.searchsorted(line_weights, rng.random(num_sequences) * line_weights[-1], side='right')
+    batches, row_sequences = [], []
+    for i, line in enumerate(scenario.lines):
+        batch, rows = _generate_line_events(line, sequences[line_of_sequence == i], rng)
+        batches.append(batch)
+        row_sequences.append(rows)
+    # Back into sequence order; rows within a sequence keep their order
+    order = np.argsort(np.concatenate(row_sequences), kind='stable')
+    return AuditEventBatch.concat(batches).take(order)
+
+def _generate_line_events(line, sequences, rng):
+    """
+    Events of one production line for the given sequence numbers, and the
+    sequence number of every row. Activity orders, template choices,
+    parameters and time deltas are drawn as whole arrays per sequence-length
+    bucket, and timestamps come from a cumulative sum of the deltas
+    """
+    import numpy as np
+    from templates import get_registry
+    template_id = get_registry().template_id
+    num_sequences = len(sequences)
+
+    # Sequence lengths and the row offset at which each sequence starts
+    num_middle = rng.integers(line.min_middle, len(line.middle) + 1, size=num_sequences)
+    lengths = len(line.opening) + num_middle + len(line.closing)
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    total = int(lengths.sum())
+
+    type_col = np.empty(total, dtype=np.int64)
+    seq_col = np.empty(total, dtype=np.int64)
+    minutes_col = np.empty(total, dtype=np.int64)
+
+    # One bucket per sequence length, so every draw in it is a 2-D array
+    with profiling.stage('generate.layout'):
+        for k in np.unique(num_middle):
+            seqs = np.flatnonzero(num_middle == k)
+            n = len(seqs)
+            shuffled = np.argsort(rng.random((n, len(line.middle))), axis=1)[:, :k]
+            types = np.hstack([np.broadcast_to(line.opening_ids, (n, len(line.opening_ids))),
+                               line.middle_ids[shuffled],
+                               np.broadcast_to(line.closing_ids, (n, len(line.closing_ids)))])
+            deltas = rng.integers(line.interval_lo[types], line.interval_hi[types] + 1)
+            rows = offsets[seqs][:, None] + np.arange(types.shape[1])
+            type_col[rows] = types
+            seq_col[rows] = seqs[:, None]
+            # Each row starts after the intervals of all the rows before it
+            minutes_col[rows] = np.cumsum(deltas, axis=1) - deltas
+
+    with profiling.stage('generate.templates'):
+        template_ids = np.array([template_id(text) for _, text in line.templates], dtype=np.uint16)
+        template_col = template_ids[line.sample_templates(type_col, rng)]
+
+    # Placeholder values as IDs into one table of strings ('' is ID 0)
+    with profiling.stage('generate.params'):
+        values = ['']
+        params = np.zeros((total, 2), dtype=np.uint32)
+        batch_rows = np.isin(type_col, line.batch_ids)
+        params[batch_rows, 0] = len(values) + seq_col[batch_rows]
+        values += [line.batch_number_format.format(seq + 1) for seq in sequences.tolist()]
+        for activity_type, parameter in line.parameters.items():
+            if not isinstance(parameter, dict):
+                continue
+            rows = np.flatnonzero(type_col == line.activity_index[activity_type])
+            if 'range' in parameter:
+                low, high = parameter['range']
+                step = parameter['max_step']
+                value1 = rng.integers(low, high + 1, size=len(rows))
+                value2 = np.clip(value1 + rng.integers(-step, step + 1, size=len(rows)), low, high)
+                params[rows, 0] = len(values) + value1 - low
+                params[rows, 1] = len(values) + value2 - low
+                values += [str(value) for value in range(low, high + 1)]
             else:
-                activity = random.choice(activity_variations[activity_type])
-
-            # Add log entry
-            synthetic_logs.append([
-                current_date.strftime('%Y-%m-%d'),
-                current_time.strftime('%H:%M:%S'),
-                current_user,
-                activity,
-                'Not Available',
-                '0'
-            ])
-
-            # Add realistic time interval based on activity type
-            min_time, max_time = time_intervals[activity_type]
-            current_time += timedelta(minutes=random.randint(min_time, max_time))
-
-    return pd.DataFrame(synthetic_logs, columns=['Date', 'Time', 'User', 
-                                               'Activity Description', 'Reason for change', 'Anomaly'])
-
-def save_audit_logs(num_sequences=1500, output_file='enhanced_audit_logs.csv'):
+                choices = parameter['choices']
+                params[rows, 0] = len(values) + rng.integers(len(choices), size=len(rows))
+                values += choices
+
+    # Timestamps: sequence start plus the cumulative minutes within it
+    start = epoch_seconds(line.start_date, line.start_time)
+    timestamps = start + sequences[seq_col] * 86400 + minutes_col * 60
+
+    user_ids = rng.integers(len(line.users), size=num_sequences).astype(np.uint16)
+
+    return (AuditEventBatch(timestamps, user_ids[seq_col], template_col, params, np.zeros(total, dtype=np.int8),
+                            line.users, values),
+            sequences[seq_col])
+
+def iter_audit_log_chunks(num_sequences=1500, chunk_size=10000, vectorized=False, rng=None, first_sequence=0,
+                          scenario=None, render=True):
+    """
+    Yield the audit logs as DataFrames of at most chunk_size sequences each,
+    so only one chunk is held in memory at a time
+    """
+    from scenario import resolve_scenario
+    # Resolve the RNG and scenario once so a seeded stream continues across chunks
+    rng = numpy_rng(rng) if vectorized else python_rng(rng)
+    scenario = resolve_scenario(scenario)
+    end = first_sequence + num_sequences
+    for start in range(first_sequence, end, chunk_size):
+        yield generate_normal_audit_logs(min(chunk_size, end - start), vectorized=vectorized,
+                                         first_sequence=start, rng=rng, render=render, scenario=scenario)
+
+def stream_audit_logs(num_sequences=1500, output_file='enhanced_audit_logs.csv', chunk_size=10000,
+                      vectorized=False, rng=None, output_format=None, scenario=None):
+    """
+    Generate audit logs chunk by chunk and append each chunk to output_file.
+    The header is written once, with the first chunk. output_format is 'csv',
+    'parquet' or 'arrow' (inferred from the extension when None). Returns the
+    number of records written
+    """
+    with AuditLogWriter(output_file, output_format) as writer:
+        for chunk in iter_audit_log_chunks(num_sequences, chunk_size, vectorized, rng, scenario=scenario,
+                                            render=False):
+            writer.write(chunk)
+    return writer.num_records
+
+def save_audit_logs(num_sequences=1500, output_file='enhanced_audit_logs.csv', vectorized=False,
+                    chunk_size=10000, output_format=None, rng=None, scenario=None):
     """
     Generate and save enhanced audit logs
     """
     try:
-        df = generate_normal_audit_logs(num_sequences)
-        df.to_csv(output_file, index=False)
-        print(f"Successfully saved {len(df)} records to {output_file}")
+        num_records = stream_audit_logs(num_sequences, output_file, chunk_size, vectorized, rng=rng,
+                                        output_format=output_format, scenario=scenario)
+        print(f"Successfully saved {num_records} records to {output_file}")
         print(f"Generated {num_sequences} complete sequences")
         return True
     except Exception as e:
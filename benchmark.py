@@ -0,0 +1,194 @@
+"""
+Benchmark harness for the audit log generators.
+
+    python benchmark.py                          # 1k and 100k rows, all cases
+    python benchmark.py --sizes 1k,100k,10M --cases generate_dataset
+    python benchmark.py --compare old.json       # flag regressions against a previous run
+
+Every (case, size) runs in a fresh process so its peak RSS is its own. Time
+is split, using the generators' profiling stages, into DataFrame
+construction (the frame.* stages), serialization (write and write.render)
+and generation (everything else); the per-stage times are kept under
+'profile'. Each case runs one untimed unit first, so imports and warm-up
+are not counted. Results are written as JSON, tagged with the
+current git commit, so runs can be compared between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+# Approximate rows per generated unit, used to turn a row budget into a count
+ROWS_PER_UNIT = {
+    'generate_normal_audit_logs': 14.5,
+    'generate_normal_audit_logs_vectorized': 14.5,
+    'save_audit_logs': 14.5,
+    'save_audit_logs_vectorized': 14.5,
+    'generate_normal_sequence': 11.5,
+    'generate_anomalous_sequence': 9.5,
+    'generate_dataset': 11.4,
+    'create_anomalous_sequence': 78,
+    'create_anomalous_variants': 78,
+    'save_fleet_logs': 1270  # simulated days of the default 12-line fleet
+}
+
+CASES = list(ROWS_PER_UNIT)
+
+def parse_size(text):
+    """'1k' -> 1000, '10M' -> 10000000"""
+    multipliers = {'k': 10 ** 3, 'm': 10 ** 6}
+    suffix = text[-1].lower()
+    if suffix in multipliers:
+        return int(float(text[:-1]) * multipliers[suffix])
+    return int(text)
+
+def _run(case, units, output_file):
+    """Run one benchmark case; returns the number of rows it produced"""
+    from datetime import datetime
+    date, start_time = datetime(2024, 8, 27), datetime(1900, 1, 1, 8)
+
+    if case in ('generate_normal_audit_logs', 'generate_normal_audit_logs_vectorized'):
+        from augmentation import generate_normal_audit_logs
+        return len(generate_normal_audit_logs(units, vectorized=case.endswith('vectorized'), rng=0))
+    if case in ('save_audit_logs', 'save_audit_logs_vectorized'):
+        from augmentation import stream_audit_logs
+        return stream_audit_logs(units, output_file, vectorized=case.endswith('vectorized'), rng=0)
+    if case == 'generate_normal_sequence':
+        from incorrect_augmentation import AuditLogGenerator
+        generator = AuditLogGenerator(0)
+        return sum(len(generator.generate_normal_sequence(date, start_time, 'user123', i + 1))
+                   for i in range(units))
+    if case == 'generate_anomalous_sequence':
+        from incorrect_augmentation import AuditLogGenerator
+        generator = AuditLogGenerator(0)
+        return sum(len(generator.generate_anomalous_sequence(date, start_time, 'user123', i + 1))
+                   for i in range(units))
+    if case == 'generate_dataset':
+        from incorrect_augmentation import generate_dataset
+        return len(generate_dataset(units, rng=0))
+    if case == 'create_anomalous_sequence':
+        from demo import create_correct_sequence, create_anomalous_sequence
+        correct_df = create_correct_sequence()
+        rng = random.Random(0)
+        return sum(len(create_anomalous_sequence(correct_df, rng=rng)) for _ in range(units))
+    if case == 'create_anomalous_variants':
+        from demo import create_correct_sequence, iter_anomalous_variants
+        correct_df = create_correct_sequence()
+        return sum(len(chunk) for chunk in iter_anomalous_variants(correct_df, units, rng=0))
+    if case == 'save_fleet_logs':
+        from fleet import save_fleet_logs
+        return save_fleet_logs(output_file, days=units, rng=0)
+    raise ValueError(f"Unknown benchmark case {case!r}")
+
+def _run_case(case, units, output_dir):
+    """Run one benchmark case in the current (worker) process"""
+    import resource
+    import profiling
+
+    output_file = os.path.join(output_dir, f'{case}.csv')
+    # One untimed unit first: module imports and warm-up caches would otherwise dominate small sizes
+    _run(case, 1, output_file)
+    with profiling.profile() as run_profile:
+        start = time.perf_counter()
+        rows = _run(case, units, output_file)
+        seconds = time.perf_counter() - start
+    if os.path.exists(output_file):
+        os.remove(output_file)
+
+    # Stage times are exclusive, so the frame.* and write* stages never overlap
+    stage_seconds = {name: totals['seconds'] for name, totals in run_profile.stats()['stages'].items()}
+    frame_seconds = sum(t for name, t in stage_seconds.items() if name.startswith('frame.'))
+    write_seconds = sum(t for name, t in stage_seconds.items() if name == 'write' or name.startswith('write.'))
+    return {
+        'case': case,
+        'units': units,
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'rows_per_sec': round(rows / seconds, 1) if seconds else None,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'stages': {
+            'generation': round(seconds - frame_seconds - write_seconds, 4),
+            'dataframe': round(frame_seconds, 4),
+            'serialization': round(write_seconds, 4)
+        },
+        'profile': {name: round(t, 4) for name, t in stage_seconds.items()}
+    }
+
+def run_benchmarks(cases, sizes):
+    """Run every case at every row budget, each in its own process"""
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for size in sizes:
+            for case in cases:
+                units = max(1, int(size / ROWS_PER_UNIT[case]))
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+                    result = pool.submit(_run_case, case, units, output_dir).result()
+                result['size'] = size
+                results.append(result)
+                print(f"{case:<40} {size:>10,} rows target  {result['rows']:>10,} rows  "
+                      f"{result['seconds']:>9.3f}s  {result['rows_per_sec'] or 0:>12,.0f} rows/s  "
+                      f"{result['peak_rss_mb']:>8.1f} MB")
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_file, threshold=0.1):
+    """Print throughput changes against a previous results file; returns the number of regressions"""
+    with open(baseline_file) as f:
+        baseline = {(r['case'], r['size']): r for r in json.load(f)['results']}
+    regressions = 0
+    for result in results:
+        old = baseline.get((result['case'], result['size']))
+        if not old or not old['rows_per_sec'] or not result['rows_per_sec']:
+            continue
+        change = result['rows_per_sec'] / old['rows_per_sec'] - 1
+        flag = ''
+        if change < -threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"{result['case']:<40} {result['size']:>10,}  {change:+.1%}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the audit log generators")
+    parser.add_argument('--sizes', default='1k,100k', help="comma-separated row budgets, e.g. 1k,100k,10M")
+    parser.add_argument('--cases', default=','.join(CASES), help="comma-separated case names")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', default=None, help="previous results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    cases = [c for c in args.cases.split(',') if c]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+    results = run_benchmarks(cases, [parse_size(s) for s in args.sizes.split(',')])
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'results': results
+        }, f, indent=2)
+    print(f"Saved results to {args.output}")
+
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Command-line entry point for the audit log generators.
+
+    python cli.py normal --num-sequences 1500 --output enhanced_audit_logs1.5k.csv
+    python cli.py anomalies --num-sequences 50 --anomaly-probability 0.3
+    python cli.py sequences --num-variants 5 --output-dir .
+    python cli.py normal --scenario scenarios/coating_lines.yaml --vectorized
+    python cli.py anomalies --num-sequences 100000 --profile stats.json
+    python cli.py fleet --lines 24 --operators 60 --days 365 --output fleet.parquet
+
+The generator modules are imported by the subcommand that needs them, so
+--help and argument errors return without loading pandas.
+"""
+import argparse
+import sys
+
+def _copy_from_cache(args, generator, **options):
+    """
+    Fetch the dataset from the cache in --cache-dir (generating it on a miss,
+    then evicting least recently used entries past --cache-max-bytes) and
+    copy it to --output; returns its number of records
+    """
+    import json
+    import os
+    import shutil
+    from dataset_cache import DatasetCache
+    from output_formats import format_for_path
+    if args.seed is None:
+        sys.exit("--cache-dir needs a --seed")
+    cache = DatasetCache(args.cache_dir, args.cache_max_bytes)
+    path = cache.get(generator, args.seed, format_for_path(args.output, args.format),
+                     num_sequences=args.num_sequences, chunk_size=args.chunk_size, num_shards=args.shards or None,
+                     scenario=args.scenario, **options)
+    # A copy rather than a link, so rewriting the output never touches the cache
+    shutil.copyfile(path, args.output)
+    with open(os.path.splitext(path)[0] + '.json') as f:
+        return json.load(f)['num_records']
+
+def run_normal(args):
+    if args.cache_dir:
+        num_records = _copy_from_cache(args, 'normal', vectorized=args.vectorized)
+        print(f"Successfully saved {num_records} records to {args.output}")
+        return 0
+    if args.shards:
+        from sharding import generate_sharded
+        files, num_records = generate_sharded('normal', args.num_sequences, args.output, seed=args.seed or 0,
+                                              num_shards=args.shards, processes=args.processes,
+                                              chunk_size=args.chunk_size, output_format=args.format,
+                                              vectorized=args.vectorized, scenario=args.scenario)
+        print(f"Successfully saved {num_records} records to {', '.join(files)}")
+        return 0
+
+    from augmentation import stream_audit_logs
+    num_records = stream_audit_logs(args.num_sequences, args.output, args.chunk_size, args.vectorized,
+                                    rng=args.seed, output_format=args.format, scenario=args.scenario)
+    print(f"Successfully saved {num_records} records to {args.output}")
+    return 0
+
+def run_anomalies(args):
+    if args.cache_dir:
+        num_records = _copy_from_cache(args, 'anomalies', anomaly_probability=args.anomaly_probability)
+        print(f"Generated {num_records} records with anomalies in {args.output}")
+        return 0
+    if args.shards:
+        from sharding import generate_sharded
+        files, num_records = generate_sharded('anomalies', args.num_sequences, args.output, seed=args.seed or 0,
+                                              num_shards=args.shards, processes=args.processes,
+                                              chunk_size=args.chunk_size, output_format=args.format,
+                                              anomaly_probability=args.anomaly_probability, scenario=args.scenario)
+        print(f"Generated {num_records} records with anomalies in {', '.join(files)}")
+        return 0
+
+    from incorrect_augmentation import save_dataset
+    num_records = save_dataset(args.num_sequences, args.output, args.anomaly_probability, rng=args.seed,
+                               chunk_size=args.chunk_size, output_format=args.format, scenario=args.scenario)
+    print(f"Generated {num_records} records with anomalies in {args.output}")
+    return 0
+
+def run_sequences(args):
+    from demo import save_demo_sequences
+    save_demo_sequences(args.num_variants, args.num_anomalies, args.output_dir, args.extension, rng=args.seed)
+    print(f"Saved the correct sequence and {args.num_variants} anomalous sequences to {args.output_dir}")
+    return 0
+
+def run_fleet(args):
+    from fleet import save_fleet_logs
+    num_records = save_fleet_logs(args.output, args.lines, args.operators, args.days, args.chunk_size,
+                                  args.anomaly_probability, rng=args.seed, scenario=args.scenario,
+                                  output_format=args.format)
+    print(f"Simulated {num_records} records from {args.lines} lines over {args.days} days in {args.output}")
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Generate synthetic audit logs")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_common(sub, default_output):
+        sub.add_argument('--num-sequences', type=int, default=1500)
+        sub.add_argument('--output', default=default_output)
+        sub.add_argument('--format', choices=['csv', 'parquet', 'arrow'], default=None,
+                         help="output format (default: from the output file extension)")
+        sub.add_argument('--seed', type=int, default=None)
+        sub.add_argument('--chunk-size', type=int, default=10000, help="sequences per written chunk")
+        sub.add_argument('--shards', type=int, default=0, help="generate in this many parallel shards")
+        sub.add_argument('--processes', type=int, default=None, help="worker processes for --shards")
+        sub.add_argument('--scenario', default=None, help="YAML or JSON scenario spec to generate from")
+        sub.add_argument('--profile', default=None, metavar='STATS_FILE',
+                         help="time the generation stages and write the stats to this JSON file")
+        sub.add_argument('--cache-dir', default=None,
+                         help="reuse datasets generated before with the same options and --seed from this cache")
+        sub.add_argument('--cache-max-bytes', type=int, default=None,
+                         help="evict least recently used cache entries beyond this many bytes (default: no limit)")
+
+    normal = subparsers.add_parser('normal', help="normal audit logs (augmentation.py)")
+    add_common(normal, 'enhanced_audit_logs.csv')
+    normal.add_argument('--vectorized', action='store_true', help="use the NumPy generation path")
+    normal.set_defaults(func=run_normal)
+
+    anomalies = subparsers.add_parser('anomalies', help="mixed normal/anomalous logs (incorrect_augmentation.py)")
+    add_common(anomalies, 'audit_logs_with_anomalies.csv')
+    anomalies.add_argument('--anomaly-probability', type=float, default=0.3)
+    anomalies.set_defaults(func=run_anomalies)
+
+    fleet = subparsers.add_parser('fleet', help="time-ordered logs of many lines and operators on shifts (fleet.py)")
+    fleet.add_argument('--lines', type=int, default=12, help="production lines running concurrently")
+    fleet.add_argument('--operators', type=int, default=40, help="operators, split over overlapping shifts")
+    fleet.add_argument('--days', type=float, default=7, help="simulated days")
+    fleet.add_argument('--anomaly-probability', type=float, default=0.0)
+    fleet.add_argument('--output', default='fleet_audit_logs.csv')
+    fleet.add_argument('--format', choices=['csv', 'parquet', 'arrow'], default=None,
+                       help="output format (default: from the output file extension)")
+    fleet.add_argument('--seed', type=int, default=None)
+    fleet.add_argument('--chunk-size', type=int, default=100000, help="events per written chunk")
+    fleet.add_argument('--scenario', default=None, help="YAML or JSON scenario spec to generate from")
+    fleet.add_argument('--profile', default=None, metavar='STATS_FILE',
+                       help="time the generation stages and write the stats to this JSON file")
+    fleet.set_defaults(func=run_fleet)
+
+    sequences = subparsers.add_parser('sequences', help="correct and anomalous batch sequences (demo.py)")
+    sequences.add_argument('--num-variants', type=int, default=5)
+    sequences.add_argument('--num-anomalies', type=int, default=3)
+    sequences.add_argument('--output-dir', default='.')
+    sequences.add_argument('--extension', default='.csv', help="file extension, selects the output format")
+    sequences.add_argument('--seed', type=int, default=None)
+    sequences.add_argument('--profile', default=None, metavar='STATS_FILE',
+                           help="time the generation stages and write the stats to this JSON file")
+    sequences.set_defaults(func=run_sequences)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not args.profile:
+        return args.func(args)
+    from profiling import format_stats, profile
+    with profile(stats_file=args.profile) as active:
+        status = args.func(args)
+    print(format_stats(active.stats()), file=sys.stderr)
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
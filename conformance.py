@@ -0,0 +1,450 @@
+"""
+Step-order conformance of audit log sequences.
+
+    python conformance.py anomalous_sequence_1.csv
+    python conformance.py enhanced_audit_logs1.5k.csv --variations --output report.csv
+
+    from conformance import ConformanceModel, check_conformance
+    report = check_conformance(df, ConformanceModel(variations=True))
+
+The reference order of demo.CORRECT_SEQUENCE is compiled, over activity
+types, into a deterministic automaton. With variations, each scenario line's
+own order (fixed opening, any min_middle or more of its middle activities in
+any order, fixed closing, as augmentation.draw_sequence draws them) is
+accepted as well. The line models are unioned with the reference and
+determinized by subset construction. Parameter values are not checked here,
+only the order of the steps; anomaly_scorer covers the values.
+
+Rows are grouped into sequences per user (and variant_id) from one login to
+the next, as in anomaly_scorer. All sequences run through the automaton's
+transition table at once, one NumPy step per position, so checking the
+conforming ones is linear in the rows. Only the others are aligned: an A*
+search over (position, state) pairs finds the fewest deviations that turn
+the sequence into an accepted one. A deviation is an inserted row, a
+skipped step, a substituted step or two swapped neighbours. Each changes
+the number of rows left by at most one, so the gap between the rows left
+and the shortest/longest accepted rest from a state is a lower bound on
+the deviations still needed. Pairs are expanded in order of cost plus that
+bound, and pairs whose bound exceeds max_cost are never queued, so a
+sequence with few deviations visits a narrow band of the alignment table.
+Sequences needing more than max_cost deviations are reported as unaligned.
+Distinct orders are aligned once each, in a process pool.
+"""
+import argparse
+import collections
+import heapq
+import sys
+
+DEVIATIONS = ('inserted', 'skipped', 'substituted', 'swapped')
+
+# Deviations an alignment may use before the sequence is reported unaligned
+MAX_COST = 8
+
+# Sequences per alignment task
+TASK_SIZE = 2000
+
+# Automaton state every undefined transition leads to
+DEAD = 0
+
+# One report row per sequence (plus variant_id after First Row when the
+# input has one); Cost is NaN for unaligned sequences
+REPORT_COLUMNS = ['First Row', 'User', 'Length', 'Conforming', 'Cost', 'Deviations', 'Anomaly']
+
+def _chain(steps):
+    """NFA (edges, starts, accepting) for steps in a fixed order"""
+    edges = [[(symbol, i + 1)] for i, symbol in enumerate(steps)] + [[]]
+    return edges, [0], [len(steps)]
+
+def _line_model(opening, middle, min_middle, closing):
+    """
+    NFA for a line's order: the opening, then a set of at least min_middle
+    distinct middle activities in any order, then the closing. Middle states
+    are the bit masks of the activities done so far
+    """
+    middle_base = len(opening)
+    closing_base = middle_base + (1 << len(middle))
+    edges = [[(symbol, i + 1)] for i, symbol in enumerate(opening)]
+    edges += [[] for _ in range(1 << len(middle))]
+    edges += [[(symbol, closing_base + i + 1)] for i, symbol in enumerate(closing)] + [[]]
+    for mask in range(1 << len(middle)):
+        state = middle_base + mask
+        for bit, symbol in enumerate(middle):
+            if not mask >> bit & 1:
+                edges[state].append((symbol, middle_base + (mask | 1 << bit)))
+        if bin(mask).count('1') >= min_middle:
+            # Straight on into the closing
+            edges[state].extend(edges[closing_base])
+    accepting = [closing_base + len(closing)]
+    if not closing:
+        accepting = [middle_base + mask for mask in range(1 << len(middle)) if bin(mask).count('1') >= min_middle]
+    return edges, [0], accepting
+
+def _union(models):
+    edges, starts, accepting = [], [], []
+    for model_edges, model_starts, model_accepting in models:
+        base = len(edges)
+        edges += [[(symbol, base + state) for symbol, state in state_edges] for state_edges in model_edges]
+        starts += [base + state for state in model_starts]
+        accepting += [base + state for state in model_accepting]
+    return edges, starts, accepting
+
+def _determinize(edges, starts, accepting, num_symbols):
+    """Subset construction: (transition table, start state, accepting flags), state DEAD a sink"""
+    import numpy as np
+    accepting = set(accepting)
+    start = frozenset(starts)
+    index = {frozenset(): DEAD, start: 1}
+    queue = [start]
+    rows = [[DEAD] * num_symbols, None]
+    while queue:
+        subset = queue.pop()
+        moves = collections.defaultdict(set)
+        for state in subset:
+            for symbol, target in edges[state]:
+                moves[symbol].add(target)
+        row = [DEAD] * num_symbols
+        for symbol, targets in moves.items():
+            targets = frozenset(targets)
+            if targets not in index:
+                index[targets] = len(rows)
+                rows.append(None)
+                queue.append(targets)
+            row[symbol] = index[targets]
+        rows[index[subset]] = row
+    final = np.zeros(len(rows), dtype=bool)
+    for subset, state in index.items():
+        final[state] = bool(subset & accepting)
+    return np.array(rows, dtype=np.int32), 1, final
+
+class ConformanceModel:
+    """
+    The accepted step orders as a DFA over activity types (the registry's
+    activity_index; len(activity_types) stands for unrecognized rows).
+    reference is a list of (activity type, template) pairs,
+    demo.CORRECT_SEQUENCE by default; variations adds the scenario's lines
+    """
+
+    def __init__(self, reference=None, variations=False, scenario=None, max_cost=MAX_COST):
+        from templates import get_registry
+        registry = get_registry()
+        if reference is None:
+            from demo import CORRECT_SEQUENCE
+            reference = CORRECT_SEQUENCE
+        self.activity_types = list(registry.activity_types) + ['<unknown>']
+        self.unknown = len(registry.activity_types)
+        self.max_cost = max_cost
+        symbol = registry.activity_index
+        models = [_chain([symbol[activity_type] for activity_type, _ in reference])]
+        if variations:
+            from scenario import resolve_scenario
+            orders = {(tuple(line.opening), tuple(line.middle), line.min_middle, tuple(line.closing))
+                      for line in resolve_scenario(scenario).lines}
+            for opening, middle, min_middle, closing in sorted(orders):
+                models.append(_line_model([symbol[a] for a in opening], [symbol[a] for a in middle], min_middle,
+                                          [symbol[a] for a in closing]))
+        self.table, self.start, self.accepting = _determinize(*_union(models), len(self.activity_types))
+        # Per state: symbol -> next state, and the fewest and most steps to
+        # acceptance, for the alignment search
+        self.moves = [{a: int(q) for a, q in enumerate(row) if q != DEAD} for row in self.table.tolist()]
+        self.shortest, self.longest = (values.tolist() for values in self._rest_lengths())
+
+    def _rest_lengths(self):
+        """Per state, the length of the shortest and longest accepted rest (inf through a loop)"""
+        import numpy as np
+        shortest = np.where(self.accepting, 0.0, np.inf)
+        longest = np.where(self.accepting, 0.0, -np.inf)
+        for _ in range(self.num_states):
+            # DEAD only leads to itself, so it stays at +inf/-inf
+            new_shortest = np.minimum(shortest, 1 + shortest[self.table].min(axis=1))
+            new_longest = np.maximum(longest, 1 + longest[self.table].max(axis=1))
+            if np.array_equal(new_shortest, shortest) and np.array_equal(new_longest, longest):
+                break
+            shortest, longest = new_shortest, new_longest
+        longest[longest >= self.num_states] = np.inf
+        return shortest, longest
+
+    @property
+    def num_states(self):
+        return len(self.table)
+
+    def accepts(self, symbols, offsets):
+        """
+        Whether each sequence is accepted; sequence i is
+        symbols[offsets[i]:offsets[i + 1]]. One table lookup per position for
+        all sequences still running, longest first
+        """
+        import numpy as np
+        lengths = np.diff(offsets)
+        order = np.argsort(-lengths, kind='stable')
+        starts, remaining = offsets[order], lengths[order]
+        states = np.full(len(order), self.start, dtype=np.int32)
+        running = len(order)
+        for position in range(int(remaining.max(initial=0))):
+            running = np.searchsorted(-remaining, -position, side='left')
+            states[:running] = self.table[states[:running], symbols[starts[:running] + position]]
+        accepted = np.empty(len(order), dtype=bool)
+        accepted[order] = self.accepting[states]
+        return accepted
+
+    def align(self, sequence):
+        """
+        (cost, deviations) of the cheapest alignment of a list of symbols;
+        deviations are (kind, position, observed, expected) with activity
+        type names (None where not applicable). (None, None) past max_cost
+        """
+        n, moves, accepting, shortest, longest = len(sequence), self.moves, self.accepting, self.shortest, self.longest
+        start = (0, self.start)
+        cost = {start: 0}
+        came_from = {start: None}
+        queue = [(0, 0, self.start)]
+        done = set()
+
+        def relax(node, new_cost, step):
+            # A*: every deviation changes the length left by at most one, so
+            # the gap to the state's shortest/longest accepted rest is a bound
+            i, state = node
+            left = n - i
+            bound = new_cost + max(shortest[state] - left, left - longest[state], 0)
+            if bound <= self.max_cost and new_cost < cost.get(node, new_cost + 1):
+                cost[node] = new_cost
+                came_from[node] = step
+                heapq.heappush(queue, (bound, -i, state))
+
+        while queue:
+            _, i, state = heapq.heappop(queue)
+            i = -i
+            node = (i, state)
+            if node in done:
+                continue
+            done.add(node)
+            current = cost[node]
+            if i == n and accepting[state]:
+                return current, self._deviations(node, came_from, sequence)
+            following = moves[state]
+            if i < n:
+                observed = sequence[i]
+                target = following.get(observed)
+                if target is not None:
+                    relax((i + 1, target), current, (node, None))
+                relax((i + 1, state), current + 1, (node, ('inserted', i, observed, None)))
+                if i + 1 < n and sequence[i + 1] != observed:
+                    middle = following.get(sequence[i + 1])
+                    target = moves[middle].get(observed) if middle is not None else None
+                    if target is not None:
+                        relax((i + 2, target), current + 1, (node, ('swapped', i, observed, sequence[i + 1])))
+            for expected, target in following.items():
+                relax((i, target), current + 1, (node, ('skipped', i, None, expected)))
+                if i < n and expected != sequence[i]:
+                    relax((i + 1, target), current + 1, (node, ('substituted', i, sequence[i], expected)))
+        return None, None
+
+    def _deviations(self, node, came_from, sequence):
+        names = self.activity_types
+        deviations = []
+        while came_from[node] is not None:
+            node, deviation = came_from[node]
+            if deviation is not None:
+                kind, position, observed, expected = deviation
+                deviations.append((kind, position, None if observed is None else names[observed],
+                                   None if expected is None else names[expected]))
+        return deviations[::-1]
+
+def format_deviations(deviations):
+    """One line for a sequence's deviations, e.g. 'swapped@3 calibration/equipment_check'"""
+    if deviations is None:
+        return 'unaligned'
+    return '; '.join(f"{kind}@{position} {observed or '-'}/{expected or '-'}"
+                     for kind, position, observed, expected in deviations)
+
+def row_symbols(df, unknown):
+    """Activity type index of every row (unknown where unrecognized)"""
+    import numpy as np
+    from templates import get_registry
+    if 'Param 1' in df.columns:
+        activity_ids = get_registry().activity_of_template[df['Template'].to_numpy(dtype=np.int64)]
+    else:
+        from activity_classifier import get_classifier
+        activity_ids = get_classifier().classify_batch(df['Activity Description'])['activity_id']
+    return np.where(activity_ids < 0, unknown, activity_ids).astype(np.int32)
+
+class _SequenceReader:
+    """
+    Cuts a stream of chunks into sequences, holding each owner's last
+    sequence until their next login (or final=True)
+    """
+
+    def __init__(self, model):
+        from templates import get_registry
+        self.model = model
+        self.login = get_registry().activity_index['login']
+        self.rows_seen = 0
+        self.held = None
+        # Users by ID across chunks; whether the input has variant_id
+        self.users = {}
+        self.has_variants = False
+
+    def _user_ids(self, users):
+        import numpy as np
+        import pandas as pd
+        codes, uniques = pd.factorize(users, use_na_sentinel=False)
+        ids = np.array([self.users.setdefault(user, len(self.users)) for user in np.asarray(uniques, dtype=object)],
+                       dtype=np.int64)
+        return ids[codes]
+
+    def add(self, df, final=False):
+        """
+        (symbols, offsets, rows, users, variants, labels) of the closed
+        sequences, rows being stream row numbers and users IDs into
+        self.users; None if no sequence closed
+        """
+        import numpy as np
+        import pandas as pd
+        parts = [] if self.held is None else [self.held]
+        if df is not None and len(df):
+            variants = np.zeros(len(df), dtype=np.int64)
+            if 'variant_id' in df.columns:
+                self.has_variants = True
+                variants = pd.to_numeric(df['variant_id']).to_numpy(dtype=np.int64)
+            labels = np.zeros(len(df), dtype=np.int8)
+            if 'Anomaly' in df.columns:
+                labels = (pd.to_numeric(df['Anomaly'], errors='coerce').fillna(0).to_numpy() != 0).astype(np.int8)
+            rows = np.arange(self.rows_seen, self.rows_seen + len(df))
+            self.rows_seen += len(df)
+            parts.append((row_symbols(df, self.model.unknown), rows, self._user_ids(df['User']), variants, labels))
+        if not parts:
+            return None
+        columns = tuple(np.concatenate([part[i] for part in parts]) for i in range(5))
+        symbols, rows, users, variants, labels = columns
+
+        # A sequence belongs to a user within a variant
+        owners = pd.factorize(variants * len(self.users) + users)[0].astype(np.int64)
+        number = pd.Series(symbols == self.login).groupby(owners).cumsum().to_numpy()
+        closed = np.ones(len(symbols), dtype=bool)
+        if not final:
+            closed = number < pd.Series(number).groupby(owners).transform('max').to_numpy()
+        self.held = tuple(values[~closed] for values in columns) if not closed.all() else None
+        if not closed.any():
+            return None
+
+        # Lay the closed sequences out contiguously, numbered by their first row
+        sequence_ids = pd.factorize((number * (owners.max(initial=0) + 1) + owners)[closed])[0]
+        order = np.argsort(sequence_ids, kind='stable')
+        lengths = np.bincount(sequence_ids)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        picked = np.flatnonzero(closed)[order]
+        return (symbols[picked], offsets) + tuple(values[picked] for values in (rows, users, variants, labels))
+
+_worker_model = None
+
+def _init_worker(model):
+    global _worker_model
+    _worker_model = model
+
+def _align_task(sequences):
+    return [_worker_model.align(sequence) for sequence in sequences]
+
+def _report(model, reader, pool_map, symbols, offsets, rows, users, variants, labels):
+    """One report row per sequence, aligning the ones the automaton rejects"""
+    import numpy as np
+    import pandas as pd
+    accepted = model.accepts(symbols, offsets)
+    starts, lengths = offsets[:-1], np.diff(offsets)
+    rejected = np.flatnonzero(~accepted).tolist()
+    # Step orders repeat a lot: align each distinct one once
+    sequences = [tuple(symbols[offsets[i]:offsets[i + 1]].tolist()) for i in rejected]
+    distinct = list(dict.fromkeys(sequences))
+    tasks = [distinct[lo:lo + TASK_SIZE] for lo in range(0, len(distinct), TASK_SIZE)]
+    alignments = dict(zip(distinct, (result for results in pool_map(_align_task, tasks) for result in results)))
+    aligned = [alignments[sequence] for sequence in sequences]
+
+    costs = np.zeros(len(starts))
+    deviations = np.full(len(starts), '', dtype=object)
+    costs[rejected] = [np.nan if cost is None else cost for cost, _ in aligned]
+    deviations[rejected] = [format_deviations(found) for _, found in aligned]
+    report = pd.DataFrame({
+        'First Row': rows[starts],
+        'User': np.array(list(reader.users), dtype=object)[users[starts]],
+        'Length': lengths,
+        'Conforming': accepted,
+        'Cost': costs,
+        'Deviations': deviations,
+        'Anomaly': np.maximum.reduceat(labels, starts)
+    })
+    if reader.has_variants:
+        report.insert(1, 'variant_id', variants[starts])
+    return report
+
+def iter_conformance(chunks, model=None, processes=None):
+    """
+    Yield a report frame for the sequences closed by each chunk (and the
+    rest at the end). Rejected sequences are aligned in a process pool;
+    processes=1 aligns inline
+    """
+    import contextlib
+    import os
+    model = model or ConformanceModel()
+    reader = _SequenceReader(model)
+    with contextlib.ExitStack() as stack:
+        if processes == 1:
+            _init_worker(model)
+            pool_map = map
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            pool = ProcessPoolExecutor(max_workers=processes or os.cpu_count() or 1, initializer=_init_worker,
+                                       initargs=(model,))
+            pool_map = stack.enter_context(pool).map
+        for chunk in chunks:
+            closed = reader.add(chunk)
+            if closed is not None:
+                yield _report(model, reader, pool_map, *closed)
+        closed = reader.add(None, final=True)
+        if closed is not None:
+            yield _report(model, reader, pool_map, *closed)
+
+def check_conformance(df, model=None, processes=None):
+    """The conformance report of a whole frame, one row per sequence in order of first row"""
+    import pandas as pd
+    reports = list(iter_conformance([df], model, processes))
+    if not reports:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    return pd.concat(reports, ignore_index=True).sort_values('First Row', kind='stable', ignore_index=True)
+
+def main(argv=None):
+    import pandas as pd
+    from output_formats import iter_audit_log_batches
+    parser = argparse.ArgumentParser(description="Check the step order of audit log sequences against the reference")
+    parser.add_argument('input', help="audit log file (csv, parquet or arrow)")
+    parser.add_argument('--variations', action='store_true',
+                        help="also accept the scenario lines' orders (shuffled middle activities)")
+    parser.add_argument('--scenario', help="scenario name or YAML/JSON spec for --variations")
+    parser.add_argument('--max-cost', type=int, default=MAX_COST, help="deviations searched before giving up")
+    parser.add_argument('--processes', type=int, help="alignment worker processes (default: one per CPU)")
+    parser.add_argument('--output', help="write the per-sequence report here (CSV)")
+    parser.add_argument('--examples', type=int, default=5, help="deviating sequences to print")
+    args = parser.parse_args(argv)
+
+    model = ConformanceModel(variations=args.variations, scenario=args.scenario, max_cost=args.max_cost)
+    reports = list(iter_conformance(iter_audit_log_batches(args.input), model, args.processes))
+    report = pd.concat(reports, ignore_index=True) if reports else pd.DataFrame(columns=REPORT_COLUMNS)
+    report = report.sort_values('First Row', kind='stable', ignore_index=True)
+    deviating = report[~report['Conforming'].astype(bool)]
+    print(f"{len(report):,} sequences, {len(deviating):,} deviating ({model.num_states} automaton states)")
+    kinds = deviating['Deviations'].str.findall(r'(\w+)@').explode().value_counts()
+    for kind in DEVIATIONS:
+        print(f"{kind:<12} {int(kinds.get(kind, 0)):>8,}")
+    print(f"{'unaligned':<12} {int(report['Cost'].isna().sum()):>8,}")
+
+    # Agreement with the generators' own labels
+    labeled = report['Anomaly'].to_numpy() != 0
+    flagged = ~report['Conforming'].to_numpy(dtype=bool)
+    print(f"{int((flagged & labeled).sum()):,} of {int(labeled.sum()):,} labeled sequences deviate, "
+          f"{int((flagged & ~labeled).sum()):,} unlabeled ones do")
+    for row in deviating.head(args.examples).itertuples():
+        print(f"  row {row[1]} {row.User}: {row.Deviations}")
+    if args.output:
+        report.to_csv(args.output, index=False)
+        print(f"Saved the report to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
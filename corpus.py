@@ -0,0 +1,421 @@
+"""
+Parallel loading and validation of existing audit log corpora.
+
+    from corpus import load_corpus, validate_corpus
+    df, report = load_corpus(['data/'])               # one normalized frame
+    report = validate_corpus(['data/'], workers=8)    # the report only, in bounded memory
+
+    python corpus.py data/ --report corpus_report.json
+    python corpus.py *.csv --output corpus.parquet
+
+Files may be CSV, Parquet or Arrow, in either column order the generators
+have written (demo.py puts Activity Description first). A pool of threads
+reads them in chunks and normalizes every chunk to one layout,
+NORMALIZED_COLUMNS: a Timestamp parsed from Date and Time in one vectorized
+call, the string columns, and Anomaly as int8 (-1 where the label is not
+one of LABELS).
+
+Each file is validated on the way: timestamps that don't parse, labels
+outside LABELS, and rows whose time runs backwards within a sequence (per
+user, a login starts a new one, as in anomaly_scorer). The report groups the
+files by schema (column order plus the kind of each column) and lists how
+each file drifts from the canonical layout of its format.
+
+Readers hand their chunks over through a bounded queue, so iter_corpus and
+validate_corpus hold about workers + max_pending chunks however large the
+corpus is.
+"""
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from events import NOT_AVAILABLE
+from output_formats import EXTENSIONS, ROW_COLUMNS, format_for_path, iter_audit_log_batches
+
+NORMALIZED_COLUMNS = ['Timestamp', 'User', 'Activity Description', 'Reason for change', 'Anomaly']
+
+LABELS = (0, 1)
+LABEL_TEXTS = [str(label) for label in LABELS]
+
+CHUNK_ROWS = 100000
+
+# Examples kept per issue and file
+MAX_EXAMPLES = 5
+
+# Canonical columns and their kinds per format; unlisted columns are strings
+CANONICAL_COLUMNS = {
+    'csv': ROW_COLUMNS,
+    'columnar': ['Timestamp', 'User', 'Activity Description', 'Reason for change', 'Anomaly']
+}
+CANONICAL_KINDS = {'Timestamp': 'datetime', 'Anomaly': 'int'}
+
+# Columns the columnar writer adds when the producer supplies them
+OPTIONAL_COLUMNS = ['Activity Type', 'Template']
+
+class _Stopped(Exception):
+    """Raised in reader threads once the consumer of iter_corpus is gone"""
+
+def find_audit_logs(paths):
+    """The audit log files among paths (directories searched recursively), sorted"""
+    files = set()
+    for path in paths:
+        if not os.path.isdir(path):
+            files.add(path)
+            continue
+        for root, _, names in os.walk(path):
+            files.update(os.path.join(root, name) for name in names
+                         if os.path.splitext(name)[1].lower() in EXTENSIONS)
+    return sorted(files)
+
+def _column_kind(values):
+    import pandas as pd
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return 'datetime'
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return 'bool'
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return 'int'
+    if pd.api.types.is_float_dtype(values.dtype):
+        return 'float'
+    return 'string'
+
+class _FileScan:
+    """Normalizes the chunks of one file, collecting its schema and validation results"""
+
+    def __init__(self, path):
+        self.path = path
+        from templates import get_registry
+        self.format = format_for_path(path)
+        self.columns = None
+        self.kinds = {}
+        self.rows = 0
+        self.labels = {}
+        self.users = set()
+        self.first = self.last = None
+        self.issues = {'bad_timestamps': 0, 'bad_labels': 0, 'time_reversals': 0}
+        self.examples = {name: [] for name in self.issues}
+        self.error = None
+        # User -> time of their latest row, carried across chunks
+        self._latest = {}
+        # Login descriptions have no placeholders, so they are matched exactly
+        registry = get_registry()
+        self._login_texts = [registry.templates[i].text for i in registry.by_activity['login']]
+
+    def _issue(self, name, mask, examples):
+        count = int(mask.sum())
+        if count:
+            self.issues[name] += count
+            kept = self.examples[name]
+            kept += examples[:MAX_EXAMPLES - len(kept)]
+
+    def _set_kind(self, column, kind):
+        # A column whose kind differs between chunks is mixed, i.e. strings
+        previous = self.kinds.setdefault(column, kind)
+        if previous != kind:
+            self.kinds[column] = 'string'
+
+    def normalize(self, df):
+        import numpy as np
+        import pandas as pd
+
+        if self.columns is None:
+            self.columns = list(df.columns)
+            has_time = 'Timestamp' in df.columns or {'Date', 'Time'} <= set(df.columns)
+            missing = [c for c in ('User', 'Activity Description') if c not in df.columns]
+            if not has_time or missing:
+                raise ValueError(f"missing columns {missing + ([] if has_time else ['Date', 'Time'])}")
+        for column in df.columns:
+            if column != 'Anomaly':
+                self._set_kind(column, _column_kind(df[column]))
+        rows = np.arange(self.rows, self.rows + len(df))
+
+        # One timestamp per row; NaT where it doesn't parse
+        if 'Timestamp' in df.columns:
+            timestamps = pd.to_datetime(df['Timestamp'], errors='coerce')
+        else:
+            timestamps = pd.to_datetime(df['Date'] + ' ' + df['Time'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+        bad_time = timestamps.isna().to_numpy()
+        self._issue('bad_timestamps', bad_time, rows[bad_time].tolist())
+        if not bad_time.all():
+            first, last = timestamps.min(), timestamps.max()
+            self.first = first if self.first is None else min(self.first, first)
+            self.last = last if self.last is None else max(self.last, last)
+
+        # Labels: the values seen, and the ones outside LABELS
+        if 'Anomaly' in df.columns:
+            raw = df['Anomaly']
+            counts = raw.astype(str).value_counts(dropna=False)
+            for value, n in counts.items():
+                self.labels[value] = self.labels.get(value, 0) + int(n)
+            if counts.index.isin(LABEL_TEXTS).all():
+                # Only the label texts themselves, as CSV files have them
+                codes = pd.Index(LABEL_TEXTS).get_indexer(raw.astype(str))
+                labels = pd.Series(np.asarray(LABELS)[codes], index=raw.index)
+            else:
+                labels = pd.to_numeric(raw, errors='coerce')
+            if (raw.notna() & labels.isna()).any():
+                self._set_kind('Anomaly', 'string')
+            elif _column_kind(raw) == 'float' or (labels.dropna() % 1 != 0).any():
+                self._set_kind('Anomaly', 'float')
+            else:
+                self._set_kind('Anomaly', 'int')
+            valid = labels.isin(LABELS).to_numpy()
+            self._issue('bad_labels', ~valid, pd.unique(raw[~valid].astype(str)).tolist())
+            anomaly = np.where(valid, labels.fillna(-1), -1).astype(np.int8)
+        else:
+            anomaly = np.full(len(df), -1, dtype=np.int8)
+
+        # Time must not run backwards within a user's sequence; the first row
+        # of each user continues from their latest row in earlier chunks
+        users = df['User']
+        codes, uniques = pd.factorize(users, use_na_sentinel=False)
+        self.users.update(uniques.tolist())
+        is_login = df['Activity Description'].isin(self._login_texts).to_numpy()
+        seconds = pd.Series(timestamps.to_numpy().astype('datetime64[s]').astype(np.int64), dtype=float)
+        seconds[bad_time] = np.nan
+        by_user = seconds.groupby(codes)
+        previous = by_user.shift().to_numpy(copy=True)
+        first_rows = np.flatnonzero(~pd.Series(codes).duplicated().to_numpy())
+        previous[first_rows] = [self._latest.get(user, np.nan) for user in uniques[codes[first_rows]].tolist()]
+        reversed_time = ~is_login & (seconds.to_numpy() < previous)
+        self._issue('time_reversals', reversed_time, rows[reversed_time].tolist())
+        for code, latest in by_user.last().items():
+            if not np.isnan(latest):
+                self._latest[uniques[code]] = latest
+
+        if 'Reason for change' in df.columns:
+            reason = df['Reason for change'].fillna(NOT_AVAILABLE).to_numpy()
+        else:
+            reason = np.full(len(df), NOT_AVAILABLE, dtype=object)
+        self.rows += len(df)
+        return pd.DataFrame({
+            'Timestamp': timestamps.to_numpy(),
+            'User': users.to_numpy(),
+            'Activity Description': df['Activity Description'].to_numpy(),
+            'Reason for change': reason,
+            'Anomaly': anomaly
+        })
+
+    def drift(self):
+        """How the schema differs from the canonical one of the file's format, or None"""
+        if self.columns is None:
+            return None
+        expected = CANONICAL_COLUMNS['csv' if self.format == 'csv' else 'columnar']
+        present = [c for c in self.columns if c in expected]
+        drift = {
+            'missing': [c for c in expected if c not in self.columns],
+            'extra': [c for c in self.columns if c not in expected and c not in OPTIONAL_COLUMNS],
+            'reordered': present != [c for c in expected if c in self.columns],
+            'kinds': {c: kind for c, kind in self.kinds.items()
+                      if c in expected and kind != CANONICAL_KINDS.get(c, 'string')}
+        }
+        return drift if any(drift.values()) else None
+
+    def report(self, seconds):
+        return {
+            'path': self.path,
+            'format': self.format,
+            'bytes': os.path.getsize(self.path) if os.path.exists(self.path) else None,
+            'rows': self.rows,
+            'seconds': round(seconds, 4),
+            'columns': self.columns,
+            'kinds': self.kinds,
+            'drift': self.drift(),
+            'labels': dict(sorted(self.labels.items())),
+            'users': len(self.users),
+            'first': None if self.first is None else self.first.isoformat(),
+            'last': None if self.last is None else self.last.isoformat(),
+            'issues': self.issues,
+            'examples': {name: examples for name, examples in self.examples.items() if examples},
+            'error': self.error
+        }
+
+def scan_file(path, chunk_rows=CHUNK_ROWS, emit=None):
+    """
+    Validate one file chunk by chunk and return its report. emit, when
+    given, receives every normalized chunk. A file that can't be read or
+    lacks the required columns gets an 'error' instead of raising
+    """
+    start = time.perf_counter()
+    scan = _FileScan(path)
+    try:
+        for df in iter_audit_log_batches(path, scan.format, chunk_rows):
+            chunk = scan.normalize(df)
+            if emit is not None:
+                emit(chunk)
+    except (OSError, ValueError) as e:
+        scan.error = f"{type(e).__name__}: {e}"
+    return scan.report(time.perf_counter() - start)
+
+def iter_corpus(paths, workers=None, chunk_rows=CHUNK_ROWS, max_pending=None, reports=None):
+    """
+    Yield (path, normalized chunk) for every file under paths, in the order
+    the reader threads produce them (in order within a file). At most
+    max_pending chunks (2 per worker by default) wait in the queue; a full
+    queue blocks the readers. Each file's report is stored in reports[path]
+    once the file is done
+    """
+    files = find_audit_logs(paths)
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    pending = queue.Queue(maxsize=max_pending or 2 * workers)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise _Stopped()
+
+    def read(path):
+        try:
+            put((path, scan_file(path, chunk_rows, lambda chunk: put((path, chunk)))))
+        except _Stopped:
+            pass
+        except Exception as e:
+            # Re-raised by the consumer rather than lost in the pool
+            try:
+                put((path, e))
+            except _Stopped:
+                pass
+
+    # Build the template registry once, before the threads share it
+    from templates import get_registry
+    get_registry()
+    executor = ThreadPoolExecutor(workers)
+    try:
+        for path in files:
+            executor.submit(read, path)
+        remaining = len(files)
+        while remaining:
+            path, item = pending.get()
+            if isinstance(item, Exception):
+                raise item
+            if isinstance(item, dict):
+                remaining -= 1
+                if reports is not None:
+                    reports[path] = item
+            else:
+                yield path, item
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def summarize(reports, seconds=None):
+    """Corpus report from the file reports: totals, schemas, drift, issues and errors"""
+    schemas = {}
+    for report in reports:
+        if report['columns'] is not None:
+            key = (tuple(report['columns']), tuple(sorted(report['kinds'].items())))
+            schemas.setdefault(key, []).append(report['path'])
+    issues = {}
+    for report in reports:
+        for name, count in report['issues'].items():
+            issues[name] = issues.get(name, 0) + count
+    rows = sum(report['rows'] for report in reports)
+    errors = {report['path']: report['error'] for report in reports if report['error']}
+    return {
+        'files': len(reports),
+        'rows': rows,
+        'bytes': sum(report['bytes'] or 0 for report in reports),
+        'seconds': None if seconds is None else round(seconds, 4),
+        'rows_per_second': round(rows / seconds, 1) if seconds else None,
+        'valid': not errors and not any(issues.values()),
+        'issues': issues,
+        'errors': errors,
+        'schemas': [{'columns': list(columns), 'kinds': dict(kinds), 'files': files}
+                    for (columns, kinds), files in sorted(schemas.items(), key=lambda item: -len(item[1]))],
+        'drift': {report['path']: report['drift'] for report in reports if report['drift']},
+        'file_reports': reports
+    }
+
+def validate_corpus(paths, workers=None, chunk_rows=CHUNK_ROWS):
+    """Validate every file under paths in parallel; returns the corpus report"""
+    start = time.perf_counter()
+    reports = {}
+    for _ in iter_corpus(paths, workers, chunk_rows, reports=reports):
+        pass
+    return summarize([reports[path] for path in sorted(reports)], time.perf_counter() - start)
+
+def load_corpus(paths, workers=None, chunk_rows=CHUNK_ROWS, with_source=False):
+    """
+    Every file under paths as one normalized DataFrame (files in sorted
+    order, each in its own row order), plus the corpus report. with_source
+    adds a categorical Source column with each row's file
+    """
+    import pandas as pd
+    start = time.perf_counter()
+    reports, chunks = {}, {}
+    for path, chunk in iter_corpus(paths, workers, chunk_rows, reports=reports):
+        chunks.setdefault(path, []).append(chunk)
+    frames = []
+    for path in sorted(chunks):
+        frame = pd.concat(chunks.pop(path), ignore_index=True)
+        if with_source:
+            frame['Source'] = path
+        frames.append(frame)
+    if frames:
+        df = pd.concat(frames, ignore_index=True)
+    else:
+        df = pd.DataFrame({column: pd.Series(dtype=object) for column in NORMALIZED_COLUMNS})
+    if with_source:
+        df['Source'] = df['Source'].astype('category')
+    return df, summarize([reports[path] for path in sorted(reports)], time.perf_counter() - start)
+
+def format_report(report):
+    """A short human-readable summary of a corpus report"""
+    lines = [f"{report['files']} files, {report['rows']:,} rows, {report['bytes']:,} bytes"
+             + (f" in {report['seconds']:.2f}s ({report['rows_per_second'] or 0:,.0f} rows/s)"
+                if report['seconds'] is not None else '')]
+    for schema in report['schemas']:
+        lines.append(f"  schema {', '.join(schema['columns'])}: {len(schema['files'])} files")
+    for path, drift in report['drift'].items():
+        details = [f"{key} {value}" for key, value in drift.items() if value and key != 'reordered']
+        if drift['reordered']:
+            details.insert(0, 'column order')
+        lines.append(f"  drift {path}: {'; '.join(details)}")
+    for name, count in report['issues'].items():
+        lines.append(f"  {name:<16} {count:>10,} rows")
+    for path, error in report['errors'].items():
+        lines.append(f"  error {path}: {error}")
+    lines.append('valid' if report['valid'] else 'INVALID')
+    return '\n'.join(lines)
+
+def main(argv=None):
+    import json
+    from output_formats import AuditLogWriter, from_columnar
+    parser = argparse.ArgumentParser(description="Load and validate a corpus of audit log files")
+    parser.add_argument('paths', nargs='+', help="audit log files or directories (csv, parquet, arrow)")
+    parser.add_argument('--workers', type=int, default=None, help="reader threads")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help="rows per CSV read")
+    parser.add_argument('--report', default=None, help="write the full report to this JSON file")
+    parser.add_argument('--output', default=None,
+                        help="also write the normalized rows here, in the order the chunks are read")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    reports = {}
+    chunks = iter_corpus(args.paths, args.workers, args.chunk_rows, reports=reports)
+    if args.output:
+        with AuditLogWriter(args.output) as writer:
+            for _, chunk in chunks:
+                writer.write(from_columnar(chunk) if writer.format == 'csv' else chunk)
+    else:
+        for _ in chunks:
+            pass
+    report = summarize([reports[path] for path in sorted(reports)], time.perf_counter() - start)
+
+    print(format_report(report))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0 if report['valid'] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""
+Content-addressed on-disk cache of generated datasets.
+
+    from dataset_cache import DatasetCache
+    cache = DatasetCache(max_bytes=10 * 2 ** 30)
+    path = cache.get('normal', seed=0, num_sequences=1500)     # generated once
+    df = cache.load('anomalies', seed=1, num_sequences=50)     # DataFrame, mmapped for parquet/arrow
+
+An entry is keyed on the generator name, its config, the seed and a hash of
+the generator source code plus the library versions that affect the output
+bytes, so any change to them yields a new key instead of a stale file.
+
+Entries are written to a temporary file and renamed into place, so a reader
+never sees a partial file. A per-key lock (fcntl.flock on a .lock file)
+makes concurrent jobs on one host wait for the first one to finish instead
+of generating the same dataset twice. Every hit refreshes the entry's
+mtime; once the cache grows past max_bytes the least recently used entries
+that nobody holds a lock on are removed.
+"""
+import contextlib
+import fcntl
+import functools
+import hashlib
+import json
+import mmap
+import os
+import time
+
+from output_formats import EXTENSIONS, format_for_path
+
+# Modules whose code determines the generated bytes
+SOURCE_MODULES = ['augmentation', 'incorrect_augmentation', 'demo', 'templates', 'events', 'output_formats',
+                  'seeding', 'sharding', 'scenario']
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'audit_logs')
+
+FORMAT_EXTENSIONS = {fmt: ext for ext, fmt in reversed(list(EXTENSIONS.items()))}
+
+# Options each generator falls back to, filled in so they don't change the key
+GENERATOR_DEFAULTS = {
+    'normal': {'vectorized': False, 'chunk_size': 10000},
+    'anomalies': {'anomaly_probability': 0.3, 'chunk_size': 10000}
+}
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """Hash of the generator sources and the library versions behind them"""
+    import importlib.metadata
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in SOURCE_MODULES:
+        with open(os.path.join(directory, f'{module}.py'), 'rb') as f:
+            digest.update(f.read())
+    for package in ('numpy', 'pandas', 'pyarrow'):
+        try:
+            digest.update(f"{package}={importlib.metadata.version(package)}".encode())
+        except importlib.metadata.PackageNotFoundError:
+            pass
+    return digest.hexdigest()[:16]
+
+def dataset_key(generator, config, seed):
+    """Content address of one dataset request"""
+    request = {'generator': generator, 'config': config, 'seed': seed, 'code': code_version()}
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()[:32]
+
+def _generate(generator, path, seed, output_format, config):
+    """Write one dataset to path; returns the number of records"""
+    config = dict(config)
+    num_sequences = config.pop('num_sequences')
+    chunk_size = config.pop('chunk_size')
+    num_shards = config.pop('num_shards', None)
+    if num_shards:
+        from sharding import generate_sharded
+        return generate_sharded(generator, num_sequences, path, seed=seed, num_shards=num_shards,
+                                chunk_size=chunk_size, output_format=output_format, **config)[1]
+    if generator == 'normal':
+        from augmentation import stream_audit_logs
+        return stream_audit_logs(num_sequences, path, chunk_size, config['vectorized'], rng=seed,
+                                 output_format=output_format, scenario=config.get('scenario'))
+    from incorrect_augmentation import save_dataset
+    return save_dataset(num_sequences, path, config['anomaly_probability'], rng=seed, chunk_size=chunk_size,
+                        output_format=output_format, scenario=config.get('scenario'))
+
+class DatasetCache:
+    """A directory of generated datasets, addressed by dataset_key"""
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or os.environ.get('AUDIT_LOG_CACHE_DIR', DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, generator, seed, output_format='csv', **config):
+        """
+        Path of the cached dataset, generating it first if needed. config
+        holds num_sequences and the generator's options (vectorized,
+        anomaly_probability, chunk_size, num_shards, scenario)
+        """
+        if generator not in GENERATOR_DEFAULTS:
+            raise ValueError(f"Unknown generator {generator!r}, expected one of {tuple(GENERATOR_DEFAULTS)}")
+        if not isinstance(seed, int):
+            raise ValueError("Only datasets generated from an integer seed can be cached")
+        output_format = format_for_path('', output_format)
+        config = {**GENERATOR_DEFAULTS[generator], **{k: v for k, v in config.items() if v is not None}}
+        key_config = {**config, 'output_format': output_format}
+        if 'scenario' in config:
+            # Keyed on the compiled spec rather than its path
+            from scenario import resolve_scenario
+            key_config['scenario'] = resolve_scenario(config['scenario']).digest
+        key = dataset_key(generator, key_config, seed)
+        path = os.path.join(self.cache_dir, key + FORMAT_EXTENSIONS[output_format])
+
+        try:
+            # Refreshing the mtime is the existence check too: an entry evicted
+            # in between falls through to the locked path below
+            os.utime(path)
+            self.hits += 1
+            return path
+        except FileNotFoundError:
+            pass
+        with self._lock(key):
+            if os.path.exists(path):
+                # Another job generated it while we waited for the lock
+                os.utime(path)
+                self.hits += 1
+                return path
+            root, ext = os.path.splitext(path)
+            tmp_path = f'{root}.tmp-{os.getpid()}{ext}'
+            try:
+                num_records = _generate(generator, tmp_path, seed, output_format, config)
+                with open(root + '.json.tmp', 'w') as f:
+                    json.dump({'generator': generator, 'seed': seed, 'config': key_config, 'code': code_version(),
+                               'num_records': num_records, 'created': time.time()}, f)
+                os.replace(root + '.json.tmp', root + '.json')
+                os.replace(tmp_path, path)
+            finally:
+                for stale in (tmp_path, root + '.json.tmp'):
+                    if os.path.exists(stale):
+                        os.remove(stale)
+            self.misses += 1
+        if self.max_bytes is not None:
+            self.evict(keep=path)
+        return path
+
+    def open(self, generator, seed, output_format='csv', **config):
+        """The cached dataset as a read-only memory map"""
+        with open(self.get(generator, seed, output_format, **config), 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def load(self, generator, seed, output_format='parquet', **config):
+        """The cached dataset as a DataFrame (columnar formats are memory-mapped)"""
+        from output_formats import read_audit_logs
+        return read_audit_logs(self.get(generator, seed, output_format, **config), output_format)
+
+    def entries(self):
+        """(path, size, last used) of every complete entry, least recently used first"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            root, ext = os.path.splitext(name)
+            if ext not in FORMAT_EXTENSIONS.values() or '.tmp-' in root:
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the cache fits in max_bytes,
+        along with temporary files left behind by crashed jobs
+        """
+        for name in os.listdir(self.cache_dir):
+            if '.tmp-' in name or name.endswith('.json.tmp'):
+                with self._lock(name.split('.')[0], blocking=False) as locked:
+                    if locked and os.path.exists(os.path.join(self.cache_dir, name)):
+                        os.remove(os.path.join(self.cache_dir, name))
+
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.max_bytes is None or total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            root = os.path.splitext(path)[0]
+            with self._lock(os.path.basename(root), blocking=False) as locked:
+                if not locked:
+                    # Being generated or evicted by another job
+                    continue
+                for stale in (path, root + '.json', root + '.lock'):
+                    if os.path.exists(stale):
+                        os.remove(stale)
+            total -= size
+
+    @contextlib.contextmanager
+    def _lock(self, key, blocking=True):
+        """
+        Exclusive per-key lock; yields whether it was acquired. The lock file
+        is re-checked after locking in case an eviction replaced it meanwhile
+        """
+        lock_path = os.path.join(self.cache_dir, key + '.lock')
+        flags = fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB)
+        while True:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, flags)
+            except BlockingIOError:
+                os.close(fd)
+                yield False
+                return
+            try:
+                same_file = os.path.samestat(os.fstat(fd), os.stat(lock_path))
+            except FileNotFoundError:
+                same_file = False
+            if same_file:
+                break
+            os.close(fd)
+        try:
+            yield True
+        finally:
+            os.close(fd)
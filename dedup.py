@@ -0,0 +1,431 @@
+"""
+Sequence-level deduplication of audit log streams.
+
+    from augmentation import iter_audit_log_chunks
+    from dedup import Deduplicator
+    dedup = Deduplicator(near_duplicates=True)
+    for chunk in dedup.filter(iter_audit_log_chunks(1000000, vectorized=True, rng=0, render=False)):
+        ...
+    print(dedup.stats())
+
+    python dedup.py enhanced_audit_logs1.5k.csv --output deduped.csv --near-duplicates
+
+Sequences are delimited as in anomaly_scorer: per user, from a login to the
+next one, so rows logged after a logout stay with their sequence. A
+sequence is closed by the user's next login, by max_open pushing out the
+least recently active, or by max_held closing the earliest ones. Every row becomes a token of its activity
+type, template and placeholder values, with identifier slots (the batch
+number after a '#') blanked, as they would make every sequence unique. A
+sequence's hash is a polynomial hash of its tokens, computed for all the
+sequences of a chunk at once. Unrendered chunks (render=False, with
+Template and Param columns) are tokenized without parsing descriptions.
+
+Exact duplicates are sequences whose hash was seen before. Seen hashes go
+into a Bloom filter sized by capacity and error_rate, so memory is fixed
+however long the stream runs; the price is that a first occurrence is taken
+for a duplicate with probability error_rate. Near duplicates (optional) are
+found with MinHash signatures over token shingles and an LSH index made of
+direct-mapped band tables plus a ring of the latest max_signatures
+signatures. Candidates are verified by their estimated Jaccard similarity,
+so a bucket overwritten by a later sequence only costs recall.
+
+mode='drop' removes the rows of duplicate sequences; mode='weight' keeps
+them and adds a Weight column (duplicate_weight for duplicates, 1
+otherwise). Rows come out in stream order, up to the first row of a
+sequence still open.
+"""
+import argparse
+import hashlib
+import math
+import sys
+
+import profiling
+
+MODES = ('drop', 'weight')
+
+# A placeholder right after this is an identifier (a batch number), not a value
+IDENTIFIER_MARK = '#'
+IDENTIFIER_PATTERN = r'#\S+'
+
+# Tokens per MinHash shingle
+SHINGLE_SIZE = 3
+
+# Row kinds
+OTHER, LOGIN, LOGOUT = 0, 1, 2
+
+# Decision of a held row whose sequence is still open
+UNDECIDED = -1
+
+# Odd 64-bit multipliers for the polynomial sequence hash and the shingles
+_POLY = 0x9E3779B97F4A7C15
+_SHINGLE = (0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0x27D4EB2F165667C5)
+
+def _mix(x):
+    """splitmix64 finalizer over a uint64 array"""
+    import numpy as np
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+class _Tokenizer:
+    """Description -> (token, row kind), cached up to max_cache descriptions"""
+
+    def __init__(self, max_cache=1000000):
+        import numpy as np
+        from activity_classifier import get_classifier
+        self.classifier = get_classifier()
+        self.cache = {}
+        self.max_cache = max_cache
+        # Per template, whether each of its two slots holds an identifier
+        self._identifier_slots = np.zeros((0, 2), dtype=bool)
+
+    def tokens(self, descriptions):
+        """Token and row kind of every description"""
+        import numpy as np
+        import pandas as pd
+        # Identifiers blanked first, so their descriptions are classified once
+        masked = pd.Series(descriptions).astype(str).str.replace(IDENTIFIER_PATTERN, IDENTIFIER_MARK + '0',
+                                                                 regex=True)
+        codes, uniques = pd.factorize(masked.to_numpy(dtype=object))
+        if len(self.cache) > self.max_cache:
+            self.cache.clear()
+        tokens = np.empty(len(uniques), dtype=np.uint64)
+        kinds = np.empty(len(uniques), dtype=np.int8)
+        for i, description in enumerate(uniques.tolist()):
+            entry = self.cache.get(description)
+            if entry is None:
+                template, slots = self.classifier.classify(description)
+                entry = self.cache[description] = _token(template, slots, description)
+            tokens[i], kinds[i] = entry
+        return tokens[codes], kinds[codes]
+
+    def template_tokens(self, template_ids, first, second):
+        """The same tokens for unrendered rows: template IDs and their two placeholder values"""
+        import numpy as np
+        import pandas as pd
+        templates = self.classifier.registry.templates
+        if len(self._identifier_slots) != len(templates):
+            self._identifier_slots = np.array([[len(t.literals) > i + 1 and t.literals[i].endswith(IDENTIFIER_MARK)
+                                                for i in range(2)] for t in templates], dtype=bool)
+        template_ids = np.asarray(template_ids, dtype=np.int64)
+        identifiers = self._identifier_slots[template_ids]
+        first = np.where(identifiers[:, 0], '', np.asarray(first, dtype=object))
+        second = np.where(identifiers[:, 1], '', np.asarray(second, dtype=object))
+        first_codes, first_values = pd.factorize(first, use_na_sentinel=False)
+        second_codes, second_values = pd.factorize(second, use_na_sentinel=False)
+        keys = (template_ids * (len(first_values) + 1) + first_codes) * (len(second_values) + 1) + second_codes
+        codes, uniques = pd.factorize(keys)
+        rows = np.empty(len(uniques), dtype=np.int64)
+        rows[codes[::-1]] = np.arange(len(codes))[::-1]
+        if len(self.cache) > self.max_cache:
+            self.cache.clear()
+        tokens = np.empty(len(uniques), dtype=np.uint64)
+        kinds = np.empty(len(uniques), dtype=np.int8)
+        for i, (template_id, value1, value2) in enumerate(zip(template_ids[rows].tolist(),
+                                                             first[rows].tolist(), second[rows].tolist())):
+            key = (template_id, value1, value2)
+            entry = self.cache.get(key)
+            if entry is None:
+                template = templates[template_id]
+                slots = (str(value1), str(value2))[:len(template.fields)]
+                entry = self.cache[key] = _token(template, slots, None)
+            tokens[i], kinds[i] = entry
+        return tokens[codes], kinds[codes]
+
+def _token(template, slots, description):
+    """
+    Stable 64-bit token of a classified row (description is only used when
+    template is None) and its kind
+    """
+    if template is None:
+        key = '\x00' + description
+        kind = OTHER
+    else:
+        # literals[i] is the text before slot i
+        slots = ['' if template.literals[i].endswith(IDENTIFIER_MARK) else slot for i, slot in enumerate(slots)]
+        key = '\x1f'.join([template.activity_type, template.text] + slots)
+        kind = {'login': LOGIN, 'logout': LOGOUT}.get(template.activity_type, OTHER)
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little'), kind
+
+class _BloomFilter:
+    """Fixed-size set of uint64 hashes with a false positive rate of about error_rate up to capacity"""
+
+    def __init__(self, capacity, error_rate):
+        import numpy as np
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError(f"Need capacity >= 1 and 0 < error_rate < 1, got {capacity}, {error_rate}")
+        self.num_bits = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def add(self, hashes):
+        """Insert distinct hashes; returns which of them were (probably) present already"""
+        import numpy as np
+        first = hashes & np.uint64(0xFFFFFFFF)
+        step = (hashes >> np.uint64(32)) | np.uint64(1)
+        # Double hashing: k bit positions from two halves of the hash
+        positions = (first[:, None] + np.arange(self.num_hashes, dtype=np.uint64) * step[:, None])
+        positions %= np.uint64(self.num_bits)
+        byte, bit = positions >> np.uint64(3), (positions & np.uint64(7)).astype(np.uint8)
+        present = ((self.bits[byte] >> bit) & 1).all(axis=1)
+        np.bitwise_or.at(self.bits, byte.ravel(), (np.uint8(1) << bit).ravel())
+        self.count += int((~present).sum())
+        return present
+
+class _NearDuplicateIndex:
+    """MinHash signatures with an LSH index of bands direct-mapped tables"""
+
+    def __init__(self, threshold=0.8, num_perm=64, bands=16, max_signatures=200000, table_bits=18, seed=0):
+        import numpy as np
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        rng = np.random.default_rng(seed)
+        self.threshold = threshold
+        self.bands = bands
+        self.multipliers = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.offsets = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+        self.band_multipliers = rng.integers(1, 2 ** 63, size=num_perm // bands, dtype=np.uint64) | np.uint64(1)
+        self.tables = np.full((bands, 1 << table_bits), -1, dtype=np.int64)
+        self.signatures = np.zeros((max_signatures, num_perm), dtype=np.uint32)
+        self.inserted = 0
+
+    def signatures_of(self, tokens, starts, lengths, hashes):
+        """
+        MinHash signatures of the sequences laid out contiguously in tokens;
+        a sequence shorter than a shingle has its hash as its only shingle
+        """
+        import numpy as np
+        sequence_of_row = np.repeat(np.arange(len(starts)), lengths)
+        position = np.arange(len(tokens)) - starts[sequence_of_row]
+        remaining = lengths[sequence_of_row] - position
+        shingles = np.where(remaining >= SHINGLE_SIZE, np.uint64(0), hashes[sequence_of_row])
+        for k, multiplier in enumerate(_SHINGLE):
+            shifted = np.zeros_like(tokens)
+            shifted[:len(tokens) - k] = tokens[k:]
+            shingles += np.where(remaining >= SHINGLE_SIZE, shifted * np.uint64(multiplier), np.uint64(0))
+        keep = (remaining >= SHINGLE_SIZE) | ((position == 0) & (lengths[sequence_of_row] < SHINGLE_SIZE))
+        shingles, owners = _mix(shingles[keep]), sequence_of_row[keep]
+        shingle_starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+
+        signatures = np.empty((len(starts), len(self.multipliers)), dtype=np.uint32)
+        # Slices of whole sequences, so the (shingles x permutations) matrix stays small
+        step = max(1, (1 << 20) // len(self.multipliers))
+        for first in range(0, len(starts), step):
+            lo = shingle_starts[first]
+            hi = shingle_starts[first + step] if first + step < len(starts) else len(shingles)
+            # Permutations by rows, so the reduction runs along contiguous memory
+            permuted = (self.multipliers[:, None] * shingles[lo:hi] + self.offsets[:, None]) >> np.uint64(32)
+            signatures[first:first + step] = np.minimum.reduceat(permuted, shingle_starts[first:first + step] - lo,
+                                                                 axis=1).T
+        return signatures
+
+    def _band_hashes(self, signatures):
+        import numpy as np
+        rows = signatures.reshape(len(signatures), self.bands, -1).astype(np.uint64)
+        return _mix((rows * self.band_multipliers).sum(axis=2, dtype=np.uint64))
+
+    def add(self, signatures):
+        """
+        Insert the signatures; returns which of them are near duplicates of an
+        indexed one or of an earlier one in the same call
+        """
+        import numpy as np
+        n, capacity = len(signatures), len(self.signatures)
+        band_hashes = self._band_hashes(signatures)
+        buckets = (band_hashes % np.uint64(self.tables.shape[1])).astype(np.int64)
+        near = np.zeros(n, dtype=bool)
+
+        # Against the index, in slices to bound the candidate matrix
+        for lo in range(0, n, 4096):
+            slots = self.tables[np.arange(self.bands), buckets[lo:lo + 4096]]
+            live = (slots >= 0) & (slots >= self.inserted - capacity)
+            candidates = self.signatures[slots % capacity]
+            similarity = (candidates == signatures[lo:lo + 4096, None, :]).mean(axis=2)
+            near[lo:lo + 4096] = (np.where(live, similarity, 0) >= self.threshold).any(axis=1)
+
+        # Against the first earlier sequence sharing a band within this call
+        rows = np.arange(n)
+        for band in range(self.bands):
+            _, first, inverse = np.unique(band_hashes[:, band], return_index=True, return_inverse=True)
+            earlier = first[inverse]
+            pairs = np.flatnonzero(earlier < rows)
+            similarity = (signatures[pairs] == signatures[earlier[pairs]]).mean(axis=1)
+            near[pairs[similarity >= self.threshold]] = True
+
+        keep = slice(max(0, n - capacity), n)
+        ids = self.inserted + rows[keep]
+        self.signatures[ids % capacity] = signatures[keep]
+        for band in range(self.bands):
+            self.tables[band, buckets[keep, band]] = ids
+        self.inserted += n
+        return near
+
+class Deduplicator:
+    """
+    Streaming sequence deduplication: process() chunks of row-format frames
+    (rendered, or with Template/Param columns) and flush() at the end, or
+    wrap a chunk iterator with filter()
+    """
+
+    def __init__(self, mode='drop', near_duplicates=False, duplicate_weight=0.0, capacity=10000000,
+                 error_rate=1e-6, threshold=0.8, num_perm=64, bands=16, max_signatures=200000, max_open=100000,
+                 max_held=1000000, seed=0):
+        import numpy as np
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode!r}, expected one of {MODES}")
+        self.mode = mode
+        self.duplicate_weight = duplicate_weight
+        self.max_open = max_open
+        self.max_held = max_held
+        self.tokenizer = _Tokenizer()
+        self.seen = _BloomFilter(capacity, error_rate)
+        self.near = None
+        if near_duplicates:
+            self.near = _NearDuplicateIndex(threshold, num_perm, bands, max_signatures, seed=seed)
+        self.counts = {'rows_in': 0, 'rows_out': 0, 'sequences': 0, 'duplicates': 0, 'near_duplicates': 0}
+        # Rows from the first open sequence on: (frame, tokens, kinds, decision)
+        self._held = None
+        self._powers = np.ones(1, dtype=np.uint64)
+
+    def process(self, df):
+        """Rows of the sequences closed by this chunk, after dropping or weighting duplicates"""
+        with profiling.stage('dedup'):
+            return self._process(df, final=False)
+
+    def flush(self):
+        """Close every open sequence and return its rows"""
+        with profiling.stage('dedup'):
+            return self._process(None, final=True)
+
+    def filter(self, chunks):
+        """Yield the deduplicated rows of an iterable of chunks"""
+        for chunk in chunks:
+            out = self.process(chunk)
+            if len(out):
+                yield out
+        out = self.flush()
+        if len(out):
+            yield out
+
+    def stats(self):
+        held = self._held
+        open_users = 0 if held is None else held[0]['User'][held[3] == UNDECIDED].nunique()
+        return {**self.counts, 'open_sequences': int(open_users), 'distinct_hashes': self.seen.count}
+
+    def _process(self, df, final):
+        import numpy as np
+        import pandas as pd
+        parts = [] if self._held is None else [self._held]
+        if df is not None and len(df):
+            if 'Activity Description' in df.columns:
+                tokens, kinds = self.tokenizer.tokens(df['Activity Description'])
+            else:
+                tokens, kinds = self.tokenizer.template_tokens(df['Template'], df['Param 1'], df['Param 2'])
+            self.counts['rows_in'] += len(df)
+            parts.append((df.reset_index(drop=True), tokens, kinds, np.full(len(df), UNDECIDED, dtype=np.int8)))
+        if not parts:
+            return pd.DataFrame()
+        df = pd.concat([part[0] for part in parts], ignore_index=True) if len(parts) > 1 else parts[0][0]
+        tokens, kinds, decided = (np.concatenate([part[i] for part in parts]) for i in (1, 2, 3))
+
+        # Per user, a sequence starts at a login or with the user's first undecided row
+        rows = np.flatnonzero(decided == UNDECIDED)
+        users = pd.factorize(df['User'].to_numpy()[rows], use_na_sentinel=False)[0].astype(np.int64)
+        first_of_user = ~pd.Series(users).duplicated().to_numpy()
+        number = pd.Series((kinds[rows] == LOGIN) | first_of_user).groupby(users).cumsum().to_numpy()
+        sequence = pd.factorize(number * (users.max(initial=0) + 1) + users)[0]
+
+        # Closed: followed by another sequence of the user. Past max_open open
+        # sequences or max_held held rows, the least recently active or the
+        # earliest ones are closed as well
+        closed = np.ones(len(rows), dtype=bool)
+        if not final:
+            closed = number < pd.Series(number).groupby(users).transform('max').to_numpy()
+            open_rows = pd.Series(rows[~closed]).groupby(sequence[~closed])
+            last_seen = open_rows.max().sort_values(kind='stable')
+            evicted = list(last_seen.index[:len(last_seen) - self.max_open])
+            first_seen = open_rows.min().sort_values(kind='stable')
+            evicted += list(first_seen.index[:np.searchsorted(first_seen.to_numpy(), len(df) - self.max_held, 'right')])
+            closed |= np.isin(sequence, evicted)
+        decided[rows[closed]] = self._duplicates(tokens[rows[closed]], sequence[closed])
+
+        # Emit up to the first row of a sequence still open, keeping stream order
+        cut = rows[~closed][0] if not closed.all() else len(df)
+        self._held = (df.iloc[cut:].reset_index(drop=True), tokens[cut:], kinds[cut:], decided[cut:]) \
+            if cut < len(df) else None
+        out = df.iloc[:cut]
+        if self.mode == 'drop':
+            out = out[decided[:cut] == 0].reset_index(drop=True)
+        else:
+            out = out.assign(Weight=np.where(decided[:cut] == 1, self.duplicate_weight, 1.0))
+        self.counts['rows_out'] += len(out)
+        return out
+
+    def _duplicates(self, tokens, sequence):
+        """Whether each row (in stream order) belongs to a duplicate sequence"""
+        import numpy as np
+        import pandas as pd
+        if not len(tokens):
+            return np.zeros(0, dtype=bool)
+        # Number the sequences by first appearance and lay their rows out contiguously
+        codes = pd.factorize(sequence)[0]
+        order = np.argsort(codes, kind='stable')
+        lengths = np.bincount(codes)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        grouped = tokens[order]
+
+        if len(self._powers) < lengths.max():
+            self._powers = np.cumprod(np.r_[np.uint64(1), np.full(lengths.max() - 1, _POLY, dtype=np.uint64)],
+                                      dtype=np.uint64)
+        position = np.arange(len(grouped)) - np.repeat(starts, lengths)
+        hashes = np.add.reduceat(grouped * self._powers[position], starts, dtype=np.uint64)
+        hashes = _mix(hashes ^ lengths.astype(np.uint64) * np.uint64(_POLY))
+
+        # Repeats within the chunk, then against every earlier chunk
+        unique_hashes, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+        seen_before = self.seen.add(unique_hashes)
+        duplicate = seen_before[inverse] | (first[inverse] != np.arange(len(hashes)))
+        near = np.zeros(len(hashes), dtype=bool)
+        if self.near is not None:
+            near = self.near.add(self.near.signatures_of(grouped, starts, lengths, hashes)) & ~duplicate
+
+        self.counts['sequences'] += len(hashes)
+        self.counts['duplicates'] += int(duplicate.sum())
+        self.counts['near_duplicates'] += int(near.sum())
+        profiling.count('dedup.sequences', len(hashes))
+        profiling.count('dedup.duplicates', int(duplicate.sum()))
+        profiling.count('dedup.near_duplicates', int(near.sum()))
+        return (duplicate | near)[codes]
+
+def main(argv=None):
+    from output_formats import AuditLogWriter, format_for_path, iter_audit_log_batches
+    parser = argparse.ArgumentParser(description="Drop or down-weight duplicate sequences of audit logs")
+    parser.add_argument('input', help="audit log file (csv, parquet or arrow)")
+    parser.add_argument('--output', required=True, help="write the deduplicated log here")
+    parser.add_argument('--mode', choices=MODES, default='drop')
+    parser.add_argument('--duplicate-weight', type=float, default=0.0, help="Weight of duplicates in weight mode")
+    parser.add_argument('--near-duplicates', action='store_true', help="also catch near duplicates (MinHash/LSH)")
+    parser.add_argument('--threshold', type=float, default=0.8, help="estimated Jaccard similarity of near duplicates")
+    parser.add_argument('--capacity', type=int, default=10000000,
+                        help="distinct sequences the Bloom filter is sized for")
+    parser.add_argument('--error-rate', type=float, default=1e-6)
+    args = parser.parse_args(argv)
+    if args.mode == 'weight' and format_for_path(args.output) != 'csv':
+        parser.error("--mode weight needs a CSV output, the columnar layout has no Weight column")
+
+    dedup = Deduplicator(args.mode, args.near_duplicates, args.duplicate_weight, args.capacity, args.error_rate,
+                         args.threshold)
+    with AuditLogWriter(args.output) as writer:
+        for chunk in dedup.filter(iter_audit_log_batches(args.input)):
+            writer.write(chunk)
+    stats = dedup.stats()
+    print(f"{stats['sequences']:,} sequences: {stats['duplicates']:,} duplicates, "
+          f"{stats['near_duplicates']:,} near duplicates")
+    print(f"Wrote {stats['rows_out']:,} of {stats['rows_in']:,} rows to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,114 +1,135 @@
-import pandas as pd
-import random
+import itertools
 from datetime import datetime, timedelta
+import profiling
+from output_formats import write_audit_logs
+from seeding import python_rng
+
+# Standard batch sequence template: (activity type, description template)
+CORRECT_SEQUENCE = [
+    ("login", "User logged into the system"),
+    ("batch_prep", "Loaded recipe for batch #{batch_num}"),
+    ("equipment_check", "Initiated pre-operation equipment check"),
+    ("calibration", "Verified calibration of scales"),
+    ("batch_start", "Started coating process for batch #{batch_num}"),
+    ("temp_adjust", "Adjusted inlet air temperature from {temp1}°C to {temp2}°C"),
+    ("spray_adjust", "Adjusted spray rate from {spray1} mL/min to {spray2} mL/min"),
+    ("quality_check", "Performed intermediate quality check"),
+    ("solution_change", "Changed coating solution to type {solution}"),
+    ("drum_speed", "Adjusted drum speed from {rpm1} RPM to {rpm2} RPM"),
+    ("quality_check", "Performed final quality check"),
+    ("batch_end", "Stopped coating process for batch #{batch_num}"),
+    ("logout", "Logged out of the system")
+]
 
 def create_correct_sequence():
     """Create a correct sequence for a coating batch process"""
+    from events import AuditEventBuilder, epoch_seconds
+    from templates import get_registry
     
-    sequence = [
-        # Standard batch sequence template
-        {"Activity Description": "User logged into the system", "User": "operator1"},
-        {"Activity Description": "Loaded recipe for batch #{batch_num}", "User": "operator1"},
-        {"Activity Description": "Initiated pre-operation equipment check", "User": "operator1"},
-        {"Activity Description": "Verified calibration of scales", "User": "operator1"},
-        {"Activity Description": "Started coating process for batch #{batch_num}", "User": "operator1"},
-        {"Activity Description": "Adjusted inlet air temperature from {temp1}°C to {temp2}°C", "User": "operator1"},
-        {"Activity Description": "Adjusted spray rate from {spray1} mL/min to {spray2} mL/min", "User": "operator1"},
-        {"Activity Description": "Performed intermediate quality check", "User": "operator1"},
-        {"Activity Description": "Changed coating solution to type {solution}", "User": "operator1"},
-        {"Activity Description": "Adjusted drum speed from {rpm1} RPM to {rpm2} RPM", "User": "operator1"},
-        {"Activity Description": "Performed final quality check", "User": "operator1"},
-        {"Activity Description": "Stopped coating process for batch #{batch_num}", "User": "operator1"},
-        {"Activity Description": "Logged out of the system", "User": "operator1"}
-    ]
+    registry = get_registry()
+    sequence = [registry.lookup(text) for _, text in CORRECT_SEQUENCE]
     
-    batches = []
+    events = AuditEventBuilder()
     start_time = datetime(2024, 8, 27, 8, 0, 0)
     solutions = ['A', 'B', 'C']
     
     for batch_num in range(1, 7):
-        batch_sequence = []
         current_time = start_time + timedelta(hours=2*(batch_num-1))
+        params = {
+            "batch_num": str(batch_num).zfill(3),
+            "temp1": 145 + batch_num,
+            "temp2": 150 + batch_num,
+            "spray1": 8 + batch_num,
+            "spray2": 10 + batch_num,
+            "rpm1": 12 + batch_num,
+            "rpm2": 15 + batch_num,
+            "solution": solutions[batch_num % 3]
+        }
         
-        for idx, step in enumerate(sequence):
-            step_dict = step.copy()
-            
-            desc = step_dict["Activity Description"]
-            desc = desc.replace("{batch_num}", str(batch_num).zfill(3))
-            desc = desc.replace("{temp1}", str(145 + batch_num))
-            desc = desc.replace("{temp2}", str(150 + batch_num))
-            desc = desc.replace("{spray1}", str(8 + batch_num))
-            desc = desc.replace("{spray2}", str(10 + batch_num))
-            desc = desc.replace("{rpm1}", str(12 + batch_num))
-            desc = desc.replace("{rpm2}", str(15 + batch_num))
-            desc = desc.replace("{solution}", solutions[batch_num % 3])
-            
-            step_dict["Activity Description"] = desc
-            step_dict["Date"] = current_time.strftime("%Y-%m-%d")
-            step_dict["Time"] = current_time.strftime("%H:%M:%S")
-            step_dict["Reason for change"] = "Not Available"
-            step_dict["Anomaly"] = 0
-            
-            batch_sequence.append(step_dict)
+        for template in sequence:
+            events.append(epoch_seconds(current_time), "operator1", template.template_id,
+                          [params[field] for field in template.fields])
             current_time += timedelta(minutes=5)
-        
-        batches.extend(batch_sequence)
     
-    return pd.DataFrame(batches)
+    df = events.build().to_frame()
+    return df[["Activity Description", "User", "Date", "Time", "Reason for change", "Anomaly"]]
 
-def create_anomalous_sequence(correct_df, num_anomalies=3):
-    """Create an anomalous sequence by introducing various types of anomalies"""
+UNEXPECTED_ACTIONS = [
+    "Attempted unauthorized recipe modification",
+    "Bypassed safety interlock",
+    "Changed batch parameters without approval",
+    "Disabled temperature monitoring",
+    "Overrode system warnings"
+]
+
+# Out-of-range values used by modify_parameter: (marker, low, high, unit)
+ANOMALOUS_PARAMETERS = [
+    ("temperature", 160, 180, "°C"),
+    ("RPM", 25, 30, " RPM"),
+    ("mL/min", 20, 25, " mL/min")
+]
+
+def _parameter_edit(desc, cache):
+    """Return (prefix, low, high, unit) for a parameter-bearing description, else None"""
+    if desc not in cache:
+        cache[desc] = None
+        for marker, low, high, unit in ANOMALOUS_PARAMETERS:
+            if marker in desc:
+                cache[desc] = (desc.split("to")[0], low, high, unit)
+                break
+    return cache[desc]
+
+def _inject_anomalies(columns, num_rows, num_anomalies, edit_cache, rng):
+    """
+    Apply num_anomalies random anomalies to one variant and return its row
+    order. Rows [0, num_rows) of `columns` are the shared base sequence and are
+    never modified: a row is copied to the end of the columns the first time
+    a variant writes to it, and inserted rows are appended the same way
+    """
+    descriptions = columns["Activity Description"]
+    anomalies = columns["Anomaly"]
+    order = list(range(num_rows))
+    first_own = len(descriptions)
     
-    df = correct_df.copy()
+    def own(idx):
+        """Copy the row at position idx unless this variant already owns it"""
+        row = order[idx]
+        if row < first_own:
+            for values in columns.values():
+                values.append(values[row])
+            row = order[idx] = len(descriptions) - 1
+        return row
     
-    def swap_steps(df, idx1, idx2):
+    def swap_steps(order, idx1, idx2):
         """Swap two steps in the sequence"""
-        df.iloc[idx1:idx2+1] = df.iloc[idx1:idx2+1][::-1].values
-        df.iloc[idx1:idx2+1, df.columns.get_loc("Anomaly")] = 1
-        return df
+        order[idx1:idx2+1] = order[idx1:idx2+1][::-1]
+        for idx in range(idx1, idx2+1):
+            anomalies[own(idx)] = 1
     
-    def modify_parameter(df, idx):
+    def modify_parameter(order, idx):
         """Modify a parameter to an anomalous value"""
-        desc = df.iloc[idx]["Activity Description"]
-        if "temperature" in desc:
-            new_value = random.randint(160, 180)
-            desc = desc.split("to")[0] + f"to {new_value}°C"
-        elif "RPM" in desc:
-            new_value = random.randint(25, 30)
-            desc = desc.split("to")[0] + f"to {new_value} RPM"
-        elif "mL/min" in desc:
-            new_value = random.randint(20, 25)
-            desc = desc.split("to")[0] + f"to {new_value} mL/min"
-        
-        df.iloc[idx, df.columns.get_loc("Activity Description")] = desc
-        df.iloc[idx, df.columns.get_loc("Anomaly")] = 1
-        return df
+        row = own(idx)
+        edit = _parameter_edit(descriptions[row], edit_cache)
+        if edit is not None:
+            prefix, low, high, unit = edit
+            descriptions[row] = prefix + f"to {rng.randint(low, high)}{unit}"
+        anomalies[row] = 1
     
-    def insert_unexpected_action(df, idx):
+    def insert_unexpected_action(order, idx):
         """Insert an unexpected action"""
-        unexpected_actions = [
-            "Attempted unauthorized recipe modification",
-            "Bypassed safety interlock",
-            "Changed batch parameters without approval",
-            "Disabled temperature monitoring",
-            "Overrode system warnings"
-        ]
-        
-        new_row = df.iloc[idx].copy()
-        new_row["Activity Description"] = random.choice(unexpected_actions)
-        new_row["Anomaly"] = 1
-        
-        df = pd.concat([df.iloc[:idx], 
-                       pd.DataFrame([new_row]), 
-                       df.iloc[idx:]]).reset_index(drop=True)
-        return df
+        # The new row copies the current one, then gets its own description
+        source = order[idx]
+        for values in columns.values():
+            values.append(values[source])
+        descriptions[-1] = rng.choice(UNEXPECTED_ACTIONS)
+        anomalies[-1] = 1
+        order.insert(idx, len(descriptions) - 1)
     
-    def skip_step(df, idx):
+    def skip_step(order, idx):
         """Skip a critical step"""
-        df = df.drop(idx).reset_index(drop=True)
-        if idx < len(df):
-            df.iloc[idx, df.columns.get_loc("Anomaly")] = 1
-        return df
+        del order[idx]
+        if idx < len(order):
+            anomalies[own(idx)] = 1
     
     # List of possible anomaly functions
     anomaly_functions = [
@@ -120,41 +141,94 @@ def create_anomalous_sequence(correct_df, num_anomalies=3):
     
     # Apply random anomalies
     for _ in range(num_anomalies):
-        func, num_indices = random.choice(anomaly_functions)
+        func, num_indices = rng.choice(anomaly_functions)
         
         if num_indices == 1:
-            idx = random.randint(1, len(df)-2)
-            df = func(df, idx)
+            idx = rng.randint(1, len(order)-2)
+            func(order, idx)
         else:  # For swap_steps
-            idx1 = random.randint(1, len(df)-3)
-            df = func(df, idx1, idx1+1)
-    
-    # Fix timestamps
-    start_time = datetime.strptime(df.iloc[0]["Date"] + " " + df.iloc[0]["Time"], 
-                                 "%Y-%m-%d %H:%M:%S")
-    for i in range(len(df)):
-        current_time = start_time + timedelta(minutes=5*i)
-        df.iloc[i, df.columns.get_loc("Date")] = current_time.strftime("%Y-%m-%d")
-        df.iloc[i, df.columns.get_loc("Time")] = current_time.strftime("%H:%M:%S")
-    
-    return df
+            idx1 = rng.randint(1, len(order)-3)
+            func(order, idx1, idx1+1)
+    
+    return order
 
-# Generate sequences
-correct_df = create_correct_sequence()
-anomalous_sequences = []
+def iter_anomalous_variants(correct_df, num_variants, num_anomalies=3, chunk_size=10000, rng=None):
+    """
+    Yield anomalous variants of correct_df as DataFrames of up to chunk_size
+    variants each, with a leading variant_id column. The base sequence is
+    read once; every variant only records its row order and changed rows.
+    rng is a seed or RNG; None uses the global random state
+    """
+    import numpy as np
+    import pandas as pd
+    from events import format_timestamps
+    base_columns = {name: correct_df[name].tolist() for name in correct_df.columns}
+    num_rows = len(correct_df)
+    start_time = np.datetime64(f"{correct_df['Date'].iloc[0]}T{correct_df['Time'].iloc[0]}", 's')
+    edit_cache = {}
+    rng = python_rng(rng)
+    
+    for first_variant in range(0, num_variants, chunk_size):
+        count = min(chunk_size, num_variants - first_variant)
+        with profiling.stage('generate'):
+            columns = {name: list(values) for name, values in base_columns.items()}
+            orders = [_inject_anomalies(columns, num_rows, num_anomalies, edit_cache, rng) for _ in range(count)]
+        
+        with profiling.stage('frame.build'):
+            lengths = np.array([len(order) for order in orders])
+            rows = np.fromiter(itertools.chain.from_iterable(orders), dtype=np.int64, count=lengths.sum())
+            df = pd.DataFrame(columns).take(rows).reset_index(drop=True)
+            df.insert(0, "variant_id", np.repeat(np.arange(first_variant, first_variant + count), lengths))
+        
+        # Fix timestamps: 5 minutes apart from the first row's timestamp
+        with profiling.stage('frame.timestamps'):
+            offsets = np.cumsum(lengths) - lengths
+            positions = np.arange(len(rows)) - np.repeat(offsets, lengths)
+            timestamps = (start_time + positions * np.timedelta64(5, 'm')).view(np.int64)
+            df["Date"], df["Time"] = format_timestamps(timestamps)
+        
+        profiling.count('sequences', count)
+        profiling.count('events', len(df))
+        yield df
 
-# Generate 5 different anomalous sequences
-for i in range(5):
-    anom_df = create_anomalous_sequence(correct_df, num_anomalies=3)
-    anomalous_sequences.append(anom_df)
+def create_anomalous_variants(correct_df, num_variants, num_anomalies=3, rng=None):
+    """Create num_variants anomalous sequences as one frame with a variant_id column"""
+    import pandas as pd
+    frames = list(iter_anomalous_variants(correct_df, num_variants, num_anomalies, rng=rng))
+    if not frames:
+        return pd.DataFrame(columns=["variant_id"] + list(correct_df.columns))
+    return pd.concat(frames, ignore_index=True)
 
-# Save sequences to CSV
-correct_df.to_csv("correct_sequence.csv", index=False)
-for i, anom_df in enumerate(anomalous_sequences, 1):
-    anom_df.to_csv(f"anomalous_sequence_{i}.csv", index=False)
+def create_anomalous_sequence(correct_df, num_anomalies=3, rng=None):
+    """Create an anomalous sequence by introducing various types of anomalies"""
+    df = next(iter_anomalous_variants(correct_df, 1, num_anomalies, rng=rng))
+    return df.drop(columns="variant_id")
 
-# Print sample of correct and anomalous sequences
-print("\nSample of correct sequence:")
-print(correct_df.head())
-print("\nSample of anomalous sequence with anomalies marked:")
-print(anomalous_sequences[0].head())
\ No newline at end of file
+def save_demo_sequences(num_variants=5, num_anomalies=3, output_dir=".", extension=".csv", rng=None):
+    """Generate the correct sequence plus num_variants anomalous ones and write them to output_dir"""
+    import os
+    
+    # Generate sequences
+    correct_df = create_correct_sequence()
+    
+    # Generate the anomalous sequences in one batch
+    variants_df = create_anomalous_variants(correct_df, num_variants, num_anomalies=num_anomalies, rng=rng)
+    with profiling.stage('frame.split'):
+        anomalous_sequences = [group.drop(columns="variant_id").reset_index(drop=True)
+                               for _, group in variants_df.groupby("variant_id", sort=True)]
+    
+    # Save sequences
+    write_audit_logs(correct_df, os.path.join(output_dir, f"correct_sequence{extension}"))
+    for i, anom_df in enumerate(anomalous_sequences, 1):
+        write_audit_logs(anom_df, os.path.join(output_dir, f"anomalous_sequence_{i}{extension}"))
+    
+    return correct_df, anomalous_sequences
+
+if __name__ == "__main__":
+    correct_df, anomalous_sequences = save_demo_sequences()
+    
+    # Print sample of correct and anomalous sequences
+    print("\nSample of correct sequence:")
+    print(correct_df.head())
+    print("\nSample of anomalous sequence with anomalies marked:")
+    print(anomalous_sequences[0].head())
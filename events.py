@@ -0,0 +1,229 @@
+"""
+Compact audit event records shared by the generators.
+
+AuditEvent is one row as a slotted object: epoch seconds, user, template ID,
+placeholder values and label; its description is only rendered on demand.
+AuditEventBatch holds many events as parallel NumPy arrays (int64 epoch
+seconds, uint16 user and template IDs, two uint32 parameter IDs, a uint8
+reason ID and an int8 label), 22 bytes per event. Users, placeholder values
+and reasons are interned in small per-batch tables. Placeholder values stay
+strings in their table because some must render back exactly (zero-padded
+batch numbers, solution letters, '-0.0').
+
+to_frame wraps the numeric arrays without copying and builds the Date, Time,
+User and Activity Description strings from lookup tables.
+"""
+import functools
+from array import array
+from datetime import datetime, timedelta
+
+import profiling
+
+NOT_AVAILABLE = 'Not Available'
+
+EPOCH = datetime(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+
+def epoch_seconds(day, clock=None):
+    """Epoch seconds of day's date at clock's time of day (day's own time when clock is None)"""
+    clock = day if clock is None else clock
+    return (day.toordinal() - EPOCH_ORDINAL) * 86400 + clock.hour * 3600 + clock.minute * 60 + clock.second
+
+class AuditEvent:
+    """A single audit log row"""
+
+    __slots__ = ('timestamp', 'user', 'template_id', 'params', 'label', 'reason')
+
+    def __init__(self, timestamp, user, template_id, params=(), label=0, reason=NOT_AVAILABLE):
+        self.timestamp = timestamp
+        self.user = user
+        self.template_id = template_id
+        self.params = params
+        self.label = label
+        self.reason = reason
+
+    def __repr__(self):
+        return (f"AuditEvent({self.timestamp}, {self.user!r}, {self.template_id}, {self.params!r}, "
+                f"{self.label})")
+
+    def description(self):
+        from templates import get_registry
+        return get_registry().templates[self.template_id].render(*self.params)
+
+    def to_row(self):
+        """[Date, Time, User, Activity Description, Reason for change, Anomaly] as strings"""
+        moment = EPOCH + timedelta(seconds=self.timestamp)
+        return [moment.strftime('%Y-%m-%d'), moment.strftime('%H:%M:%S'), self.user, self.description(),
+                self.reason, str(self.label)]
+
+class AuditEventBuilder:
+    """
+    Appends events to typed arrays, interning users, placeholder values and
+    reasons. build() hands the arrays to an AuditEventBatch without copying,
+    after which the builder must not be appended to
+    """
+
+    def __init__(self):
+        self.timestamps = array('q')
+        self.user_ids = array('H')
+        self.template_ids = array('H')
+        self.params = array('I')
+        self.reason_ids = array('B')
+        self.labels = array('b')
+        self.users = {}
+        self.values = {'': 0}
+        self.reasons = {}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, timestamp, user, template_id, params=(), label=0, reason=NOT_AVAILABLE):
+        """Add one event; params holds up to two placeholder values"""
+        user_id = self.users.get(user)
+        if user_id is None:
+            user_id = self.users[user] = len(self.users)
+        reason_id = self.reasons.get(reason)
+        if reason_id is None:
+            reason_id = self.reasons[reason] = len(self.reasons)
+        values = self.values
+        first = str(params[0]) if params else ''
+        second = str(params[1]) if len(params) > 1 else ''
+        self.timestamps.append(timestamp)
+        self.user_ids.append(user_id)
+        self.template_ids.append(template_id)
+        self.params.append(values.setdefault(first, len(values)))
+        self.params.append(values.setdefault(second, len(values)))
+        self.reason_ids.append(reason_id)
+        self.labels.append(label)
+
+    def extend(self, events):
+        for event in events:
+            self.append(event.timestamp, event.user, event.template_id, event.params, event.label, event.reason)
+        return self
+
+    def build(self):
+        import numpy as np
+        return AuditEventBatch(
+            _from_array(self.timestamps, np.int64),
+            _from_array(self.user_ids, np.uint16),
+            _from_array(self.template_ids, np.uint16),
+            _from_array(self.params, np.uint32).reshape(-1, 2),
+            _from_array(self.labels, np.int8),
+            list(self.users),
+            list(self.values),
+            _from_array(self.reason_ids, np.uint8),
+            list(self.reasons)
+        )
+
+def _from_array(values, dtype):
+    import numpy as np
+    return np.frombuffer(values, dtype=dtype) if len(values) else np.empty(0, dtype=dtype)
+
+class AuditEventBatch:
+    """Struct-of-arrays container for many audit events"""
+
+    def __init__(self, timestamps, user_ids, template_ids, params, labels, users, values, reason_ids=None,
+                 reasons=(NOT_AVAILABLE,)):
+        import numpy as np
+        self.timestamps = timestamps
+        self.user_ids = user_ids
+        self.template_ids = template_ids
+        self.params = params
+        self.labels = labels
+        self.users = list(users)
+        self.values = list(values)
+        self.reason_ids = np.zeros(len(timestamps), dtype=np.uint8) if reason_ids is None else reason_ids
+        self.reasons = list(reasons)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, i):
+        params = tuple(self.values[j] for j in self.params[i] if j)
+        return AuditEvent(int(self.timestamps[i]), self.users[self.user_ids[i]], int(self.template_ids[i]),
+                          params, int(self.labels[i]), self.reasons[self.reason_ids[i]])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def take(self, indices):
+        """A batch of the events at indices (an index array or boolean mask), sharing the lookup tables"""
+        return AuditEventBatch(self.timestamps[indices], self.user_ids[indices], self.template_ids[indices],
+                               self.params[indices], self.labels[indices], self.users, self.values,
+                               self.reason_ids[indices], self.reasons)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the per-event arrays"""
+        return sum(a.nbytes for a in (self.timestamps, self.user_ids, self.template_ids, self.params,
+                                      self.labels, self.reason_ids))
+
+    @classmethod
+    def concat(cls, batches):
+        """One batch holding the events of all batches, with merged lookup tables"""
+        import numpy as np
+        batches = list(batches)
+        tables = {'users': {}, 'values': {'': 0}, 'reasons': {}}
+        remapped = {name: [] for name in ('user_ids', 'params', 'reason_ids')}
+        for batch in batches:
+            for name, ids in (('users', 'user_ids'), ('values', 'params'), ('reasons', 'reason_ids')):
+                table = tables[name]
+                mapping = np.array([table.setdefault(value, len(table)) for value in getattr(batch, name)],
+                                   dtype=getattr(batch, ids).dtype)
+                remapped[ids].append(mapping[getattr(batch, ids)])
+        return cls(
+            np.concatenate([b.timestamps for b in batches] or [np.empty(0, np.int64)]),
+            np.concatenate(remapped['user_ids'] or [np.empty(0, np.uint16)]),
+            np.concatenate([b.template_ids for b in batches] or [np.empty(0, np.uint16)]),
+            np.concatenate(remapped['params'] or [np.empty((0, 2), np.uint32)]),
+            np.concatenate([b.labels for b in batches] or [np.empty(0, np.int8)]),
+            list(tables['users']),
+            list(tables['values']),
+            np.concatenate(remapped['reason_ids'] or [np.empty(0, np.uint8)]),
+            list(tables['reasons'])
+        )
+
+    def to_frame(self, render=True):
+        """
+        The six-column row format. With render=False, Activity Description is
+        replaced by Template (ID), Param 1 and Param 2 for the output writers
+        to render
+        """
+        import numpy as np
+        import pandas as pd
+        with profiling.stage('frame.timestamps'):
+            dates, times = format_timestamps(self.timestamps)
+        with profiling.stage('frame.render'):
+            values = np.array(self.values, dtype=object)
+            first, second = values[self.params[:, 0]], values[self.params[:, 1]]
+            columns = {'Date': dates, 'Time': times, 'User': np.array(self.users, dtype=object)[self.user_ids]}
+            if render:
+                from templates import get_registry
+                columns['Activity Description'] = get_registry().render(self.template_ids, first, second)
+            else:
+                columns.update({'Template': self.template_ids, 'Param 1': first, 'Param 2': second})
+            columns['Reason for change'] = np.array(self.reasons, dtype=object)[self.reason_ids]
+            columns['Anomaly'] = self.labels
+        with profiling.stage('frame.build'):
+            return pd.DataFrame(columns, copy=False)
+
+def format_timestamps(seconds):
+    """Date and Time string arrays for int64 epoch seconds"""
+    import numpy as np
+    days, second_of_day = np.divmod(np.asarray(seconds, dtype=np.int64), 86400)
+    if not len(days):
+        return np.empty(0, dtype=object), np.empty(0, dtype=object)
+    first_day, last_day = days.min(), days.max()
+    if last_day - first_day <= 2 * len(days):
+        day_strings = np.datetime_as_string(np.arange(first_day, last_day + 1).astype('datetime64[D]'), unit='D')
+        dates = day_strings.astype(object)[days - first_day]
+    else:
+        unique_days, inverse = np.unique(days, return_inverse=True)
+        dates = np.datetime_as_string(unique_days.astype('datetime64[D]'), unit='D').astype(object)[inverse]
+    return dates, _time_strings()[second_of_day]
+
+@functools.lru_cache(maxsize=None)
+def _time_strings():
+    """HH:MM:SS for every second of the day"""
+    import numpy as np
+    return np.array([f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in range(86400)], dtype=object)
@@ -0,0 +1,515 @@
+"""
+Precomputed sequence features in memory-mapped .npy shards.
+
+    from feature_shards import export_file, export_generated, open_shards
+    export_generated('normal', 1000000, 'features/normal', seed=0, vectorized=True)
+    export_file('enhanced_audit_logs.csv', 'features/enhanced', close_sequences=True)
+    offsets, shards = open_shards('features/normal')
+    shards[0]['tokens']    # int32 (n, max_length), memory-mapped
+
+    python feature_shards.py features/enhanced --input enhanced_audit_logs.csv --close
+
+Rows are grouped into sequences per user, from a login to the user's next
+one as in anomaly_scorer. Every sequence becomes one row of fixed-width
+matrices, cut after max_length events and padded with 0:
+
+    tokens      int32 (n, L)        activity-type ID + 2 (sequence_encoder's vocabulary)
+    templates   int32 (n, L)        template ID + 2, UNKNOWN_ID where no template matches
+    deltas      float32 (n, L)      seconds since the sequence's previous event (0 first)
+    params      float32 (n, L, 2)   numeric placeholder values, NaN where absent
+    row_labels  int8 (n, L)         Anomaly label of every event
+    labels      int8 (n,)           largest label of the sequence
+    lengths     int32 (n,)          events in the sequence before the cut
+
+A shard is a directory shard-NNNNN of these files. offsets.npy holds the
+number of sequences before every shard (and the total at the end), and
+manifest.json the settings, the vocabularies and how far the input has been
+read. Loading is np.load(mmap_mode='r'), with no parsing at all.
+
+export_generated runs the generators in a process pool, one task per shard
+of shard_size generated sequences, each seeded from the master seed and the
+shard index as in sharding. export_file parses line-aligned blocks of a CSV
+(or the batches of a parquet/arrow file) in a process pool and cuts the
+sequences, in the order they start, into shards of shard_size.
+
+Both are incremental. Rerunning export_generated with more sequences only
+regenerates the last, partial shard and adds new ones. Rerunning export_file
+on a grown file reads on from where the previous run stopped, fills up the
+partial shard and continues the sequences left open, which are kept in a
+pending file. Files are replaced atomically and the manifest last, so an
+interrupted run leaves the previous export readable.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+
+import profiling
+from sequence_encoder import PAD_ID, UNKNOWN_ID, parse_csv_header
+
+# Arrays of every shard, with their dtype
+ARRAYS = {
+    'tokens': 'int32',
+    'templates': 'int32',
+    'deltas': 'float32',
+    'params': 'float32',
+    'row_labels': 'int8',
+    'labels': 'int8',
+    'lengths': 'int32'
+}
+
+SHARD_SIZE = 65536
+MAX_LENGTH = 32
+
+# Bytes of CSV per parsing task
+BLOCK_BYTES = 1 << 24
+
+MANIFEST = 'manifest.json'
+OFFSETS = 'offsets.npy'
+
+def shard_name(shard_index):
+    return f'shard-{shard_index:05d}'
+
+def row_features(df):
+    """
+    Per-row arrays of a chunk in row format, columnar layout or with
+    Template/Param columns (render=False): user, activity and template IDs
+    (-1 if unknown), time in epoch seconds (NaN where it doesn't parse),
+    the two numeric placeholder values and the label
+    """
+    import numpy as np
+    import pandas as pd
+    from templates import get_registry
+    if 'Param 1' in df.columns:
+        template_ids = df['Template'].to_numpy(dtype=np.int64)
+        activity_ids = get_registry().activity_of_template[template_ids]
+        values = [_numbers(df[column]) for column in ('Param 1', 'Param 2')]
+    else:
+        from activity_classifier import get_classifier
+        found = get_classifier().classify_batch(df['Activity Description'])
+        template_ids, activity_ids = found['template_id'], found['activity_id']
+        values = [found['value1'], found['value2']]
+    if 'Timestamp' in df.columns:
+        seconds = _seconds(pd.to_datetime(df['Timestamp'], errors='coerce'))
+    else:
+        # Few distinct dates and times, each parsed once; a time alone parses to a time on 1900-01-01
+        seconds = _parsed(df['Date'], '%Y-%m-%d') + _parsed(df['Time'], '%H:%M:%S') % 86400
+    if 'Anomaly' in df.columns:
+        labels = pd.to_numeric(df['Anomaly'], errors='coerce').fillna(0).to_numpy() != 0
+    else:
+        labels = np.zeros(len(df), dtype=bool)
+    return {
+        'user': df['User'].to_numpy(dtype=object),
+        'activity': np.asarray(activity_ids, dtype=np.int32),
+        'template': np.asarray(template_ids, dtype=np.int32),
+        'time': seconds,
+        'values': np.column_stack(values).astype(np.float32),
+        'label': labels.astype(np.int8)
+    }
+
+def _seconds(timestamps):
+    """Epoch seconds of a datetime Series, NaN for NaT"""
+    import numpy as np
+    seconds = timestamps.to_numpy().astype('datetime64[s]').astype(np.int64).astype(float)
+    seconds[timestamps.isna().to_numpy()] = np.nan
+    return seconds
+
+def _parsed(strings, format):
+    """_seconds of date or time strings, each distinct string parsed once"""
+    import numpy as np
+    import pandas as pd
+    codes, uniques = pd.factorize(strings.to_numpy(dtype=object))
+    parsed = _seconds(pd.Series(pd.to_datetime(pd.Series(uniques, dtype=object), format=format, errors='coerce')))
+    return np.append(parsed, np.nan)[codes]
+
+def _numbers(params):
+    """Placeholder strings as floats, NaN where not numeric; each distinct value is parsed once"""
+    import numpy as np
+    import pandas as pd
+    codes, uniques = pd.factorize(params.to_numpy(dtype=object))
+    numbers = pd.to_numeric(pd.Series(uniques, dtype=object), errors='coerce').to_numpy(dtype=float)
+    return np.append(numbers, np.nan)[codes]
+
+def _concat(parts):
+    import numpy as np
+    parts = [part for part in parts if part is not None]
+    if len(parts) < 2:
+        return parts[0] if parts else None
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+def _take(arrays, rows):
+    return {name: values[rows] for name, values in arrays.items()}
+
+def _pack_sequences(rows, sequence_ids, max_length):
+    """
+    The shard arrays of the sequences given by sequence_ids (one per row,
+    rows in stream order), numbered by their first row
+    """
+    import numpy as np
+    import pandas as pd
+    codes = pd.factorize(sequence_ids)[0]
+    n = codes.max(initial=-1) + 1
+    order = np.argsort(codes, kind='stable')
+    lengths = np.bincount(codes, minlength=n)
+    starts = np.cumsum(lengths) - lengths
+    position = np.arange(len(order)) - np.repeat(starts, lengths)
+    times = rows['time'][order]
+    deltas = np.diff(times, prepend=0.0)
+    deltas[starts[lengths > 0]] = 0.0
+
+    kept = np.flatnonzero(position < max_length)
+    sequence, column, source = codes[order][kept], position[kept], order[kept]
+    arrays = {
+        'tokens': np.full((n, max_length), PAD_ID, dtype=np.int32),
+        'templates': np.full((n, max_length), PAD_ID, dtype=np.int32),
+        'deltas': np.zeros((n, max_length), dtype=np.float32),
+        'params': np.zeros((n, max_length, 2), dtype=np.float32),
+        'row_labels': np.zeros((n, max_length), dtype=np.int8)
+    }
+    # Unknown (-1) IDs land on UNKNOWN_ID
+    arrays['tokens'][sequence, column] = np.maximum(rows['activity'][source] + 2, UNKNOWN_ID)
+    arrays['templates'][sequence, column] = np.maximum(rows['template'][source] + 2, UNKNOWN_ID)
+    arrays['deltas'][sequence, column] = deltas[kept]
+    arrays['params'][sequence, column] = rows['values'][source]
+    arrays['row_labels'][sequence, column] = rows['label'][source]
+    arrays['labels'] = np.zeros(n, dtype=np.int8)
+    np.maximum.at(arrays['labels'], codes, rows['label'])
+    arrays['lengths'] = lengths.astype(np.int32)
+    return arrays
+
+class SequenceAssembler:
+    """
+    Groups a stream of row_features chunks into sequences. add() returns the
+    packed sequences closed so far, in the order they start; the rows from
+    the first sequence still open on are held in pending until the user's
+    next login (or final=True)
+    """
+
+    def __init__(self, max_length=MAX_LENGTH, pending=None):
+        from templates import get_registry
+        self.max_length = max_length
+        self.pending = pending
+        self.login_id = get_registry().activity_index['login']
+
+    def add(self, rows, final=False):
+        import numpy as np
+        import pandas as pd
+        rows = _concat([self.pending, rows])
+        if rows is None:
+            return None
+        users = pd.factorize(rows['user'])[0].astype(np.int64)
+        first_of_user = ~pd.Series(users).duplicated().to_numpy()
+        number = pd.Series((rows['activity'] == self.login_id) | first_of_user).groupby(users).cumsum().to_numpy()
+        sequence_ids = number * (users.max(initial=0) + 1) + users
+        closed = np.ones(len(users), dtype=bool)
+        if not final:
+            closed = number < pd.Series(number).groupby(users).transform('max').to_numpy()
+        # Emit the sequences starting before the first open one, so the
+        # order doesn't depend on how the input was chunked
+        codes = pd.factorize(sequence_ids)[0]
+        first_row = np.flatnonzero(~pd.Series(codes).duplicated().to_numpy())[codes]
+        emitted = first_row < (np.argmin(closed) if not closed.all() else len(users))
+        self.pending = _take(rows, ~emitted) if not emitted.all() else None
+        return _pack_sequences(_take(rows, emitted), sequence_ids[emitted], self.max_length)
+
+def _write_arrays(directory, arrays):
+    """Write each array to directory/<name>.npy through a temporary file"""
+    import numpy as np
+    os.makedirs(directory, exist_ok=True)
+    for name, values in arrays.items():
+        path = os.path.join(directory, name + '.npy')
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, values)
+        os.replace(path + '.tmp', path)
+
+def _write_json(path, state):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+def _load_shard(directory, shard_index, count, mmap_mode=None):
+    import numpy as np
+    path = os.path.join(directory, shard_name(shard_index))
+    return {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)[:count] for name in ARRAYS}
+
+def _vocabularies():
+    from sequence_encoder import activity_vocabulary
+    from templates import get_registry
+    return {'activity_types': activity_vocabulary(),
+            'templates': ['<pad>', '<unknown>'] + [t.text for t in get_registry().templates]}
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)
+
+def _open_export(directory, source_kind, shard_size, max_length):
+    """The manifest of an existing export to continue (checked against the settings), or a new one"""
+    settings = {'shard_size': shard_size, 'max_length': max_length, **_vocabularies()}
+    if not os.path.exists(os.path.join(directory, MANIFEST)):
+        os.makedirs(directory, exist_ok=True)
+        return {**settings, 'shards': [], 'source': {'kind': source_kind}}
+    manifest = read_manifest(directory)
+    for name, value in settings.items():
+        if manifest[name] != value:
+            raise ValueError(f"{directory} was exported with a different {name}; export to a new directory")
+    if manifest['source']['kind'] != source_kind:
+        raise ValueError(f"{directory} holds a {manifest['source']['kind']} export, not a {source_kind} one")
+    return manifest
+
+def _commit(directory, manifest, num_shards=None):
+    """Write offsets and manifest, then remove shards past the manifest's"""
+    import numpy as np
+    counts = manifest['shards']
+    with open(os.path.join(directory, OFFSETS + '.tmp'), 'wb') as f:
+        np.save(f, np.concatenate(([0], np.cumsum(counts, dtype=np.int64))))
+    os.replace(os.path.join(directory, OFFSETS + '.tmp'), os.path.join(directory, OFFSETS))
+    _write_json(os.path.join(directory, MANIFEST), manifest)
+    for shard_index in range(len(counts), num_shards or 0):
+        shutil.rmtree(os.path.join(directory, shard_name(shard_index)), ignore_errors=True)
+
+def open_shards(directory, mmap_mode='r'):
+    """(offsets, shards): the offsets index and one dict of memory-mapped arrays per shard"""
+    import numpy as np
+    manifest = read_manifest(directory)
+    offsets = np.load(os.path.join(directory, OFFSETS))
+    return offsets, [_load_shard(directory, i, count, mmap_mode) for i, count in enumerate(manifest['shards'])]
+
+def _pool_map(stack, processes):
+    """map over a process pool entered on stack, or the builtin map for one process"""
+    if processes == 1:
+        return map
+    from concurrent.futures import ProcessPoolExecutor
+    return stack.enter_context(ProcessPoolExecutor(max_workers=processes)).map
+
+def _export_shard(task):
+    """Generate, encode and write one shard (runs in a worker process)"""
+    from seeding import shard_seed
+    from sharding import iter_shard_chunks
+    generator, shard_index, first_sequence, count, seed, directory, max_length, chunk_size, options, \
+        profiled = task
+    with profiling.profile() if profiled else contextlib.nullcontext() as worker_profile:
+        assembler = SequenceAssembler(max_length)
+        parts = []
+        for chunk in iter_shard_chunks(generator, first_sequence, count, shard_seed(seed, shard_index), chunk_size,
+                                       options, render=False):
+            with profiling.stage('features'):
+                parts.append(assembler.add(row_features(chunk)))
+        with profiling.stage('features'):
+            parts.append(assembler.add(None, final=True))
+            arrays = _concat(parts)
+        with profiling.stage('write'):
+            _write_arrays(os.path.join(directory, shard_name(shard_index)), arrays)
+        profiling.count('feature.sequences', len(arrays['labels']))
+    return len(arrays['labels']), worker_profile.stats() if profiled else None
+
+def export_generated(generator, num_sequences, directory, seed=0, shard_size=SHARD_SIZE, max_length=MAX_LENGTH,
+                     processes=None, chunk_size=10000, **options):
+    """
+    Export num_sequences of a generator ('normal' or 'anomalies'; options as
+    for sharding.generate_sharded). Shards that an earlier export with the
+    same seed and options already holds are kept. Returns the manifest
+    """
+    from scenario import resolve_scenario
+    from sharding import GENERATORS
+    if generator not in GENERATORS:
+        raise ValueError(f"Unknown generator {generator!r}, expected one of {GENERATORS}")
+    # Register the scenario's templates here too, so the manifest vocabulary covers every ID the workers emit
+    resolve_scenario(options.get('scenario'))
+    manifest = _open_export(directory, 'generator', shard_size, max_length)
+    source = {'kind': 'generator', 'generator': generator, 'seed': seed, 'options': options}
+    previous = manifest['source'].pop('generated', [])
+    if manifest['shards'] and manifest['source'] != source:
+        raise ValueError(f"{directory} was exported with {manifest['source']}; export to a new directory")
+
+    bounds = [(first, min(shard_size, num_sequences - first)) for first in range(0, num_sequences, shard_size)]
+    active_profile = profiling.current()
+    tasks = [(generator, shard_index, first, count, seed, directory, max_length, chunk_size, options,
+              active_profile is not None)
+             for shard_index, (first, count) in enumerate(bounds)
+             if shard_index >= len(previous) or previous[shard_index] != count]
+    with contextlib.ExitStack() as stack:
+        results = list(_pool_map(stack, processes or min(len(tasks), os.cpu_count() or 1))(_export_shard, tasks))
+
+    counts = manifest['shards'][:len(bounds)]
+    counts += [0] * (len(bounds) - len(counts))
+    for task, (num_exported, stats) in zip(tasks, results):
+        counts[task[1]] = num_exported
+        if active_profile is not None:
+            active_profile.merge(stats)
+    num_shards = len(manifest['shards'])
+    manifest.update(shards=counts, source={**source, 'generated': [count for _, count in bounds]})
+    _commit(directory, manifest, num_shards)
+    return manifest
+
+def _csv_blocks(path, offset, block_bytes):
+    """(start, end) byte ranges of complete lines from offset on, about block_bytes each"""
+    size = os.path.getsize(path)
+    blocks = []
+    with open(path, 'rb') as f:
+        while offset < size:
+            f.seek(min(offset + block_bytes, size) - 1)
+            f.readline()
+            end = f.tell()
+            if end == size:
+                # Only up to the last newline: a line being appended is left for the next run
+                f.seek(offset)
+                end = offset + f.read(size - offset).rfind(b'\n') + 1
+                if end == offset:
+                    break
+            blocks.append((offset, end))
+            offset = end
+    return blocks
+
+def _read_block(task):
+    """row_features of one CSV byte range or columnar batch (runs in a worker process)"""
+    import pandas as pd
+    path, output_format, columns, start, end = task
+    if output_format == 'csv':
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        df = pd.read_csv(io.BytesIO(data), header=None, names=columns, dtype=str, keep_default_na=False)
+    elif output_format == 'parquet':
+        import pyarrow.parquet as pq
+        df = pq.ParquetFile(path, memory_map=True).read_row_group(start).to_pandas()
+    else:
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+        df = ipc.open_file(pa.memory_map(path)).get_batch(start).to_pandas()
+    return row_features(df)
+
+def _num_batches(path, output_format):
+    if output_format == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).num_row_groups
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    return ipc.open_file(pa.memory_map(path)).num_record_batches
+
+def export_file(path, directory, shard_size=SHARD_SIZE, max_length=MAX_LENGTH, processes=None,
+                close_sequences=False, output_format=None, block_bytes=BLOCK_BYTES):
+    """
+    Export an audit log file, or what was appended to it since the last
+    export into directory. With close_sequences the file is taken to be
+    complete: the sequences still open at its end are exported too instead
+    of waiting for more rows. Returns the manifest
+    """
+    import numpy as np
+    from output_formats import format_for_path
+    output_format = format_for_path(path, output_format)
+    manifest = _open_export(directory, 'file', shard_size, max_length)
+    source = manifest['source']
+    if source.get('path', path) != path:
+        raise ValueError(f"{directory} was exported from {source['path']}, not {path}")
+    source.update(path=path, format=output_format)
+
+    # Where the previous run stopped: byte offset (CSV) or batch index
+    start = source.get('position', 0)
+    if output_format == 'csv':
+        if os.path.getsize(path) < start:
+            raise ValueError(f"{path} is shorter than when it was exported; export to a new directory")
+        if 'columns' not in source:
+            with open(path, 'rb') as f:
+                header = f.readline()
+            if not header.endswith(b'\n'):
+                return manifest
+            # The offset counts the BOM bytes, if any
+            source.update(columns=parse_csv_header(header), position=len(header))
+        tasks = [(path, output_format, source['columns'], lo, hi)
+                 for lo, hi in _csv_blocks(path, source['position'], block_bytes)]
+    else:
+        tasks = [(path, output_format, None, i, i + 1) for i in range(start, _num_batches(path, output_format))]
+
+    # The partial last shard is refilled, and the open sequences continued
+    counts = manifest['shards']
+    num_shards = len(counts)
+    buffered = []
+    if counts and counts[-1] < shard_size:
+        buffered.append(_load_shard(directory, len(counts) - 1, counts[-1]))
+        counts.pop()
+    pending = None
+    if source.get('pending'):
+        with np.load(os.path.join(directory, source['pending'])) as saved:
+            pending = {**saved, 'user': saved['user'].astype(object)}
+    assembler = SequenceAssembler(max_length, pending)
+
+    def flush(final):
+        arrays = _concat(buffered)
+        buffered.clear()
+        n = len(arrays['labels']) if arrays else 0
+        full = n if final else n - n % shard_size
+        with profiling.stage('write'):
+            for lo in range(0, full, shard_size):
+                shard = _take(arrays, slice(lo, lo + shard_size))
+                _write_arrays(os.path.join(directory, shard_name(len(counts))), shard)
+                counts.append(min(shard_size, full - lo))
+        if full < n:
+            buffered.append(_take(arrays, slice(full, n)))
+
+    workers = processes or os.cpu_count() or 1
+    with contextlib.ExitStack() as stack:
+        pool_map = _pool_map(stack, min(workers, len(tasks)) or 1)
+        for lo in range(0, len(tasks), workers):
+            # One round of parsing in parallel, then assembly in stream order
+            round_tasks = tasks[lo:lo + workers]
+            for rows in pool_map(_read_block, round_tasks):
+                with profiling.stage('features'):
+                    buffered.append(assembler.add(rows))
+            flush(final=False)
+            source['position'] = round_tasks[-1][4]
+    if close_sequences:
+        with profiling.stage('features'):
+            buffered.append(assembler.add(None, final=True))
+    flush(final=True)
+
+    # Open sequences go to a pending file named after the position, so the
+    # manifest never points at one written by a later run
+    previous_pending = source.pop('pending', None)
+    if assembler.pending is not None:
+        source['pending'] = f"pending-{source.get('position', 0)}.npz"
+        with open(os.path.join(directory, source['pending'] + '.tmp'), 'wb') as f:
+            np.savez(f, **{**assembler.pending, 'user': assembler.pending['user'].astype(str)})
+        os.replace(os.path.join(directory, source['pending'] + '.tmp'), os.path.join(directory, source['pending']))
+    _commit(directory, manifest, num_shards)
+    if previous_pending and previous_pending != source.get('pending'):
+        os.remove(os.path.join(directory, previous_pending))
+    profiling.count('feature.sequences', sum(counts))
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export sequence feature matrices to memory-mapped .npy shards")
+    parser.add_argument('directory', help="export directory; an existing export is continued")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help="audit log file (csv, parquet or arrow)")
+    source.add_argument('--generator', choices=('normal', 'anomalies'))
+    parser.add_argument('--sequences', type=int, default=1500, help="sequences to generate (with --generator)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--vectorized', action='store_true', help="vectorized normal generator")
+    parser.add_argument('--anomaly-probability', type=float, default=0.3)
+    parser.add_argument('--scenario', help="scenario name or YAML/JSON spec for the generators")
+    parser.add_argument('--close', action='store_true',
+                        help="the input is complete: export the sequences still open at its end")
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE, help="sequences per shard")
+    parser.add_argument('--max-length', type=int, default=MAX_LENGTH, help="events kept per sequence")
+    parser.add_argument('--processes', type=int, help="worker processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    if args.input:
+        manifest = export_file(args.input, args.directory, args.shard_size, args.max_length, args.processes,
+                               args.close)
+    else:
+        options = {'scenario': args.scenario} if args.scenario else {}
+        if args.generator == 'normal':
+            options['vectorized'] = args.vectorized
+        else:
+            options['anomaly_probability'] = args.anomaly_probability
+        manifest = export_generated(args.generator, args.sequences, args.directory, args.seed, args.shard_size,
+                                    args.max_length, args.processes, **options)
+    print(f"{sum(manifest['shards']):,} sequences in {len(manifest['shards'])} shards in {args.directory}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
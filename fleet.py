@@ -0,0 +1,242 @@
+"""
+Scheduler-driven generation of a whole plant: many production lines running
+batches around the clock, staffed by operators on overlapping shifts.
+
+    from fleet import save_fleet_logs
+    save_fleet_logs('fleet.parquet', num_lines=24, num_operators=60, days=365, rng=0)
+
+Each line alternates between running a batch (one login-to-logout sequence
+drawn from its scenario tables) and a changeover break. A batch starts once
+an operator of a shift on duty is idle; otherwise the line waits until one
+frees up or the next shift comes on. An operator runs one batch at a time,
+so every user's rows still form contiguous sequences: an operator frees up
+the second after their logout, and run() raises if a batch would start while
+its operator's previous one is still being emitted.
+
+A heap holds the time of every line's next event. Popping it yields the rows
+of all lines in global time order, so the output streams out chunk by chunk
+without a final sort, in memory proportional to the lines and operators
+rather than the simulated time.
+"""
+import heapq
+from datetime import datetime, timedelta
+
+import profiling
+from augmentation import draw_sequence
+from events import EPOCH_ORDINAL, AuditEventBuilder, epoch_seconds
+from output_formats import AuditLogWriter
+from seeding import python_rng
+
+# (start hour, hours) of each shift; every shift overlaps the next by an hour
+# for the handover. Operator k works shift k % len(SHIFTS)
+SHIFTS = [(6, 9), (14, 9), (22, 9)]
+
+# Minutes [low, high] a line stands idle between two batches
+CHANGEOVER_MINUTES = (15, 45)
+
+# Lines start within this many minutes after their scenario start time
+START_STAGGER_MINUTES = 60
+
+def operator_names(num_operators):
+    return [f'operator{k + 1:03d}' for k in range(num_operators)]
+
+class _OperatorPool:
+    """
+    Idle operators by shift plus a heap of busy ones keyed on when they free
+    up. Queried in non-decreasing time order, as the simulation does
+    """
+
+    def __init__(self, names, shifts):
+        self.shifts = [(start * 3600, hours * 3600) for start, hours in shifts]
+        self.shift_of = {name: k % len(shifts) for k, name in enumerate(names)}
+        self.idle = [[] for _ in shifts]
+        for name in names:
+            self.idle[self.shift_of[name]].append(name)
+        self.busy = []
+        self._released = 0
+
+    def on_duty(self, shift, t):
+        start, length = self.shifts[shift]
+        return (t - start) % 86400 < length
+
+    def acquire(self, t, rng):
+        """A random idle operator of a shift on duty at t, or None"""
+        busy, idle = self.busy, self.idle
+        while busy and busy[0][0] <= t:
+            name = heapq.heappop(busy)[2]
+            idle[self.shift_of[name]].append(name)
+        available = [names for shift, names in enumerate(idle) if names and self.on_duty(shift, t)]
+        total = sum(len(names) for names in available)
+        if not total:
+            return None
+        k = rng.randrange(total)
+        for names in available:
+            if k < len(names):
+                names[k], names[-1] = names[-1], names[k]
+                return names.pop()
+            k -= len(names)
+
+    def release(self, name, t):
+        """Mark name busy until t"""
+        self._released += 1
+        heapq.heappush(self.busy, (t, self._released, name))
+
+    def next_available(self, t):
+        """
+        The next time after a failed acquire(t) at which one might succeed:
+        an operator frees up or a shift with idle operators comes on
+        """
+        times = [self.busy[0][0]] if self.busy else []
+        for shift, names in enumerate(self.idle):
+            if names:
+                times.append(t + (self.shifts[shift][0] - t) % 86400)
+        return min(times)
+
+class FleetSimulator:
+    """
+    Discrete-event simulation of num_lines production lines and
+    num_operators operators over days of simulated time. Line tables are
+    drawn from the scenario's lines by weight; no batch starts after the
+    last day, but batches running then are completed. A share
+    anomaly_probability of the batches is replaced by an anomalous sequence
+    of incorrect_augmentation.AuditLogGenerator
+    """
+
+    def __init__(self, num_lines=12, num_operators=40, days=7, anomaly_probability=0.0, rng=None, scenario=None,
+                 shifts=SHIFTS, changeover=CHANGEOVER_MINUTES):
+        from scenario import resolve_scenario
+        from templates import get_registry
+        if num_lines < 1 or num_operators < 1:
+            raise ValueError("A fleet needs at least one line and one operator")
+        if days <= 0:
+            raise ValueError(f"days must be positive, got {days}")
+        if not shifts or any(not 0 <= start < 24 or not 0 < hours <= 24 for start, hours in shifts):
+            raise ValueError(f"Shifts are (start hour in [0, 24), hours in (0, 24]) pairs, got {shifts!r}")
+        if not 0 <= changeover[0] <= changeover[1]:
+            raise ValueError(f"changeover must be minutes (low, high) with 0 <= low <= high, got {changeover!r}")
+        scenario = resolve_scenario(scenario)
+        self.rng = python_rng(rng)
+        self.template_id = get_registry().template_id
+        self.anomaly_probability = anomaly_probability
+        self.changeover = changeover
+        self.operators = _OperatorPool(operator_names(num_operators), shifts)
+        self.anomalies = None
+        if anomaly_probability:
+            from incorrect_augmentation import AuditLogGenerator
+            self.anomalies = AuditLogGenerator(self.rng, scenario)
+
+        if len(scenario.lines) == 1:
+            self.lines = scenario.lines * num_lines
+        else:
+            self.lines = self.rng.choices(scenario.lines, cum_weights=scenario.line_cum_weights, k=num_lines)
+        starts = [epoch_seconds(line.start_date, line.start_time) + 60 * self.rng.randrange(START_STAGGER_MINUTES)
+                  for line in self.lines]
+        self.end = min(starts) + int(days * 86400)
+        self.batches = 0
+
+        # (next event time, line); a line's pending batch rows, or None while it waits to start one
+        self._heap = [(start, i) for i, start in enumerate(starts)]
+        heapq.heapify(self._heap)
+        self._rows = [None] * num_lines
+        self._next_row = [0] * num_lines
+        # Operator -> line whose batch rows they are emitting
+        self._sessions = {}
+
+    @property
+    def done(self):
+        return not self._heap
+
+    def run(self, max_events):
+        """The next (at most) max_events events in time order, as an AuditEventBatch; empty once done"""
+        heap, pending, next_row = self._heap, self._rows, self._next_row
+        events = AuditEventBuilder()
+        append = events.append
+        waits = 0
+        with profiling.stage('generate'):
+            while heap and len(events) < max_events:
+                t, i = heap[0]
+                rows = pending[i]
+                if rows is not None:
+                    k = next_row[i]
+                    if k == 0:
+                        self._open_session(rows[0][1], i)
+                    append(*rows[k])
+                    k += 1
+                    if k < len(rows):
+                        next_row[i] = k
+                        heapq.heapreplace(heap, (rows[k][0], i))
+                    else:
+                        del self._sessions[rows[0][1]]
+                        pending[i] = None
+                        heapq.heapreplace(heap, (t + 60 * self.rng.randint(*self.changeover), i))
+                elif t >= self.end:
+                    heapq.heappop(heap)
+                else:
+                    operator = self.operators.acquire(t, self.rng)
+                    if operator is None:
+                        waits += 1
+                        heapq.heapreplace(heap, (self.operators.next_available(t), i))
+                        continue
+                    rows = pending[i] = self._draw_batch(self.lines[i], t, operator)
+                    next_row[i] = 0
+                    # Free from the second after the logout, so no batch of theirs starts in that second
+                    self.operators.release(operator, rows[-1][0] + 1)
+                    heapq.heapreplace(heap, (rows[0][0], i))
+            batch = events.build()
+        profiling.count('events', len(batch))
+        profiling.count('fleet.waits', waits)
+        return batch
+
+    def _open_session(self, operator, line):
+        owner = self._sessions.setdefault(operator, line)
+        if owner != line:
+            raise RuntimeError(f"{operator} starts a batch on line {line} while still running one on line {owner}")
+
+    def _draw_batch(self, line, t, operator):
+        """The rows of one batch started at t, as AuditEventBuilder.append arguments"""
+        self.batches += 1
+        profiling.count('sequences')
+        rng = self.rng
+        if self.anomalies is not None and rng.random() < self.anomaly_probability:
+            day = datetime.fromordinal(EPOCH_ORDINAL + t // 86400)
+            clock = datetime(1900, 1, 1) + timedelta(seconds=t % 86400)
+            sequence = self.anomalies.generate_anomalous_sequence(day, clock, operator, self.batches)
+            # The generator works on times of day: unwrap past midnight and
+            # keep the rows in order where it steps back in time. Every row
+            # goes to the batch's operator, including the deletion the
+            # generator gives to one of its own (off-roster) users
+            rows = []
+            latest = t
+            for event in sequence:
+                latest = max(latest, t + (event.timestamp - t) % 86400)
+                rows.append((latest, operator, event.template_id, event.params, event.label, event.reason))
+            return rows
+        batch_number = line.batch_number_format.format(self.batches)
+        template_id = self.template_id
+        return [(t + 60 * minutes, operator, template_id(activity), params)
+                for activity, params, minutes in draw_sequence(line, rng, batch_number)]
+
+def iter_fleet_chunks(num_lines=12, num_operators=40, days=7, chunk_size=100000, anomaly_probability=0.0, rng=None,
+                      scenario=None, render=True, **options):
+    """
+    Yield the fleet's events as time-ordered DataFrames of chunk_size rows;
+    options are passed on to FleetSimulator
+    """
+    simulator = FleetSimulator(num_lines, num_operators, days, anomaly_probability, rng, scenario, **options)
+    while not simulator.done:
+        batch = simulator.run(chunk_size)
+        if len(batch):
+            yield batch.to_frame(render)
+
+def save_fleet_logs(output_file='fleet_audit_logs.csv', num_lines=12, num_operators=40, days=7, chunk_size=100000,
+                    anomaly_probability=0.0, rng=None, scenario=None, output_format=None, **options):
+    """Simulate the fleet into output_file chunk by chunk; returns the number of records"""
+    with AuditLogWriter(output_file, output_format) as writer:
+        for chunk in iter_fleet_chunks(num_lines, num_operators, days, chunk_size, anomaly_probability, rng,
+                                       scenario, render=False, **options):
+            writer.write(chunk)
+    return writer.num_records
+
+if __name__ == "__main__":
+    num_records = save_fleet_logs('fleet_audit_logs.csv', num_lines=12, num_operators=40, days=30)
+    print(f"Simulated {num_records} records")
@@ -1,10 +1,44 @@
-import pandas as pd
+import functools
 from datetime import datetime, timedelta
-import random
+import profiling
+from seeding import python_rng
+from output_formats import AuditLogWriter
+from events import AuditEvent, AuditEventBuilder, epoch_seconds
+
+# Activity type of each adjusted parameter
+ADJUSTMENT_TYPES = {
+    'inlet air temperature': 'temp_adjust',
+    'spray rate': 'spray_adjust',
+    'drum speed': 'drum_speed',
+    'exhaust air temperature': 'exhaust_temp_adjust',
+    'atomization air pressure': 'atomization_pressure_adjust'
+}
+
+# How far an adjustment may move a parameter from its starting value
+ADJUSTMENT_DRIFT = 2
+
+ANOMALY_TYPES = ['alarm_sequence', 'batch_deletion', 'solution_change', 'logout_sequence']
+
+def adjustment_type(param):
+    """Activity type of an adjusted parameter; named after it when not in ADJUSTMENT_TYPES"""
+    return ADJUSTMENT_TYPES.get(param, param.replace(' ', '_') + '_adjust')
+
+@functools.lru_cache(maxsize=None)
+def _template_id(text):
+    from templates import get_registry
+    return get_registry().template_id(text)
 
 class AuditLogGenerator:
-    def __init__(self):
-        self.users = ['user123', 'user456', 'user789']
+    def __init__(self, rng=None, scenario=None):
+        # Seed or random.Random instance; None uses the global random module
+        self.rng = python_rng(rng)
+        # The anomalies section of a scenario overrides the tables below
+        overrides = {}
+        if scenario is not None:
+            from scenario import resolve_scenario
+            overrides = resolve_scenario(scenario).anomalies
+
+        self.users = overrides.get('users', ['user123', 'user456', 'user789'])
         self.base_sequence = [
             'User logged into the system',
             'Loaded recipe for batch #{}',
@@ -20,78 +54,109 @@ class AuditLogGenerator:
             ('exhaust air temperature', 42, 47),
             ('atomization air pressure', 1.8, 2.2)
         ]
+        if 'adjustments' in overrides:
+            self.normal_adjustments = [(param, low, high) for param, (low, high) in overrides['adjustments'].items()]
         
-        self.alarms = [
+        self.alarms = overrides.get('alarms', [
             'Low spray pressure',
             'High exhaust temperature',
             'Low atomization pressure',
             'High drum speed',
             'Low exhaust temperature',
             'High spray rate'
-        ]
+        ])
         
-        self.coating_solutions = ['A', 'B', 'C']
+        self.coating_solutions = overrides.get('solutions', ['A', 'B', 'C'])
+
+        # Relative frequency of each anomaly type
+        self.anomaly_mix = overrides.get('mix', dict.fromkeys(ANOMALY_TYPES, 1))
+
+    def activity_templates(self):
+        """(activity type, description template) for every row this generator can emit"""
+        base_types = ['login', 'batch_prep', 'equipment_check', 'calibration', 'batch_start']
+        templates = list(zip(base_types, self.base_sequence))
+        templates += [(adjustment_type(param), f'Adjusted {param} from {{}} to {{}}')
+                      for param, _, _ in self.normal_adjustments]
+        templates += [('batch_end', 'Stopped coating process for batch #{}'),
+                      ('logout', 'Logged out of the system'),
+                      ('batch_deletion', 'Deleted batch#{}'),
+                      ('solution_change', 'Changed coating solution to type {}')]
+        templates += [('alarm_resolved', f'Resolved alarm: {alarm}') for alarm in self.alarms]
+        templates += [('alarm_acknowledged', f'Acknowledged alarm: {alarm}') for alarm in self.alarms]
+        return templates
 
     def generate_time_string(self, time_obj):
         """Generate time string in standard format"""
         return time_obj.strftime('%H:%M:%S')
 
-    def generate_normal_sequence(self, date, start_time, user, batch_num):
+    def make_event(self, date, clock, user, template, params=(), label=0):
+        """An AuditEvent on date at clock's time of day, from a description template"""
+        # Compared with the emitted events, shows rows built and thrown away
+        profiling.count('events_built')
+        return AuditEvent(epoch_seconds(date, clock), user, _template_id(template), params, label)
+
+    def generate_base_rows(self, date, start_time, user, batch_num, start=0, stop=None):
+        """
+        Build events [start, stop) of the base sequence. The time deltas of
+        skipped leading rows are still drawn so the emitted rows get the same
+        timestamps as in a full sequence. Returns (events, next_time)
+        """
+        stop = len(self.base_sequence) if stop is None else stop
         current_time = start_time
-        sequence = []
-        
-        # Add base sequence
-        for activity in self.base_sequence:
-            if '{}' in activity:
-                activity = activity.format(f"{batch_num:03d}")
-            sequence.append([
-                date.strftime('%Y-%m-%d'),
-                self.generate_time_string(current_time),
-                user,
-                activity,
-                'Not Available',
-                '0'
-            ])
-            current_time += timedelta(minutes=random.randint(5, 10))
-            
-        # Add normal adjustments
-        for _ in range(random.randint(3, 6)):
-            param, min_val, max_val = random.choice(self.normal_adjustments)
-            val1 = round(random.uniform(min_val, max_val), 1)
-            val2 = round(val1 + random.uniform(-2, 2), 1)
-            activity = f"Adjusted {param} from {val1} to {val2}"
-            
-            sequence.append([
-                date.strftime('%Y-%m-%d'),
-                self.generate_time_string(current_time),
-                user,
-                activity,
-                'Not Available',
-                '0'
-            ])
-            current_time += timedelta(minutes=random.randint(5, 10))
-            
-        # Add batch end
-        sequence.append([
-            date.strftime('%Y-%m-%d'),
-            self.generate_time_string(current_time),
-            user,
-            f'Stopped coating process for batch #{batch_num:03d}',
-            'Not Available',
-            '0'
-        ])
-        current_time += timedelta(minutes=5)
-        
-        # Add logout
-        sequence.append([
-            date.strftime('%Y-%m-%d'),
-            self.generate_time_string(current_time),
-            user,
-            'Logged out of the system',
-            'Not Available',
-            '0'
-        ])
-        
+        rows = []
+
+        for i, activity in enumerate(self.base_sequence[:stop]):
+            if i >= start:
+                params = (f"{batch_num:03d}",) if '{}' in activity else ()
+                rows.append(self.make_event(date, current_time, user, activity, params))
+            current_time += timedelta(minutes=self.rng.randint(5, 10))
+
+        return rows, current_time
+
+    def generate_adjustment_rows(self, date, start_time, user, limit=None):
+        """
+        Build the normal parameter adjustments, stopping after limit events
+        when given. Returns (events, next_time)
+        """
+        current_time = start_time
+        rows = []
+
+        num_adjustments = self.rng.randint(3, 6)
+        if limit is not None:
+            num_adjustments = min(num_adjustments, limit)
+        for _ in range(num_adjustments):
+            param, min_val, max_val = self.rng.choice(self.normal_adjustments)
+            val1 = round(self.rng.uniform(min_val, max_val), 1)
+            val2 = round(val1 + self.rng.uniform(-ADJUSTMENT_DRIFT, ADJUSTMENT_DRIFT), 1)
+            rows.append(self.make_event(date, current_time, user, f"Adjusted {param} from {{}} to {{}}",
+                                        (str(val1), str(val2))))
+            current_time += timedelta(minutes=self.rng.randint(5, 10))
+
+        return rows, current_time
+
+    def generate_closing_rows(self, date, start_time, user, batch_num):
+        """Build the batch end and logout events"""
+        return [
+            self.make_event(date, start_time, user, 'Stopped coating process for batch #{}', (f"{batch_num:03d}",)),
+            self.make_event(date, start_time + timedelta(minutes=5), user, 'Logged out of the system')
+        ]
+
+    def generate_normal_sequence(self, date, start_time, user, batch_num):
+        sequence, current_time = self.generate_base_rows(date, start_time, user, batch_num)
+        adjustments, current_time = self.generate_adjustment_rows(date, current_time, user)
+        sequence.extend(adjustments)
+        sequence.extend(self.generate_closing_rows(date, current_time, user, batch_num))
+        return sequence
+
+    def generate_suffix_rows(self, date, start_time, user, batch_num, start):
+        """
+        Build a normal sequence from base row `start` onwards, without
+        building the rows before it
+        """
+        sequence, current_time = self.generate_base_rows(date, start_time, user, batch_num, start=start)
+        adjustments, current_time = self.generate_adjustment_rows(date, current_time, user)
+        sequence.extend(adjustments)
+        sequence.extend(self.generate_closing_rows(date, current_time, user, batch_num))
         return sequence
 
     def generate_anomalous_sequence(self, date, start_time, user, batch_num):
@@ -99,120 +164,112 @@ class AuditLogGenerator:
         current_time = start_time
         
         # Choose anomaly type (removed time_format from options)
-        anomaly_type = random.choice([
-            'alarm_sequence',
-            'batch_deletion',
-            'solution_change',
-            'logout_sequence'
-        ])
+        anomaly_types, weights = list(self.anomaly_mix), list(self.anomaly_mix.values())
+        if len(set(weights)) == 1:
+            anomaly_type = self.rng.choice(anomaly_types)
+        else:
+            anomaly_type = self.rng.choices(anomaly_types, weights)[0]
+        profiling.count(f'anomalies.{anomaly_type}')
         
         if anomaly_type == 'alarm_sequence':
             # Generate sequence with alarm events
-            sequence.extend(self.generate_normal_sequence(date, start_time, user, batch_num)[:4])
+            sequence.extend(self.generate_base_rows(date, start_time, user, batch_num, stop=4)[0])
             
             # Insert alarm sequence
-            alarm = random.choice(self.alarms)
-            sequence.append([
-                date.strftime('%Y-%m-%d'),
-                self.generate_time_string(current_time),
-                user,
-                f'Resolved alarm: {alarm}',
-                'Not Available',
-                '1'
-            ])
+            alarm = self.rng.choice(self.alarms)
+            sequence.append(self.make_event(date, current_time, user, f'Resolved alarm: {alarm}', label=1))
             current_time += timedelta(minutes=1)
             
-            sequence.append([
-                date.strftime('%Y-%m-%d'),
-                self.generate_time_string(current_time),
-                user,
-                f'Acknowledged alarm: {alarm}',
-                'Not Available',
-                '1'
-            ])
+            sequence.append(self.make_event(date, current_time, user, f'Acknowledged alarm: {alarm}', label=1))
             
             # Continue with normal sequence
-            sequence.extend(self.generate_normal_sequence(date, current_time + timedelta(minutes=5), user, batch_num)[4:])
+            sequence.extend(self.generate_suffix_rows(date, current_time + timedelta(minutes=5), user, batch_num, 4))
             
         elif anomaly_type == 'batch_deletion':
             # Generate partial sequence then delete batch
-            sequence.extend(self.generate_normal_sequence(date, start_time, user, batch_num)[:6])
+            rows, next_time = self.generate_base_rows(date, start_time, user, batch_num)
+            sequence.extend(rows)
+            sequence.extend(self.generate_adjustment_rows(date, next_time, user, limit=1)[0])
             
-            sequence.append([
-                date.strftime('%Y-%m-%d'),
-                self.generate_time_string(current_time),
-                random.choice(self.users),  # Maybe different user
-                f'Deleted batch#{batch_num:03d}',
-                'Not Available',
-                '1'
-            ])
+            sequence.append(self.make_event(date, current_time,
+                                            self.rng.choice(self.users),  # Maybe different user
+                                            'Deleted batch#{}', (f"{batch_num:03d}",), label=1))
             
         elif anomaly_type == 'solution_change':
             # Generate sequence with unusual solution changes
-            sequence.extend(self.generate_normal_sequence(date, start_time, user, batch_num)[:5])
+            sequence.extend(self.generate_base_rows(date, start_time, user, batch_num)[0])
             
             # Add multiple solution changes
             for _ in range(2):
-                sequence.append([
-                    date.strftime('%Y-%m-%d'),
-                    self.generate_time_string(current_time),
-                    user,
-                    f'Changed coating solution to type {random.choice(self.coating_solutions)}',
-                    'Not Available',
-                    '1'
-                ])
+                sequence.append(self.make_event(date, current_time, user, 'Changed coating solution to type {}',
+                                                (self.rng.choice(self.coating_solutions),), label=1))
                 current_time += timedelta(minutes=5)
                 
-            sequence.extend(self.generate_normal_sequence(date, current_time, user, batch_num)[5:])
+            sequence.extend(self.generate_suffix_rows(date, current_time, user, batch_num, 5))
             
         elif anomaly_type == 'logout_sequence':
             # Generate sequence with logout before process end
-            sequence.extend(self.generate_normal_sequence(date, start_time, user, batch_num)[:-2])
+            rows, next_time = self.generate_base_rows(date, start_time, user, batch_num)
+            sequence.extend(rows)
+            sequence.extend(self.generate_adjustment_rows(date, next_time, user)[0])
             
             # Add logout before process end
-            sequence.append([
-                date.strftime('%Y-%m-%d'),
-                self.generate_time_string(current_time),
-                user,
-                'Logged out of the system',
-                'Not Available',
-                '1'
-            ])
+            sequence.append(self.make_event(date, current_time, user, 'Logged out of the system', label=1))
             current_time += timedelta(minutes=5)
             
-            sequence.append([
-                date.strftime('%Y-%m-%d'),
-                self.generate_time_string(current_time),
-                user,
-                f'Stopped coating process for batch #{batch_num:03d}',
-                'Not Available',
-                '1'
-            ])
+            sequence.append(self.make_event(date, current_time, user, 'Stopped coating process for batch #{}',
+                                            (f"{batch_num:03d}",), label=1))
             
         return sequence
 
-def generate_dataset(num_sequences=50, anomaly_probability=0.3):  # Changed default to 0.3
-    generator = AuditLogGenerator()
-    all_sequences = []
-    current_date = datetime.strptime('2024-08-27', '%Y-%m-%d')
+def generate_dataset(num_sequences=50, anomaly_probability=0.3, rng=None, first_sequence=0, render=True,
+                     scenario=None):  # Changed default to 0.3
+    return generate_dataset_events(num_sequences, anomaly_probability, rng, first_sequence, scenario).to_frame(render)
+
+def generate_dataset_events(num_sequences=50, anomaly_probability=0.3, rng=None, first_sequence=0, scenario=None):
+    """The same dataset as generate_dataset, as an AuditEventBatch"""
+    generator = AuditLogGenerator(rng, scenario)
+    events = AuditEventBuilder()
+    current_date = datetime.strptime('2024-08-27', '%Y-%m-%d') + timedelta(days=first_sequence)
     
-    for seq in range(num_sequences):
-        start_time = datetime.strptime('08:00:00', '%H:%M:%S')
-        user = random.choice(generator.users)
-        
-        if random.random() < anomaly_probability:
-            sequence = generator.generate_anomalous_sequence(current_date, start_time, user, seq+1)
-        else:
-            sequence = generator.generate_normal_sequence(current_date, start_time, user, seq+1)
+    with profiling.stage('generate'):
+        for seq in range(first_sequence, first_sequence + num_sequences):
+            start_time = datetime.strptime('08:00:00', '%H:%M:%S')
+            user = generator.rng.choice(generator.users)
             
-        all_sequences.extend(sequence)
-        current_date += timedelta(days=1)
+            if generator.rng.random() < anomaly_probability:
+                sequence = generator.generate_anomalous_sequence(current_date, start_time, user, seq+1)
+            else:
+                sequence = generator.generate_normal_sequence(current_date, start_time, user, seq+1)
+                
+            events.extend(sequence)
+            current_date += timedelta(days=1)
+        batch = events.build()
     
-    return pd.DataFrame(all_sequences, columns=['Date', 'Time', 'User', 
-                                              'Activity Description', 'Reason for change', 'Anomaly'])
+    profiling.count('sequences', num_sequences)
+    profiling.count('events', len(batch))
+    return batch
+
+def iter_dataset_chunks(num_sequences=50, chunk_size=10000, anomaly_probability=0.3, rng=None, first_sequence=0,
+                        scenario=None, render=True):
+    """Yield the dataset as DataFrames of at most chunk_size sequences each"""
+    # Resolve the RNG once so a seeded stream continues across chunks
+    rng = python_rng(rng)
+    end = first_sequence + num_sequences
+    for start in range(first_sequence, end, chunk_size):
+        yield generate_dataset(min(chunk_size, end - start), anomaly_probability, rng=rng, first_sequence=start,
+                               render=render, scenario=scenario)
+
+def save_dataset(num_sequences=50, output_file='audit_logs_with_anomalies.csv', anomaly_probability=0.3,
+                 rng=None, chunk_size=10000, output_format=None, scenario=None):
+    """Generate the dataset chunk by chunk into output_file; returns the number of records"""
+    with AuditLogWriter(output_file, output_format) as writer:
+        for chunk in iter_dataset_chunks(num_sequences, chunk_size, anomaly_probability, rng, scenario=scenario,
+                                         render=False):
+            writer.write(chunk)
+    return writer.num_records
 
 if __name__ == "__main__":
     # Generate dataset with 30% anomalous sequences
-    df = generate_dataset(num_sequences=50, anomaly_probability=0.3)
-    df.to_csv('audit_logs_with_anomalies.csv', index=False)
-    print(f"Generated {len(df)} records with anomalies")
\ No newline at end of file
+    num_records = save_dataset(num_sequences=50, output_file='audit_logs_with_anomalies.csv', anomaly_probability=0.3)
+    print(f"Generated {num_records} records with anomalies")
\ No newline at end of file
@@ -0,0 +1,218 @@
+"""
+Pluggable output formats for the generated audit logs.
+
+'csv' writes the six-column row format exactly as the generators have always
+produced it. 'parquet' and 'arrow' (Arrow IPC file, memory-mappable) write a
+typed columnar layout instead: one datetime64 Timestamp replaces the Date and
+Time strings, low-cardinality string columns are dictionary-encoded and the
+Anomaly label is int8. pyarrow is only needed for the columnar formats.
+"""
+import os
+
+import profiling
+
+FORMATS = ('csv', 'parquet', 'arrow')
+
+EXTENSIONS = {
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ipc': 'arrow'
+}
+
+ROW_COLUMNS = ['Date', 'Time', 'User', 'Activity Description', 'Reason for change', 'Anomaly']
+
+# Columns stored as dictionaries; 'Activity Type' and 'Template' come from the
+# producer's template IDs or, for plain row-format frames, from the classifier
+DICTIONARY_COLUMNS = ['User', 'Activity Type', 'Template', 'Reason for change']
+
+def format_for_path(path, output_format=None):
+    """Resolve the output format from an explicit name or the file extension (CSV by default)"""
+    if output_format is None:
+        output_format = EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'csv')
+    if output_format not in FORMATS:
+        raise ValueError(f"Unknown output format {output_format!r}, expected one of {FORMATS}")
+    return output_format
+
+def to_columnar(df):
+    """
+    Convert a row-format audit log frame (any column order) into the typed
+    columnar layout. Frames that already have a Timestamp column are returned
+    with their columns reordered only. Frames without Activity Type and
+    Template get them from the classifier (None for unrecognized rows), so
+    every columnar file has the same schema
+    """
+    import numpy as np
+    import pandas as pd
+    if 'Timestamp' not in df.columns:
+        timestamps = pd.to_datetime(df['Date'] + ' ' + df['Time'], format='%Y-%m-%d %H:%M:%S')
+        df = df.drop(columns=['Date', 'Time']).assign(Timestamp=timestamps.to_numpy())
+    if 'Template' not in df.columns:
+        from activity_classifier import get_classifier
+        classifier = get_classifier()
+        registry = classifier.registry
+        template_ids = classifier.classify_batch(df['Activity Description'].fillna('').to_numpy(dtype=object))[
+            'template_id'].astype(np.int64)
+        # Unrecognized rows (-1) pick the trailing None
+        activity_types = np.array(registry.activity_types + [None], dtype=object)
+        texts = np.array([t.text for t in registry.templates] + [None], dtype=object)
+        activity_of_template = np.append(registry.activity_of_template, -1)
+        df = df.assign(**{'Activity Type': activity_types[activity_of_template[template_ids]],
+                          'Template': texts[template_ids]})
+    columns = ['Timestamp', 'User', 'Activity Type', 'Template', 'Activity Description', 'Reason for change',
+               'Anomaly']
+    df = df[columns]
+    if df['Anomaly'].dtype != np.int8:
+        df = df.assign(Anomaly=df['Anomaly'].astype(np.int8))
+    return df
+
+def from_columnar(df):
+    """Convert a columnar frame back into the six-column row format with string labels"""
+    import numpy as np
+    import pandas as pd
+    timestamps = pd.DatetimeIndex(df['Timestamp'])
+    return pd.DataFrame({
+        'Date': timestamps.strftime('%Y-%m-%d'),
+        'Time': timestamps.strftime('%H:%M:%S'),
+        'User': np.asarray(df['User'], dtype=object),
+        'Activity Description': np.asarray(df['Activity Description'], dtype=object),
+        'Reason for change': np.asarray(df['Reason for change'], dtype=object),
+        'Anomaly': df['Anomaly'].astype(str).to_numpy(dtype=object)
+    })
+
+class AuditLogWriter:
+    """
+    Incremental writer: call write() once per chunk, then close() (or use it
+    as a context manager). The CSV header is written once; columnar formats
+    keep one growing dictionary per encoded column, so every chunk shares the
+    same codes and the Arrow file stays valid for memory mapping
+    """
+
+    def __init__(self, path, output_format=None):
+        self.path = path
+        self.format = format_for_path(path, output_format)
+        self.num_records = 0
+        self._file = open(path, 'w', newline='') if self.format == 'csv' else None
+        self._writer = None
+        self._vocab = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, df):
+        if 'Template' in df.columns and 'Activity Description' not in df.columns:
+            # Template IDs plus parameters: render the descriptions only now
+            from templates import render_descriptions
+            with profiling.stage('write.render'):
+                df = render_descriptions(df, keep_template_columns=self.format != 'csv')
+        with profiling.stage('write'):
+            if self.format == 'csv':
+                df.to_csv(self._file, index=False, header=self.num_records == 0)
+            else:
+                table = self._to_table(to_columnar(df))
+                if self._writer is None:
+                    self._open_columnar(table.schema)
+                self._writer.write_table(table)
+        self.num_records += len(df)
+        profiling.count('rows_written', len(df))
+
+    def close(self):
+        import pandas as pd
+        if self.format == 'csv':
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                profiling.count('bytes_written', os.path.getsize(self.path))
+            return
+        if self._writer is None:
+            # Nothing was written: still produce a valid, empty file
+            self.write(pd.DataFrame({c: pd.Series(dtype=object) for c in ROW_COLUMNS}))
+        with profiling.stage('write'):
+            self._writer.close()
+        self._writer = None
+        profiling.count('bytes_written', os.path.getsize(self.path))
+
+    def _encode(self, name, values):
+        import numpy as np
+        import pandas as pd
+        import pyarrow as pa
+        vocab = self._vocab.setdefault(name, {})
+        values = pd.Series(values)
+        # Missing values (e.g. unrecognized rows' Template) are null indices, not dictionary entries
+        missing = values.isna().to_numpy()
+        for value in pd.unique(values[~missing]):
+            if value not in vocab:
+                vocab[value] = len(vocab)
+        codes = values.map(vocab).fillna(0).to_numpy(dtype=np.int32)
+        indices = pa.array(codes, mask=missing) if missing.any() else pa.array(codes)
+        return pa.DictionaryArray.from_arrays(indices, pa.array(list(vocab), type=pa.string()))
+
+    def _to_table(self, df):
+        import pyarrow as pa
+        arrays = []
+        for name in df.columns:
+            values = df[name].to_numpy()
+            if name in DICTIONARY_COLUMNS:
+                arrays.append(self._encode(name, values.astype(object)))
+            elif name == 'Timestamp':
+                arrays.append(pa.array(values.astype('datetime64[s]')))
+            elif name == 'Anomaly':
+                arrays.append(pa.array(values, type=pa.int8()))
+            else:
+                arrays.append(pa.array(values.astype(object), type=pa.string()))
+        return pa.Table.from_arrays(arrays, names=list(df.columns))
+
+    def _open_columnar(self, schema):
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(self.path, schema, compression='zstd')
+        else:
+            import pyarrow.ipc as ipc
+            options = ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+            self._writer = ipc.new_file(self.path, schema, options=options)
+
+def write_audit_logs(df, path, output_format=None):
+    """Write a whole audit log frame in the format chosen by output_format or the extension"""
+    with AuditLogWriter(path, output_format) as writer:
+        writer.write(df)
+    return writer.num_records
+
+def iter_audit_log_batches(path, output_format=None, chunk_rows=100000):
+    """
+    Yield a file's contents as DataFrames, one per stored batch/row group
+    (CSV: of chunk_rows rows, all columns as strings)
+    """
+    import pandas as pd
+    output_format = format_for_path(path, output_format)
+    if output_format == 'csv':
+        yield from pd.read_csv(path, dtype=str, chunksize=chunk_rows)
+    elif output_format == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path, memory_map=True).iter_batches():
+            yield batch.to_pandas()
+    else:
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+        reader = ipc.open_file(pa.memory_map(path))
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i).to_pandas()
+
+def read_audit_logs(path, output_format=None):
+    """
+    Read an audit log file written by any of the formats. Columnar files are
+    memory-mapped and come back in the typed columnar layout
+    """
+    import pandas as pd
+    output_format = format_for_path(path, output_format)
+    if output_format == 'csv':
+        return pd.read_csv(path)
+    if output_format == 'parquet':
+        return pd.read_parquet(path, memory_map=True)
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    return ipc.open_file(pa.memory_map(path)).read_all().to_pandas()
@@ -0,0 +1,149 @@
+"""
+Optional per-stage profiling of the generation pipelines.
+
+    from profiling import profile
+    with profile(stats_file='stats.json') as p:
+        save_audit_logs(100000, 'logs.csv')
+    print(format_stats(p.stats()))
+
+The generators mark their stages (event generation, timestamp formatting,
+description rendering, DataFrame construction, writing) with
+`with profiling.stage(name):` and bump counters with profiling.count().
+Outside profile() both return after one global check, and stages wrap whole
+chunks, never single rows, so instrumentation costs nothing measurable when
+disabled.
+
+Stage times are exclusive: time spent in a nested stage ('generate.layout'
+inside 'generate') is only counted for the nested one, so the stage times
+add up to the instrumented part of the run.
+"""
+import contextlib
+import json
+import time
+
+# The Profile collecting stats, None when profiling is off
+_active = None
+
+class _NullStage:
+    """Stand-in for _Stage while profiling is off"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    __slots__ = ('profile', 'name', 'start', 'nested')
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.nested = 0.0
+        self.profile._stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        stack = self.profile._stack
+        stack.pop()
+        if stack:
+            stack[-1].nested += elapsed
+        self.profile.add_time(self.name, elapsed - self.nested)
+        return False
+
+class Profile:
+    """Exclusive seconds and calls per stage, plus named counters"""
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.wall_seconds = None
+        self._start = time.perf_counter()
+        self._stack = []
+
+    def add_time(self, name, seconds, calls=1):
+        totals = self.stages.setdefault(name, [0.0, 0])
+        totals[0] += seconds
+        totals[1] += calls
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, stats):
+        """Add in the stats() of another profile, e.g. one from a worker process"""
+        for name, totals in stats['stages'].items():
+            self.add_time(name, totals['seconds'], totals['calls'])
+        for name, n in stats['counters'].items():
+            self.count(name, n)
+
+    def stats(self):
+        """
+        JSON-ready stats. share is a stage's fraction of the wall time; stages
+        merged from parallel workers can add up to more than 1
+        """
+        wall = self.wall_seconds if self.wall_seconds is not None else time.perf_counter() - self._start
+        # Rows generated; a row can be written more than once (shard parts, then the merged file)
+        rows = self.counters.get('events', self.counters.get('rows_written', 0))
+        stages = sorted(self.stages.items(), key=lambda item: -item[1][0])
+        return {
+            'wall_seconds': round(wall, 6),
+            'rows_per_second': round(rows / wall, 1) if wall > 0 else None,
+            'bytes_written': self.counters.get('bytes_written', 0),
+            'stages': {name: {'seconds': round(seconds, 6), 'calls': calls,
+                              'share': round(seconds / wall, 4) if wall > 0 else None}
+                       for name, (seconds, calls) in stages},
+            'counters': dict(sorted(self.counters.items()))
+        }
+
+def stage(name):
+    """Context manager timing one stage; a shared no-op unless profiling"""
+    if _active is None:
+        return _NULL_STAGE
+    return _Stage(_active, name)
+
+def count(name, n=1):
+    """Add n to a counter when profiling"""
+    if _active is not None:
+        _active.count(name, n)
+
+def current():
+    """The active Profile, or None"""
+    return _active
+
+@contextlib.contextmanager
+def profile(callback=None, stats_file=None):
+    """
+    Profile the generation run inside the block and yield the Profile. On
+    exit its stats() are passed to callback and/or written to stats_file
+    """
+    global _active
+    previous, _active = _active, Profile()
+    active = _active
+    try:
+        yield active
+    finally:
+        _active = previous
+        active.wall_seconds = time.perf_counter() - active._start
+        stats = active.stats()
+        if stats_file:
+            with open(stats_file, 'w') as f:
+                json.dump(stats, f, indent=2)
+        if callback is not None:
+            callback(stats)
+
+def format_stats(stats, top=8):
+    """A short human-readable summary of stats()"""
+    lines = [f"{stats['wall_seconds']:.3f}s wall, {stats['rows_per_second'] or 0:,.0f} rows/s, "
+             f"{stats['bytes_written']:,} bytes written"]
+    for name, totals in list(stats['stages'].items())[:top]:
+        share = f"{totals['share']:6.1%}" if totals['share'] is not None else '     -'
+        lines.append(f"  {name:<20} {totals['seconds']:9.3f}s {share}  {totals['calls']:>7,} calls")
+    return '\n'.join(lines)
@@ -0,0 +1,387 @@
+"""
+Declarative scenario specs for the generators.
+
+    from scenario import load_scenario
+    scenario = load_scenario('scenarios/coating_lines.yaml')
+    df = generate_normal_audit_logs(1000, vectorized=True, rng=0, scenario=scenario)
+
+A spec (YAML or JSON) holds what augmentation.py otherwise takes from its
+module tables: the users, the activities with their (optionally weighted)
+description templates, time intervals and placeholder parameters, and the
+opening, shuffled middle and closing activities of a sequence. An optional
+`lines` list describes several production lines. Each line is merged over
+the top-level settings and gets a share of the sequences by weight. An
+optional `anomalies` section overrides the tables of
+incorrect_augmentation.AuditLogGenerator. scenarios/coating_lines.yaml
+shows every field.
+
+A spec is validated once and compiled into the tables the generators draw
+from: per line, arrays of activity IDs, interval bounds and cumulative
+template weights. Compiled scenarios are pickled in the dataset cache
+directory, keyed on the spec bytes and the compiling code, so later runs
+skip parsing and validation.
+"""
+import functools
+import hashlib
+import json
+import os
+import pickle
+from datetime import datetime
+from itertools import accumulate
+
+SPEC_KEYS = ('name', 'start_date', 'start_time', 'batch_number_format', 'users', 'activities', 'sequence',
+             'lines', 'anomalies')
+LINE_KEYS = ('name', 'weight', 'start_date', 'start_time', 'batch_number_format', 'users', 'activities',
+             'sequence')
+ACTIVITY_KEYS = ('templates', 'interval', 'parameter')
+SEQUENCE_KEYS = ('opening', 'middle', 'min_middle', 'closing')
+ANOMALY_KEYS = ('users', 'adjustments', 'alarms', 'solutions', 'mix')
+
+# Placeholders in the templates of each parameter kind
+PARAMETER_FIELDS = {None: 0, 'batch': 1, 'range': 2, 'choices': 1}
+
+# Modules whose code shapes a compiled scenario
+COMPILER_MODULES = ['scenario', 'augmentation']
+
+# Digests of the scenarios whose templates are in this process's registry
+_registered = set()
+
+def default_spec():
+    """The spec of augmentation.py's built-in tables"""
+    from augmentation import (ACTIVITY_VARIATIONS, ACTIVITY_PARAMETERS, TIME_INTERVALS, USERS, START_DATE,
+                              START_TIME, BATCH_NUMBER_FORMAT, BASE_SEQUENCE, MIDDLE_ACTIVITIES, MIN_MIDDLE,
+                              END_SEQUENCE)
+    activities = {}
+    for activity_type, texts in ACTIVITY_VARIATIONS.items():
+        activities[activity_type] = {'templates': texts, 'interval': TIME_INTERVALS[activity_type]}
+        if activity_type in ACTIVITY_PARAMETERS:
+            activities[activity_type]['parameter'] = ACTIVITY_PARAMETERS[activity_type]
+    return {
+        'name': 'default',
+        'start_date': START_DATE,
+        'start_time': START_TIME,
+        'batch_number_format': BATCH_NUMBER_FORMAT,
+        'users': USERS,
+        'activities': activities,
+        'sequence': {'opening': BASE_SEQUENCE, 'middle': MIDDLE_ACTIVITIES, 'min_middle': MIN_MIDDLE,
+                     'closing': END_SEQUENCE}
+    }
+
+def _check_keys(spec, allowed, where):
+    if not isinstance(spec, dict):
+        raise ValueError(f"{where}: expected a mapping, got {type(spec).__name__}")
+    unknown = sorted(set(spec) - set(allowed))
+    if unknown:
+        raise ValueError(f"{where}: unknown keys {unknown}, expected some of {list(allowed)}")
+
+def _bounds(value, where, kind=int):
+    """A validated [low, high] pair"""
+    if (not isinstance(value, (list, tuple)) or len(value) != 2
+            or not all(isinstance(v, kind) and not isinstance(v, bool) for v in value) or value[0] > value[1]):
+        raise ValueError(f"{where}: expected [low, high] with low <= high, got {value!r}")
+    return list(value)
+
+def _weights(value, where):
+    """A validated {name: weight} mapping, from a list (equal weights) or a mapping"""
+    weights = dict.fromkeys(value, 1) if isinstance(value, (list, tuple)) else value
+    if not isinstance(weights, dict) or not weights:
+        raise ValueError(f"{where}: expected a non-empty list or mapping, got {value!r}")
+    if not all(isinstance(w, (int, float)) and not isinstance(w, bool) and w >= 0 for w in weights.values()):
+        raise ValueError(f"{where}: weights must be non-negative numbers")
+    if not sum(weights.values()) > 0:
+        raise ValueError(f"{where}: at least one weight must be positive")
+    return {str(name): weight for name, weight in weights.items()}
+
+def _normalize_activity(activity, where):
+    from templates import CompiledTemplate
+    _check_keys(activity, ACTIVITY_KEYS, where)
+    parameter = activity.get('parameter')
+    if parameter == 'batch' or parameter is None:
+        kind = parameter
+    elif isinstance(parameter, dict) and set(parameter) <= {'range', 'max_step'} and 'range' in parameter:
+        kind = 'range'
+        max_step = parameter.get('max_step', 0)
+        if not isinstance(max_step, int) or max_step < 0:
+            raise ValueError(f"{where}: max_step must be a non-negative integer")
+        parameter = {'range': _bounds(parameter['range'], f"{where} range"), 'max_step': max_step}
+    elif isinstance(parameter, dict) and set(parameter) == {'choices'}:
+        kind = 'choices'
+        if not isinstance(parameter['choices'], (list, tuple)) or not parameter['choices']:
+            raise ValueError(f"{where}: choices must be a non-empty list")
+        parameter = {'choices': [str(choice) for choice in parameter['choices']]}
+    else:
+        raise ValueError(f"{where}: parameter must be 'batch', {{range: [low, high], max_step: n}} or "
+                         f"{{choices: [...]}}, got {parameter!r}")
+
+    templates = _weights(activity.get('templates') or [], f"{where} templates")
+    for text in templates:
+        fields = len(CompiledTemplate(-1, None, text).fields)
+        if fields != PARAMETER_FIELDS[kind]:
+            raise ValueError(f"{where}: template {text!r} has {fields} placeholders but parameter "
+                             f"{kind or 'none'} fills {PARAMETER_FIELDS[kind]}")
+    return {'templates': [[text, weight] for text, weight in templates.items()],
+            'interval': _bounds(activity.get('interval', [0, 0]), f"{where} interval"),
+            'parameter': parameter}
+
+def _normalize_line(spec, where):
+    """Checked copy of one line's settings, with every default filled in"""
+    from augmentation import START_DATE, START_TIME, BATCH_NUMBER_FORMAT
+    _check_keys(spec, LINE_KEYS, where)
+    line = {'name': str(spec.get('name', 'default')), 'weight': spec.get('weight', 1)}
+    if not isinstance(line['weight'], (int, float)) or isinstance(line['weight'], bool) or line['weight'] <= 0:
+        raise ValueError(f"{where}: weight must be a positive number")
+
+    # YAML reads an unquoted date as a date object
+    line['start_date'] = str(spec.get('start_date', START_DATE))
+    line['start_time'] = spec.get('start_time', START_TIME)
+    try:
+        datetime.strptime(line['start_date'], '%Y-%m-%d')
+        datetime.strptime(line['start_time'], '%H:%M:%S')
+    except (TypeError, ValueError):
+        raise ValueError(f"{where}: start_date must be 'YYYY-MM-DD' and start_time a quoted 'HH:MM:SS'")
+    line['batch_number_format'] = spec.get('batch_number_format', BATCH_NUMBER_FORMAT)
+    try:
+        line['batch_number_format'].format(1)
+    except (AttributeError, IndexError, KeyError, ValueError):
+        raise ValueError(f"{where}: batch_number_format must be a format string with one field, "
+                         f"got {line['batch_number_format']!r}")
+
+    users = spec.get('users')
+    if not isinstance(users, (list, tuple)) or not users:
+        raise ValueError(f"{where}: users must be a non-empty list")
+    line['users'] = [str(user) for user in users]
+
+    activities = spec.get('activities')
+    if not isinstance(activities, dict) or not activities:
+        raise ValueError(f"{where}: activities must be a non-empty mapping")
+    line['activities'] = {str(activity_type): _normalize_activity(activity, f"{where} activity {activity_type!r}")
+                          for activity_type, activity in activities.items()}
+
+    sequence = spec.get('sequence') or {}
+    _check_keys(sequence, SEQUENCE_KEYS, f"{where} sequence")
+    parts = {part: list(sequence.get(part) or []) for part in ('opening', 'middle', 'closing')}
+    for part, activity_types in parts.items():
+        for activity_type in activity_types:
+            if activity_type not in line['activities']:
+                raise ValueError(f"{where}: sequence {part} lists {activity_type!r}, which is not an activity")
+    if not any(parts.values()):
+        raise ValueError(f"{where}: the sequence has no activities")
+    min_middle = sequence.get('min_middle', len(parts['middle']))
+    if not isinstance(min_middle, int) or not 0 <= min_middle <= len(parts['middle']):
+        raise ValueError(f"{where}: min_middle must be between 0 and the {len(parts['middle'])} middle activities")
+    line['sequence'] = {**parts, 'min_middle': min_middle}
+    return line
+
+def _normalize_anomalies(spec, where):
+    from incorrect_augmentation import ANOMALY_TYPES
+    _check_keys(spec, ANOMALY_KEYS, where)
+    anomalies = {}
+    for key in ('users', 'alarms', 'solutions'):
+        if key in spec:
+            if not isinstance(spec[key], (list, tuple)) or not spec[key]:
+                raise ValueError(f"{where}: {key} must be a non-empty list")
+            anomalies[key] = [str(value) for value in spec[key]]
+    if 'adjustments' in spec:
+        if not isinstance(spec['adjustments'], dict) or not spec['adjustments']:
+            raise ValueError(f"{where}: adjustments must map parameter names to [low, high]")
+        anomalies['adjustments'] = {str(param): _bounds(bounds, f"{where} adjustment {param!r}", (int, float))
+                                    for param, bounds in spec['adjustments'].items()}
+    if 'mix' in spec:
+        mix = _weights(spec['mix'], f"{where} mix")
+        unknown = sorted(set(mix) - set(ANOMALY_TYPES))
+        if unknown:
+            raise ValueError(f"{where}: unknown anomaly types {unknown}, expected some of {ANOMALY_TYPES}")
+        anomalies['mix'] = mix
+    return anomalies
+
+def _merge(base, override):
+    """base with override merged in; nested mappings are merged, anything else replaced"""
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            value = _merge(merged[key], value)
+        merged[key] = value
+    return merged
+
+def normalize_spec(spec):
+    """Validate a parsed spec; returns it with every line merged and every default filled in"""
+    _check_keys(spec, SPEC_KEYS, 'scenario')
+    name = str(spec.get('name', 'scenario'))
+    base = {key: value for key, value in spec.items() if key not in ('name', 'lines', 'anomalies')}
+    lines = spec.get('lines') or [{'name': name}]
+    if not isinstance(lines, list):
+        raise ValueError(f"scenario {name!r}: lines must be a list")
+    normalized = [_normalize_line(_merge(base, line), f"scenario {name!r} line {i}") for i, line in enumerate(lines)]
+    names = [line['name'] for line in normalized]
+    if len(set(names)) != len(names):
+        raise ValueError(f"scenario {name!r}: line names must be unique, got {names}")
+    return {'name': name, 'lines': normalized,
+            'anomalies': _normalize_anomalies(spec.get('anomalies') or {}, f"scenario {name!r} anomalies")}
+
+class ProductionLine:
+    """
+    One line's settings compiled into sampling tables. Activity types are
+    indexed in spec order; templates are laid out by activity type, with
+    template_base/template_total giving each type's range of the running
+    weight and template_last its final template with a positive weight
+    """
+
+    def __init__(self, spec):
+        import numpy as np
+        self.name = spec['name']
+        self.weight = spec['weight']
+        self.start_date = datetime.strptime(spec['start_date'], '%Y-%m-%d')
+        self.start_time = datetime.strptime(spec['start_time'], '%H:%M:%S')
+        self.batch_number_format = spec['batch_number_format']
+        self.users = spec['users']
+
+        activities = spec['activities']
+        self.activity_types = list(activities)
+        self.activity_index = {activity_type: i for i, activity_type in enumerate(self.activity_types)}
+        sequence = spec['sequence']
+        self.opening, self.middle, self.closing = sequence['opening'], sequence['middle'], sequence['closing']
+        self.min_middle = sequence['min_middle']
+        self.opening_ids, self.middle_ids, self.closing_ids = (
+            np.array([self.activity_index[a] for a in part], dtype=np.int64)
+            for part in (self.opening, self.middle, self.closing))
+
+        self.parameters = {a: activity['parameter'] for a, activity in activities.items()}
+        self.batch_ids = np.array([self.activity_index[a] for a, p in self.parameters.items() if p == 'batch'],
+                                  dtype=np.int64)
+        self.intervals = {a: tuple(activity['interval']) for a, activity in activities.items()}
+        self.interval_lo = np.array([self.intervals[a][0] for a in self.activity_types], dtype=np.int64)
+        self.interval_hi = np.array([self.intervals[a][1] for a in self.activity_types], dtype=np.int64)
+
+        # Template tables: texts and cumulative weights for the random module
+        # (None when uniform, so rng.choice keeps its draws), flat arrays for NumPy
+        self.texts, self.cum_weights = {}, {}
+        self.templates, weights, base, total, last = [], [], [], [], []
+        for activity_type, activity in activities.items():
+            texts = [text for text, _ in activity['templates']]
+            activity_weights = [weight for _, weight in activity['templates']]
+            self.texts[activity_type] = texts
+            self.cum_weights[activity_type] = (None if len(set(activity_weights)) == 1
+                                               else list(accumulate(activity_weights)))
+            base.append(sum(weights))
+            total.append(sum(activity_weights))
+            last.append(len(self.templates) + max(i for i, w in enumerate(activity_weights) if w > 0))
+            self.templates.extend((activity_type, text) for text in texts)
+            weights.extend(activity_weights)
+        self.template_cumulative = np.cumsum(weights)
+        self.template_base = np.array(base, dtype=float)
+        self.template_total = np.array(total, dtype=float)
+        self.template_last = np.array(last, dtype=np.int64)
+
+    def choose_template(self, activity_type, rng):
+        """One template text of activity_type, drawn with a random-module style RNG"""
+        cum_weights = self.cum_weights[activity_type]
+        if cum_weights is None:
+            return rng.choice(self.texts[activity_type])
+        return rng.choices(self.texts[activity_type], cum_weights=cum_weights)[0]
+
+    def sample_templates(self, activity_ids, rng):
+        """Index into self.templates for every entry of activity_ids, drawn with a NumPy Generator"""
+        import numpy as np
+        targets = self.template_base[activity_ids] + rng.random(len(activity_ids)) * self.template_total[activity_ids]
+        positions = np.searchsorted(self.template_cumulative, targets, side='right')
+        return np.minimum(positions, self.template_last[activity_ids])
+
+class Scenario:
+    """A validated spec compiled into its production lines"""
+
+    def __init__(self, spec):
+        spec = normalize_spec(spec)
+        self.spec = spec
+        self.digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+        self.name = spec['name']
+        self.lines = [ProductionLine(line) for line in spec['lines']]
+        self.line_cum_weights = list(accumulate(line.weight for line in self.lines))
+        self.anomalies = spec['anomalies']
+
+    def __repr__(self):
+        return f"Scenario({self.name!r}, lines={[line.name for line in self.lines]})"
+
+def parse_spec(data, path=''):
+    """Parse spec text: YAML for .yaml/.yml paths, JSON otherwise"""
+    if path.endswith(('.yaml', '.yml')):
+        import yaml
+        return yaml.safe_load(data)
+    return json.loads(data)
+
+@functools.lru_cache(maxsize=None)
+def _compiler_version():
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in COMPILER_MODULES:
+        with open(os.path.join(directory, f'{module}.py'), 'rb') as f:
+            digest.update(f.read())
+    return digest.digest()
+
+def scenario_cache_dir():
+    from dataset_cache import DEFAULT_CACHE_DIR
+    return os.path.join(os.environ.get('AUDIT_LOG_CACHE_DIR', DEFAULT_CACHE_DIR), 'scenarios')
+
+def load_scenario(path):
+    """Compile the spec at path, reusing the compilation of an unchanged spec"""
+    stat = os.stat(path)
+    return _load_scenario(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+@functools.lru_cache(maxsize=None)
+def _load_scenario(path, mtime_ns, size):
+    with open(path, 'rb') as f:
+        data = f.read()
+    key = hashlib.sha256(data + _compiler_version()).hexdigest()[:32]
+    cache_file = os.path.join(scenario_cache_dir(), key + '.pickle')
+    try:
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    scenario = Scenario(parse_spec(data, path))
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = f'{cache_file}.tmp-{os.getpid()}'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(scenario, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        # A read-only cache only costs the next run a recompile
+        pass
+    return scenario
+
+@functools.lru_cache(maxsize=None)
+def default_scenario():
+    return Scenario(default_spec())
+
+def resolve_scenario(scenario=None):
+    """
+    The Scenario for a spec path, a parsed spec or a Scenario (the built-in
+    tables when None), with its templates added to the template registry
+    """
+    if scenario is None:
+        scenario = default_scenario()
+    elif isinstance(scenario, (str, os.PathLike)):
+        scenario = load_scenario(scenario)
+    elif isinstance(scenario, dict):
+        scenario = Scenario(scenario)
+    if scenario.digest not in _registered:
+        _registered.add(scenario.digest)
+        _register_templates(scenario)
+    return scenario
+
+def _register_templates(scenario):
+    """Make the scenario's descriptions renderable and recognizable in this process"""
+    from templates import get_registry
+    from incorrect_augmentation import AuditLogGenerator
+    registry = get_registry()
+    num_templates = len(registry.templates)
+    # Scenarios sample their own tables, so the registry never draws these
+    for line in scenario.lines:
+        for activity_type, text in line.templates:
+            registry.register(activity_type, text, weight=0)
+    for activity_type, text in AuditLogGenerator(scenario=scenario).activity_templates():
+        registry.register(activity_type, text, weight=0)
+    if len(registry.templates) > num_templates:
+        from activity_classifier import get_classifier
+        get_classifier.cache_clear()
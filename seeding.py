@@ -0,0 +1,39 @@
+import random
+
+def python_rng(rng=None):
+    """
+    Resolve a seed or RNG into something with the random module's API.
+    None keeps the global random module, an int seeds a new random.Random,
+    an existing random.Random instance is used as is and a NumPy Generator
+    seeds a new random.Random from its stream
+    """
+    if rng is None or rng is random:
+        return random
+    if isinstance(rng, random.Random):
+        return rng
+    if hasattr(rng, 'bit_generator'):
+        # numpy.random.Generator: seed a Python RNG from its stream
+        return random.Random(int(rng.integers(2 ** 63)))
+    return random.Random(rng)
+
+def numpy_rng(rng=None):
+    """
+    Resolve a seed or RNG into a numpy.random.Generator. A Generator is used
+    as is and an int or SeedSequence seeds a new one. None and Python RNGs
+    (the random module or a random.Random instance) seed it from their own
+    stream, so random.seed() also fixes the NumPy draws
+    """
+    import numpy as np
+    if rng is None or rng is random or isinstance(rng, random.Random):
+        return np.random.default_rng((rng or random).getrandbits(64))
+    return np.random.default_rng(rng)
+
+def shard_seed(seed, shard_index):
+    """
+    Derive the seed for one shard from the master seed and the shard index.
+    Shards get statistically independent streams, and the same (seed,
+    shard_index) pair always maps to the same value
+    """
+    import numpy as np
+    state = np.random.SeedSequence(seed, spawn_key=(shard_index,)).generate_state(2, dtype=np.uint32)
+    return int(state[0]) << 32 | int(state[1])
@@ -0,0 +1,173 @@
+"""
+Incremental sliding-window encoder over audit log CSVs.
+
+Rows are grouped into sequences per user: a login opens a new sequence, a
+logout closes it, and a row from a user without an open sequence opens one
+implicitly. Each row's Activity Description is mapped to an activity-type ID
+and every sequence is cut into fixed-length windows of IDs.
+
+The encoder reads a file from the byte offset where the previous run stopped
+and only ever consumes complete lines. Its state (offset, column order and
+the still-open sequences) can be saved to a JSON checkpoint, so rerunning on
+a grown log only encodes the windows contributed by the new rows.
+"""
+import csv
+import io
+import json
+import os
+
+PAD_ID = 0
+UNKNOWN_ID = 1
+
+def activity_vocabulary():
+    """Activity-type names by ID: padding, unknown, then the registry's activity types"""
+    from templates import get_registry
+    return ['<pad>', '<unknown>'] + list(get_registry().activity_types)
+
+def parse_csv_header(line):
+    """Column names of a CSV header line (bytes): quoted names are unquoted and a UTF-8 BOM is dropped"""
+    return next(csv.reader([line.decode('utf-8-sig').rstrip('\r\n')]))
+
+class SequenceEncoder:
+    """
+    Sliding windows of `window` activity IDs, taken every `stride` rows of a
+    sequence. Sequences shorter than the window yield one padded window when
+    they close. Each window's label is the largest Anomaly value it covers
+    """
+
+    def __init__(self, window=8, stride=1, checkpoint_file=None, chunk_bytes=1 << 24):
+        from activity_classifier import get_classifier
+        from templates import get_registry
+        self.window = window
+        self.stride = stride
+        self.checkpoint_file = checkpoint_file
+        self.chunk_bytes = chunk_bytes
+        self.registry = get_registry()
+        self.classifier = get_classifier()
+        self.path = None
+        self.offset = 0
+        self.columns = None
+        self.open_sequences = {}
+        if checkpoint_file and os.path.exists(checkpoint_file):
+            self.load_checkpoint()
+
+    def encode_file(self, path):
+        """
+        Encode everything appended to path since the last call or checkpoint.
+        Returns (windows, labels): int32 array of shape (n, window) and int8
+        array of shape (n,)
+        """
+        if path != self.path or os.path.getsize(path) < self.offset:
+            # New or truncated file: start from scratch
+            self.path, self.offset, self.columns, self.open_sequences = path, 0, None, {}
+
+        windows, labels = [], []
+        with open(path, 'rb') as f:
+            f.seek(self.offset)
+            if self.columns is None:
+                header = f.readline()
+                if not header.endswith(b'\n'):
+                    return self._result(windows, labels)
+                self.columns = parse_csv_header(header)
+                self.offset = f.tell()
+            while True:
+                chunk = f.read(self.chunk_bytes)
+                end = chunk.rfind(b'\n') + 1
+                if end == 0:
+                    break
+                self._encode_rows(chunk[:end], windows, labels)
+                self.offset += end
+                f.seek(self.offset)
+
+        if self.checkpoint_file:
+            self.save_checkpoint()
+        return self._result(windows, labels)
+
+    def close_all(self):
+        """Close every open sequence (end of input) and return its remaining windows"""
+        windows, labels = [], []
+        for user in list(self.open_sequences):
+            self._close(user, windows, labels)
+        return self._result(windows, labels)
+
+    def _encode_rows(self, data, windows, labels):
+        import pandas as pd
+        df = pd.read_csv(io.BytesIO(data), header=None, names=self.columns, dtype=str, keep_default_na=False)
+        activity_ids = self.classifier.classify_batch(df['Activity Description'])['activity_id']
+        activity_ids = (activity_ids.astype('int32') + 2).clip(min=UNKNOWN_ID)
+        login_id = 2 + self.registry.activity_index['login']
+        logout_id = 2 + self.registry.activity_index['logout']
+
+        for user, activity_id, anomaly in zip(df['User'].tolist(), activity_ids.tolist(), df['Anomaly'].tolist()):
+            if activity_id == login_id and user in self.open_sequences:
+                self._close(user, windows, labels)
+            sequence = self.open_sequences.setdefault(user, {'ids': [], 'labels': [], 'emitted': False})
+            sequence['ids'].append(activity_id)
+            sequence['labels'].append(1 if anomaly not in ('0', '') else 0)
+            self._emit_ready(sequence, windows, labels)
+            if activity_id == logout_id:
+                self._close(user, windows, labels)
+
+    def _emit_ready(self, sequence, windows, labels):
+        """Emit every full window of an open sequence, then drop rows no later window needs"""
+        ids, row_labels = sequence['ids'], sequence['labels']
+        start = 0
+        while start + self.window <= len(ids):
+            windows.append(ids[start:start + self.window])
+            labels.append(max(row_labels[start:start + self.window]))
+            sequence['emitted'] = True
+            start += self.stride
+        if start:
+            del ids[:start]
+            del row_labels[:start]
+
+    def _close(self, user, windows, labels):
+        sequence = self.open_sequences.pop(user)
+        if not sequence['emitted'] and sequence['ids']:
+            padding = self.window - len(sequence['ids'])
+            windows.append(sequence['ids'] + [PAD_ID] * padding)
+            labels.append(max(sequence['labels']))
+
+    def _result(self, windows, labels):
+        import numpy as np
+        return (np.array(windows, dtype=np.int32).reshape(-1, self.window),
+                np.array(labels, dtype=np.int8))
+
+    def save_checkpoint(self):
+        """Persist offset, columns and open sequences; written atomically"""
+        state = {
+            'path': self.path,
+            'offset': self.offset,
+            'columns': self.columns,
+            'window': self.window,
+            'stride': self.stride,
+            'open_sequences': self.open_sequences
+        }
+        tmp_file = self.checkpoint_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def load_checkpoint(self):
+        with open(self.checkpoint_file) as f:
+            state = json.load(f)
+        if (state['window'], state['stride']) != (self.window, self.stride):
+            raise ValueError(f"Checkpoint {self.checkpoint_file} was written with window={state['window']}, "
+                             f"stride={state['stride']}")
+        self.path = state['path']
+        self.offset = state['offset']
+        self.columns = state['columns']
+        self.open_sequences = state['open_sequences']
+
+def encode_csv(path, window=8, stride=1, checkpoint_file=None):
+    """
+    Encode a whole file (or, with a checkpoint, its new rows). Without a
+    checkpoint every sequence is closed at the end of the file
+    """
+    import numpy as np
+    encoder = SequenceEncoder(window, stride, checkpoint_file)
+    windows, labels = encoder.encode_file(path)
+    if checkpoint_file:
+        return windows, labels
+    tail_windows, tail_labels = encoder.close_all()
+    return np.concatenate([windows, tail_windows]), np.concatenate([labels, tail_labels])
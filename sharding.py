@@ -0,0 +1,122 @@
+"""
+Multi-process sharded generation of the audit log datasets.
+
+The sequence range is split into contiguous shards. Every shard draws from
+its own RNG, seeded from the master seed and the shard index, so the output
+is identical for a given (seed, num_shards) no matter how many processes
+run it or in which order the shards finish.
+"""
+import contextlib
+import os
+import shutil
+
+import profiling
+from output_formats import AuditLogWriter, format_for_path, iter_audit_log_batches
+from seeding import shard_seed
+
+GENERATORS = ('normal', 'anomalies')
+
+def shard_bounds(num_sequences, num_shards):
+    """Split range(num_sequences) into num_shards contiguous (first_sequence, count) pairs"""
+    base, extra = divmod(num_sequences, num_shards)
+    bounds = []
+    first_sequence = 0
+    for shard_index in range(num_shards):
+        count = base + (1 if shard_index < extra else 0)
+        bounds.append((first_sequence, count))
+        first_sequence += count
+    return bounds
+
+def part_file_name(output_file, shard_index):
+    """Name of the part file holding one shard of output_file"""
+    root, ext = os.path.splitext(output_file)
+    return f"{root}.part-{shard_index:05d}{ext}"
+
+def iter_shard_chunks(generator, first_sequence, count, rng, chunk_size, options, render=True):
+    """The chunks of one shard: count sequences from first_sequence on, drawn from rng"""
+    if generator == 'normal':
+        from augmentation import iter_audit_log_chunks
+        return iter_audit_log_chunks(count, chunk_size, options.get('vectorized', False), rng=rng,
+                                     first_sequence=first_sequence, scenario=options.get('scenario'), render=render)
+    if generator == 'anomalies':
+        from incorrect_augmentation import iter_dataset_chunks
+        return iter_dataset_chunks(count, chunk_size, options.get('anomaly_probability', 0.3), rng=rng,
+                                   first_sequence=first_sequence, scenario=options.get('scenario'), render=render)
+    raise ValueError(f"Unknown generator {generator!r}, expected one of {GENERATORS}")
+
+def _write_shard(task):
+    """
+    Generate one shard and write it to its part file (runs in a worker
+    process). Returns the worker's profiling stats when the parent profiles
+    """
+    generator, shard_index, first_sequence, count, seed, part_file, chunk_size, output_format, options, \
+        profiled = task
+    rng = shard_seed(seed, shard_index)
+    with profiling.profile() if profiled else contextlib.nullcontext() as worker_profile:
+        with AuditLogWriter(part_file, output_format) as writer:
+            for chunk in iter_shard_chunks(generator, first_sequence, count, rng, chunk_size, options, render=False):
+                writer.write(chunk)
+    return part_file, writer.num_records, worker_profile.stats() if profiled else None
+
+def merge_part_files(part_files, output_file, output_format=None):
+    """
+    Merge part files into output_file. CSV parts are concatenated byte for
+    byte, keeping only the first header; columnar parts are re-encoded batch
+    by batch so the merged file has a single set of dictionaries
+    """
+    output_format = format_for_path(output_file, output_format)
+    if output_format != 'csv':
+        with AuditLogWriter(output_file, output_format) as writer:
+            for part_file in part_files:
+                for batch in iter_audit_log_batches(part_file, output_format):
+                    writer.write(batch)
+        return
+
+    with open(output_file, 'wb') as out:
+        for i, part_file in enumerate(part_files):
+            with open(part_file, 'rb') as f:
+                header = f.readline()
+                if i == 0:
+                    out.write(header)
+                shutil.copyfileobj(f, out, 1024 * 1024)
+        profiling.count('bytes_written', out.tell())
+
+def generate_sharded(generator, num_sequences, output_file, seed=0, num_shards=None, processes=None,
+                     chunk_size=10000, merge=True, output_format=None, **options):
+    """
+    Generate a dataset in parallel shards.
+
+    generator is 'normal' (augmentation) or 'anomalies' (incorrect_augmentation);
+    extra options (vectorized, anomaly_probability, scenario) are passed through to it.
+    With merge=True the part files are concatenated into output_file and
+    removed; otherwise they are kept and their paths returned. output_format
+    is 'csv', 'parquet' or 'arrow' (inferred from the extension when None).
+    Returns (files, num_records)
+    """
+    if generator not in GENERATORS:
+        raise ValueError(f"Unknown generator {generator!r}, expected one of {GENERATORS}")
+    from concurrent.futures import ProcessPoolExecutor
+    num_shards = num_shards or os.cpu_count() or 1
+    output_format = format_for_path(output_file, output_format)
+    active_profile = profiling.current()
+    tasks = [(generator, shard_index, first_sequence, count, seed,
+              part_file_name(output_file, shard_index), chunk_size, output_format, options,
+              active_profile is not None)
+             for shard_index, (first_sequence, count) in enumerate(shard_bounds(num_sequences, num_shards))]
+
+    with ProcessPoolExecutor(max_workers=processes or min(num_shards, os.cpu_count() or 1)) as pool:
+        results = list(pool.map(_write_shard, tasks))
+
+    part_files = [part_file for part_file, _, _ in results]
+    num_records = sum(n for _, n, _ in results)
+    if active_profile is not None:
+        for _, _, stats in results:
+            active_profile.merge(stats)
+    if not merge:
+        return part_files, num_records
+
+    with profiling.stage('merge'):
+        merge_part_files(part_files, output_file, output_format)
+    for part_file in part_files:
+        os.remove(part_file)
+    return [output_file], num_records
@@ -0,0 +1,343 @@
+"""
+Online anomaly detection over live audit logs.
+
+    python stream_detector.py audit_logs.csv --follow               # tail a growing CSV
+    python stream_detector.py events.jsonl --follow --only-anomalies
+    tail -f audit_logs.csv | python stream_detector.py -            # stdin, CSV with header
+
+Each input row gets a JSON verdict line with its score and the rules it
+breaks, using the rules and weights of anomaly_scorer. Unlike the batch
+scorer, a verdict only sees the rows before it: of a swapped pair of steps
+or a repeated solution change, only the later row is flagged, and a batch
+end with no open batch (the logout came first) is flagged on arrival.
+
+State is one small record per open sequence, keyed by source and user. A
+login opens a sequence and a batch end, batch deletion or logout evicts it;
+rows arriving with no open sequence are checked against a throwaway record
+rather than opening one. The least recently active sequences are also
+evicted beyond max_open or after idle_timeout seconds without a row, so
+memory stays bounded however many batches run at once. Sources are read by
+asyncio tasks feeding a single detector task, and each event's latency (line
+read to verdict written) is tracked for p50/p99 reporting. A line that does
+not parse, or a source that cannot be read, gets an error line in place of
+a verdict and the other rows carry on.
+"""
+import argparse
+import asyncio
+import collections
+import csv
+import json
+import os
+import sys
+import time
+from activity_classifier import get_classifier, to_number
+from anomaly_scorer import RULE_WEIGHTS, normal_ranges
+
+class LatencyStats:
+    """Per-event latencies of the most recent `window` events"""
+
+    def __init__(self, window=100000):
+        self.samples = collections.deque(maxlen=window)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentiles(self):
+        import numpy as np
+        if not self.samples:
+            return {'p50_ms': None, 'p99_ms': None}
+        p50, p99 = np.percentile(np.fromiter(self.samples, float, len(self.samples)), [50, 99]) * 1000
+        return {'p50_ms': round(float(p50), 3), 'p99_ms': round(float(p99), 3)}
+
+class _Sequence:
+    """What the detector remembers about one open sequence"""
+
+    __slots__ = ('step', 'on_reference', 'batch_open', 'solution_changes', 'last_seen')
+
+    def __init__(self):
+        self.step = -1
+        self.on_reference = True
+        self.batch_open = False
+        self.solution_changes = 0
+        self.last_seen = 0.0
+
+class StreamingDetector:
+    """Row-at-a-time version of the anomaly_scorer rules"""
+
+    def __init__(self, max_open=100000, reference=None, idle_timeout=None):
+        self.classifier = get_classifier()
+        if reference is None:
+            from demo import CORRECT_SEQUENCE
+            reference = CORRECT_SEQUENCE
+        registry = self.classifier.registry
+        self.steps = {registry.lookup(text).template_id: step for step, (_, text) in enumerate(reference)}
+        self.ranges = normal_ranges()
+        self.max_open = max_open
+        self.idle_timeout = idle_timeout
+        self.open_sequences = collections.OrderedDict()
+        self.latency = LatencyStats()
+        self.events = 0
+        self.anomalies = 0
+        self.evicted = 0
+        self.errors = 0
+
+    def _evict_idle(self, now):
+        cutoff = now - self.idle_timeout
+        while self.open_sequences:
+            key, sequence = next(iter(self.open_sequences.items()))
+            if sequence.last_seen >= cutoff:
+                break
+            del self.open_sequences[key]
+            self.evicted += 1
+
+    def process(self, record, source=None):
+        """
+        Verdict (score and broken rules) for one row, given as a column ->
+        value mapping. Sequences are tracked per (source, user)
+        """
+        user = record.get('User')
+        # JSONL values can be anything; the user is part of a dict key
+        user = '' if user is None else str(user)
+        key = (source, user)
+        description = record.get('Activity Description')
+        # Missing or non-text descriptions go the unrecognized way
+        template, slots = self.classifier.classify(description) if isinstance(description, str) else (None, ())
+        activity_type = template.activity_type if template is not None else None
+        rules = []
+
+        now = time.monotonic()
+        if self.idle_timeout is not None:
+            self._evict_idle(now)
+        if activity_type == 'login':
+            self.open_sequences.pop(key, None)
+            sequence = self.open_sequences[key] = _Sequence()
+            if len(self.open_sequences) > self.max_open:
+                self.open_sequences.popitem(last=False)
+                self.evicted += 1
+        else:
+            sequence = self.open_sequences.get(key)
+            if sequence is None:
+                # Only a login opens a sequence; rows after it closed are checked alone
+                sequence = _Sequence()
+            else:
+                self.open_sequences.move_to_end(key)
+        sequence.last_seen = now
+
+        if template is None:
+            rules.append('unrecognized')
+        elif activity_type in self.ranges:
+            low, high = self.ranges[activity_type]
+            if any(not low <= value <= high for value in map(to_number, slots) if value == value):
+                rules.append('out_of_range')
+        if activity_type in ('batch_deletion', 'unexpected_action'):
+            rules.append(activity_type)
+        elif activity_type in ('alarm_resolved', 'alarm_acknowledged'):
+            rules.append('alarm')
+        elif activity_type == 'batch_start':
+            sequence.batch_open = True
+        elif activity_type == 'batch_end':
+            if not sequence.batch_open:
+                rules.append('logout_before_batch_end')
+            sequence.batch_open = False
+        elif activity_type == 'solution_change':
+            sequence.solution_changes += 1
+            if sequence.solution_changes > 1:
+                rules.append('duplicate_solution_change')
+
+        # Order is checked while every row so far has been a reference step
+        step = self.steps.get(template.template_id) if template is not None else None
+        if step is None:
+            if activity_type != 'unexpected_action':
+                sequence.on_reference = False
+        elif sequence.on_reference:
+            if step < sequence.step:
+                rules.append('step_reordered')
+            sequence.step = step
+
+        if activity_type == 'logout' and sequence.batch_open:
+            rules.append('logout_before_batch_end')
+        if activity_type in ('batch_end', 'batch_deletion', 'logout'):
+            self.open_sequences.pop(key, None)
+
+        score = max((RULE_WEIGHTS[rule] for rule in rules), default=0.0)
+        self.events += 1
+        self.anomalies += score > 0
+        return {'user': user, 'activity_type': activity_type, 'score': score, 'rules': rules}
+
+    def stats(self):
+        return {
+            'events': self.events,
+            'anomalies': self.anomalies,
+            'open_sequences': len(self.open_sequences),
+            'evicted': self.evicted,
+            'errors': self.errors,
+            **self.latency.percentiles()
+        }
+
+class _LineParser:
+    """Turns CSV (header first) or JSONL lines into column -> value dicts"""
+
+    def __init__(self, input_format):
+        self.input_format = input_format
+        self.columns = None
+
+    def parse(self, line):
+        """Column -> value dict of line, None for blank or header lines; ValueError if malformed"""
+        line = line.decode('utf-8').rstrip('\r\n')
+        if not line:
+            return None
+        if self.input_format == 'jsonl':
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object, got %s" % type(record).__name__)
+            return record
+        values = next(csv.reader([line]))
+        if self.columns is None:
+            self.columns = values
+            return None
+        return dict(zip(self.columns, values))
+
+async def _feed(data, pending, parser, source, queue):
+    """Queue every complete line of pending + data; returns the incomplete remainder"""
+    lines = (pending + data).split(b'\n')
+    for line in lines[:-1]:
+        try:
+            record = parser.parse(line)
+        except ValueError as e:
+            # Covers JSON and UTF-8 decode errors; the line is reported and skipped
+            await queue.put((time.perf_counter(), source, None, "malformed line: %s" % e))
+            continue
+        if record is not None:
+            await queue.put((time.perf_counter(), source, record, None))
+    return lines[-1]
+
+async def _read_source(reader, source, queue):
+    """Run one reader, turning a failure to read its source into an error line"""
+    try:
+        await reader
+    except OSError as e:
+        await queue.put((time.perf_counter(), source, None, "cannot read source: %s" % e))
+
+async def tail_file(path, queue, follow=False, poll_interval=0.1, input_format=None):
+    """
+    Queue the rows of path; with follow, keep polling for appended lines and
+    start over if the file is truncated
+    """
+    input_format = input_format or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+    parser, pending = _LineParser(input_format), b''
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(1 << 16)
+            if data:
+                pending = await _feed(data, pending, parser, path, queue)
+                # Let the detector catch up before reading on
+                await asyncio.sleep(0)
+                continue
+            if not follow:
+                break
+            if os.path.getsize(path) < f.tell():
+                f.seek(0)
+                parser, pending = _LineParser(input_format), b''
+            await asyncio.sleep(poll_interval)
+    if pending:
+        await _feed(b'\n', pending, parser, path, queue)
+
+async def read_stdin(queue, input_format='csv'):
+    """Queue the rows arriving on stdin until it closes"""
+    loop = asyncio.get_running_loop()
+    parser, pending = _LineParser(input_format), b''
+    while True:
+        data = await loop.run_in_executor(None, sys.stdin.buffer.read1, 1 << 16)
+        if not data:
+            break
+        pending = await _feed(data, pending, parser, '-', queue)
+    if pending:
+        await _feed(b'\n', pending, parser, '-', queue)
+
+async def _detect(detector, queue, out, only_anomalies):
+    while True:
+        item = await queue.get()
+        if item is None:
+            break
+        received, source, record, error = item
+        if error is None:
+            try:
+                verdict = detector.process(record, source)
+            except Exception as e:
+                # One bad record must not stop the detector, or the readers block on the full queue
+                error = "bad record: %s: %s" % (type(e).__name__, e)
+        if error is not None:
+            detector.errors += 1
+            out.write(json.dumps({'source': source, 'error': error}) + '\n')
+            if queue.empty():
+                out.flush()
+            continue
+        if verdict['score'] > 0 or not only_anomalies:
+            verdict = {'source': source, 'date': record.get('Date'), 'time': record.get('Time'),
+                       'description': record.get('Activity Description'), **verdict}
+            out.write(json.dumps(verdict) + '\n')
+        if queue.empty():
+            out.flush()
+        detector.latency.add(time.perf_counter() - received)
+
+async def _report(detector, interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(json.dumps(detector.stats()), file=sys.stderr)
+
+async def detect_stream(sources, out=None, follow=False, only_anomalies=False, input_format=None,
+                        poll_interval=0.1, stats_interval=None, detector=None):
+    """
+    Run a detector over the given files ('-' for stdin) until they end (or,
+    with follow, forever). Verdicts go to out as JSON lines; returns the
+    detector for its stats
+    """
+    detector = detector or StreamingDetector()
+    queue = asyncio.Queue(maxsize=10000)
+    detect_task = asyncio.create_task(_detect(detector, queue, out or sys.stdout, only_anomalies))
+    report_task = asyncio.create_task(_report(detector, stats_interval)) if stats_interval else None
+
+    readers = [_read_source(read_stdin(queue, input_format or 'csv') if source == '-' else
+                            tail_file(source, queue, follow, poll_interval, input_format), source, queue)
+               for source in sources]
+    try:
+        await asyncio.gather(*readers)
+        await queue.put(None)
+        await detect_task
+    finally:
+        if not detect_task.done():
+            detect_task.cancel()
+        if report_task:
+            report_task.cancel()
+    return detector
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream anomaly verdicts for live audit logs")
+    parser.add_argument('sources', nargs='+', help="CSV or JSONL files to read, '-' for stdin")
+    parser.add_argument('--follow', action='store_true', help="keep tailing the files as they grow")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                        help="input format (default: from the file extension, csv for stdin)")
+    parser.add_argument('--output', default=None, help="write verdicts here instead of stdout")
+    parser.add_argument('--only-anomalies', action='store_true', help="only emit rows with a non-zero score")
+    parser.add_argument('--poll-interval', type=float, default=0.1, help="seconds between polls when following")
+    parser.add_argument('--stats-interval', type=float, default=None, help="print stats to stderr this often")
+    parser.add_argument('--max-open', type=int, default=100000, help="open sequences kept before evicting")
+    parser.add_argument('--idle-timeout', type=float, default=None,
+                        help="evict sequences with no rows for this many seconds")
+    args = parser.parse_args(argv)
+
+    detector = StreamingDetector(args.max_open, idle_timeout=args.idle_timeout)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        asyncio.run(detect_stream(args.sources, out, args.follow, args.only_anomalies, args.format,
+                                  args.poll_interval, args.stats_interval, detector))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.output:
+            out.close()
+        print(json.dumps(detector.stats()), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
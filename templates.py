@@ -0,0 +1,197 @@
+"""
+Compiled registry of the activity description templates.
+
+Every template the generators can emit is compiled once into literal
+segments and placeholder names and given a stable integer ID. IDs are
+assigned in table order and templates that differ only in their placeholder
+names ("batch #{}" vs "batch #{batch_num}") share one ID. Rows can therefore
+be kept as (template_id, params) and rendered to strings only when written.
+"""
+import functools
+from string import Formatter
+
+class CompiledTemplate:
+    """A template split into literal segments around its placeholders"""
+
+    __slots__ = ('template_id', 'activity_type', 'text', 'literals', 'fields')
+
+    def __init__(self, template_id, activity_type, text):
+        parsed = list(Formatter().parse(text))
+        self.template_id = template_id
+        self.activity_type = activity_type
+        self.text = text
+        self.literals = tuple(literal for literal, _, _, _ in parsed)
+        self.fields = tuple(field for _, field, _, _ in parsed if field is not None)
+        if len(self.literals) == len(self.fields):
+            self.literals += ('',)
+
+    @property
+    def key(self):
+        """Placeholder-name independent identity of the template"""
+        return self.literals
+
+    def render(self, *values):
+        """Fill the placeholders positionally"""
+        parts = [self.literals[0]]
+        for value, literal in zip(values, self.literals[1:]):
+            parts.append(str(value))
+            parts.append(literal)
+        return ''.join(parts)
+
+    def render_named(self, params):
+        """Fill the placeholders from a mapping of field name to value"""
+        return self.render(*(params[field] for field in self.fields))
+
+class TemplateRegistry:
+    """
+    Templates grouped by activity type, with per-activity weight tables and
+    flat arrays for vectorized sampling and rendering (templates with up to
+    two placeholders render through the head/mid/tail arrays)
+    """
+
+    def __init__(self):
+        self.templates = []
+        self.activity_types = []
+        self.activity_index = {}
+        self.by_activity = {}
+        self.weights = []
+        self._by_key = {}
+        self._ids_by_text = {}
+
+    def register(self, activity_type, text, weight=1.0):
+        """
+        Intern a template and return its ID. A weight of 0 makes the template
+        known and renderable without it ever being sampled
+        """
+        template = CompiledTemplate(len(self.templates), activity_type, text)
+        if template.key in self._by_key:
+            return self._by_key[template.key]
+        if activity_type not in self.activity_index:
+            self.activity_index[activity_type] = len(self.activity_types)
+            self.activity_types.append(activity_type)
+            self.by_activity[activity_type] = []
+        self.templates.append(template)
+        self.weights.append(weight)
+        self.by_activity[activity_type].append(template.template_id)
+        self._by_key[template.key] = template.template_id
+        # Rebuild the derived arrays on next use
+        for name in ('sampling_tables', 'segments', 'activity_of_template'):
+            self.__dict__.pop(name, None)
+        return template.template_id
+
+    def lookup(self, text):
+        """
+        Compile a registered template text with its own placeholder names,
+        carrying the interned ID and activity type
+        """
+        template = CompiledTemplate(-1, None, text)
+        interned = self.templates[self._by_key[template.key]]
+        template.template_id = interned.template_id
+        template.activity_type = interned.activity_type
+        return template
+
+    def template_id(self, text):
+        """ID of a registered template text, memoized per text"""
+        template_id = self._ids_by_text.get(text)
+        if template_id is None:
+            template_id = self._ids_by_text[text] = self._by_key[CompiledTemplate(-1, None, text).key]
+        return template_id
+
+    @functools.cached_property
+    def sampling_tables(self):
+        """
+        (template_ids, cumulative, base, total, last): the template IDs of each
+        activity type are laid out contiguously in template_ids, cumulative is
+        the running weight over that layout, base/total give each activity's
+        weight range and last its final sampleable position
+        """
+        import numpy as np
+        template_ids, weights, base, total, last = [], [], [], [], []
+        for activity_type in self.activity_types:
+            ids = self.by_activity[activity_type]
+            base.append(sum(weights))
+            template_ids.extend(ids)
+            weights.extend(self.weights[i] for i in ids)
+            total.append(sum(self.weights[i] for i in ids))
+            last.append(max((len(template_ids) - len(ids) + j for j, i in enumerate(ids) if self.weights[i] > 0),
+                            default=len(template_ids) - 1))
+        return (np.array(template_ids), np.cumsum(weights), np.array(base), np.array(total), np.array(last))
+
+    def sample(self, activity_ids, rng):
+        """Draw one template ID per entry of activity_ids, following the weight tables"""
+        import numpy as np
+        template_ids, cumulative, base, total, last = self.sampling_tables
+        targets = base[activity_ids] + rng.random(len(activity_ids)) * total[activity_ids]
+        positions = np.minimum(np.searchsorted(cumulative, targets, side='right'), last[activity_ids])
+        return template_ids[positions]
+
+    @functools.cached_property
+    def segments(self):
+        """head, mid, tail object arrays, one entry per template ID"""
+        import numpy as np
+        padded = [t.literals + ('',) * (3 - len(t.literals)) for t in self.templates]
+        return tuple(np.array(column, dtype=object) for column in zip(*padded))
+
+    @functools.cached_property
+    def activity_of_template(self):
+        """Activity type index for every template ID"""
+        import numpy as np
+        return np.array([self.activity_index[t.activity_type] for t in self.templates])
+
+    def render(self, template_ids, first=None, second=None):
+        """
+        Render descriptions for arrays of template IDs and their (string)
+        placeholder values; rows without placeholders can carry ''
+        """
+        import numpy as np
+        head, mid, tail = self.segments
+        descriptions = head[template_ids]
+        if first is None:
+            return descriptions
+        filled = np.flatnonzero(first != '')
+        ids = template_ids[filled]
+        second = second[filled] if second is not None else ''
+        descriptions[filled] = head[ids] + first[filled] + mid[ids] + second + tail[ids]
+        return descriptions
+
+@functools.lru_cache(maxsize=None)
+def get_registry():
+    """Build the registry from the generators' template tables (once per process)"""
+    from augmentation import ACTIVITY_VARIATIONS
+    from demo import CORRECT_SEQUENCE, UNEXPECTED_ACTIONS
+    from incorrect_augmentation import AuditLogGenerator
+
+    registry = TemplateRegistry()
+    for activity_type, texts in ACTIVITY_VARIATIONS.items():
+        for text in texts:
+            registry.register(activity_type, text)
+    # The other generators' wordings are recognized but never sampled
+    for activity_type, text in CORRECT_SEQUENCE:
+        registry.register(activity_type, text, weight=0)
+    for activity_type, text in AuditLogGenerator().activity_templates():
+        registry.register(activity_type, text, weight=0)
+    for text in UNEXPECTED_ACTIONS:
+        registry.register('unexpected_action', text, weight=0)
+    return registry
+
+def render_descriptions(df, keep_template_columns=True):
+    """
+    Turn a frame carrying Template IDs and 'Param 1'/'Param 2' values into the
+    row format with a rendered Activity Description. With
+    keep_template_columns, Activity Type and Template (the template text) are
+    kept for columnar writers
+    """
+    import numpy as np
+    registry = get_registry()
+    template_ids = df['Template'].to_numpy(dtype=np.int64)
+    descriptions = registry.render(template_ids, df['Param 1'].to_numpy(dtype=object),
+                                   df['Param 2'].to_numpy(dtype=object))
+    df = df.drop(columns=['Param 1', 'Param 2']).assign(**{'Activity Description': descriptions})
+    columns = ['Date', 'Time', 'User', 'Activity Description', 'Reason for change', 'Anomaly']
+    if not keep_template_columns:
+        return df[columns]
+    activity_types = np.array(registry.activity_types, dtype=object)
+    texts = np.array([t.text for t in registry.templates], dtype=object)
+    df = df.assign(**{'Activity Type': activity_types[registry.activity_of_template[template_ids]],
+                      'Template': texts[template_ids]})
+    return df[columns + ['Activity Type', 'Template']]